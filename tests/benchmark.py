@@ -0,0 +1,197 @@
+from __future__ import print_function
+"""
+Helpers for benchmarks of virt-who hot paths.
+
+Benchmarks are ordinary test cases that are skipped unless the
+VIRTWHO_BENCHMARK environment variable is set, e.g.:
+
+    VIRTWHO_BENCHMARK=1 python -m pytest -s tests -k Benchmark
+
+Synthetic inventory for the fake backend can be written to a file too:
+
+    python tests/benchmark.py 100000 > inventory.json
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+from base import TestBase, unittest
+from virtwho.virt import Guest, Hypervisor
+
+
+BENCHMARK_ENV = 'VIRTWHO_BENCHMARK'
+
+# Numbers of guests used by benchmarks by default
+GUEST_COUNTS = (1000, 10000, 100000)
+GUESTS_PER_HOST = 20
+
+
+def generate_hypervisors(guest_count, guests_per_host=GUESTS_PER_HOST, virt_type='fake', prefix=''):
+    """
+    Create list of `Hypervisor` objects with `guest_count` guests in total.
+    """
+    hypervisors = []
+    host_count = max(1, guest_count // guests_per_host)
+    for host_index in range(host_count):
+        guests = [
+            Guest('%sguest-%d-%d' % (prefix, host_index, guest_index), virt_type,
+                  Guest.STATE_RUNNING)
+            for guest_index in range(guests_per_host)
+        ]
+        hypervisors.append(Hypervisor(
+            hypervisorId='%shost-%d' % (prefix, host_index),
+            guestIds=guests,
+            name='%shost-%d.example.com' % (prefix, host_index),
+            facts={
+                Hypervisor.CPU_SOCKET_FACT: '2',
+                Hypervisor.HYPERVISOR_TYPE_FACT: virt_type,
+            }
+        ))
+    return hypervisors
+
+
+def generate_inventory(host_count, guests_per_host=GUESTS_PER_HOST, facts=None, churn=0.0,
+                       seed=0, virt_type='fake'):
+    """
+    Create host/guest mapping in the format of the fake backend file.
+
+    @param facts: facts of every hypervisor, number of sockets and
+    hypervisor type by default
+    @type facts: dict
+    @param churn: fraction of guests (0.0 - 1.0) that have state changed,
+    compared to inventory without churn
+    @type churn: float
+    @param seed: seed of the random choice of changed guests, inventories
+    with different seeds differ
+    @type seed: int
+    """
+    if facts is None:
+        facts = {
+            Hypervisor.CPU_SOCKET_FACT: '2',
+            Hypervisor.HYPERVISOR_TYPE_FACT: virt_type,
+        }
+    guest_count = host_count * guests_per_host
+    changed = set(random.Random(seed).sample(range(guest_count), int(guest_count * churn)))
+    hypervisors = []
+    for host_index in range(host_count):
+        guests = []
+        for guest_index in range(guests_per_host):
+            running = host_index * guests_per_host + guest_index not in changed
+            guests.append({
+                'guestId': 'guest-%d-%d' % (host_index, guest_index),
+                'state': Guest.STATE_RUNNING if running else Guest.STATE_SHUTOFF,
+                'attributes': {
+                    'virtWhoType': virt_type,
+                    'active': 1 if running else 0,
+                },
+            })
+        hypervisors.append({
+            'uuid': 'host-%d' % host_index,
+            'name': 'host-%d.example.com' % host_index,
+            'facts': dict(facts),
+            'guests': guests,
+        })
+    return {'hypervisors': hypervisors}
+
+
+def write_inventory(path, *args, **kwargs):
+    """
+    Write inventory created by `generate_inventory` to file `path`.
+    """
+    with open(path, 'w') as f:
+        json.dump(generate_inventory(*args, **kwargs), f)
+
+
+def generate_esx_update_set(vm_count, vms_per_host=GUESTS_PER_HOST, version=1):
+    """
+    Create WaitForUpdatesEx response (as bytes) that enters `vm_count`
+    virtual machines, their hosts and one cluster, like the responses
+    in tests/complex/data/esx/.
+    """
+    def change(name, value, xsi_type='xsd:string', attributes=''):
+        return ('<changeSet><name>%s</name><op>assign</op>'
+                '<val%s xsi:type="%s">%s</val></changeSet>' % (name, attributes, xsi_type, value))
+
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+        'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        '<soapenv:Body><WaitForUpdatesExResponse xmlns="urn:vim25"><returnval>'
+        '<version>%d</version><filterSet>'
+        '<filter type="PropertyFilter">session[0]filter</filter>' % version
+    ]
+    for vm_index in range(vm_count):
+        parts.append(
+            '<objectSet><kind>enter</kind><obj type="VirtualMachine">vm-%d</obj>%s%s</objectSet>' % (
+                vm_index,
+                change('config.uuid', '00000000-0000-0000-0000-%012d' % vm_index),
+                change('runtime.powerState', 'poweredOn', 'VirtualMachinePowerState')))
+    host_count = max(1, (vm_count + vms_per_host - 1) // vms_per_host)
+    for host_index in range(host_count):
+        vms = ''.join(
+            '<ManagedObjectReference type="VirtualMachine" xsi:type="ManagedObjectReference">'
+            'vm-%d</ManagedObjectReference>' % vm_index
+            for vm_index in range(host_index * vms_per_host, min(vm_count, (host_index + 1) * vms_per_host)))
+        parts.append(
+            '<objectSet><kind>enter</kind><obj type="HostSystem">host-%d</obj>%s</objectSet>' % (
+                host_index, ''.join([
+                    change('hardware.systemInfo.uuid', 'host-uuid-%d' % host_index),
+                    change('hardware.cpuInfo.numCpuPackages', '2', 'xsd:short'),
+                    change('config.network.dnsConfig.hostName', 'host-%d' % host_index),
+                    change('config.network.dnsConfig.domainName', 'example.com'),
+                    change('name', 'host-%d.example.com' % host_index),
+                    change('parent', 'domain-c7', 'ManagedObjectReference',
+                           ' type="ClusterComputeResource"'),
+                    change('vm', vms, 'ArrayOfManagedObjectReference'),
+                ])))
+    parts.append(
+        '<objectSet><kind>enter</kind><obj type="ClusterComputeResource">domain-c7</obj>%s</objectSet>'
+        '</filterSet></returnval></WaitForUpdatesExResponse></soapenv:Body></soapenv:Envelope>' %
+        change('name', 'cluster'))
+    return ''.join(parts).encode('utf-8')
+
+
+@unittest.skipUnless(os.environ.get(BENCHMARK_ENV), 'set %s to run benchmarks' % BENCHMARK_ENV)
+class BenchmarkBase(TestBase):
+    """
+    Base class for benchmarks, results are printed to stderr.
+    """
+
+    @staticmethod
+    def measure(func, number=1, repeat=3):
+        """
+        Return the best time (in seconds) of one call of `func`.
+        """
+        return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+    def print_results(self, title, header, rows):
+        print('\n%s' % title, file=sys.stderr)
+        print(''.join('%20s' % column for column in header), file=sys.stderr)
+        for row in rows:
+            print(''.join('%20s' % (
+                '%.6f' % column if isinstance(column, float) else column
+            ) for column in row), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    guest_count = int(sys.argv[1]) if len(sys.argv) > 1 else GUEST_COUNTS[0]
+    churn = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    json.dump(generate_inventory(max(1, guest_count // GUESTS_PER_HOST), churn=churn), sys.stdout)
@@ -507,6 +507,24 @@ type=esx
         manager = DestinationToSourceMapper(init_config({}, {}, config_dir=self.config_dir))
         self.assertEqual(manager.dest_to_sources_map, expected_mapping)
 
+    def test_shard(self):
+        with open(os.path.join(self.config_dir, "test1.conf"), "w") as f:
+            for name in ['test3', 'test1', 'test4', 'test2']:
+                options = TestReadingConfigs.source_options_1.copy()
+                options['name'] = name
+                f.write(TestReadingConfigs.dict_to_ini(
+                    combine_dicts(options, TestReadingConfigs.dest_options_1)))
+
+        manager = DestinationToSourceMapper(init_config({}, {}, config_dir=self.config_dir))
+
+        def names(shards):
+            return [[name for name, config in shard] for shard in shards]
+
+        self.assertEqual(names(manager.shard(2)), [['test1', 'test3'], ['test2', 'test4']])
+        self.assertEqual(names(manager.shard(1)), [['test1', 'test2', 'test3', 'test4']])
+        # Empty shards are dropped
+        self.assertEqual(names(manager.shard(3, names=['test2', 'test4'])), [['test2'], ['test4']])
+
     def testLibvirtConfig(self):
         with open(os.path.join(self.config_dir, "test1.conf"), "w") as f:
             f.write("""
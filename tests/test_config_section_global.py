@@ -23,7 +23,8 @@ Test validating of GlobalSection.
 
 from base import TestBase
 
-from virtwho.config import GlobalSection, str_to_bool, MinimumSendInterval, DefaultInterval
+from virtwho.config import GlobalSection, str_to_bool, MinimumSendInterval, DefaultInterval, \
+    DefaultFullResyncInterval
 from virtwho.log import DEFAULT_LOG_DIR
 
 # Values used for testing GlobalConfigSection
@@ -138,6 +139,108 @@ class TestGlobalConfigSection(TestBase):
         interval = self.global_config['interval']
         self.assertIs(interval, DefaultInterval)
 
+    def test_validate_delta_reporting(self):
+        """
+        Test validation of delta reporting options
+        """
+        self.global_config.validate()
+        self.assertIs(self.global_config['delta_reporting'], False)
+        self.assertEqual(self.global_config['full_resync_interval'], DefaultFullResyncInterval)
+        self.global_config['delta_reporting'] = 'true'
+        self.global_config['full_resync_interval'] = '7200'
+        self.global_config.validate()
+        self.assertIs(self.global_config['delta_reporting'], True)
+        self.assertEqual(self.global_config['full_resync_interval'], 7200)
+
+    def test_validate_checkin_limits(self):
+        """
+        Test validation of maximum size of one check in
+        """
+        self.global_config['max_hypervisors_per_checkin'] = '500'
+        self.global_config['max_guests_per_checkin'] = 'many'
+        validate_messages = self.global_config.validate()
+        self.assertEqual(self.global_config['max_hypervisors_per_checkin'], 500)
+        self.assertEqual(self.global_config['max_guests_per_checkin'], 0)
+        self.assertTrue(any('max_guests_per_checkin' in message for level, message in validate_messages))
+
+    def test_validate_max_workers(self):
+        """
+        Test validation of number of worker threads
+        """
+        self.global_config.validate()
+        self.assertEqual(self.global_config['max_workers'], 0)
+        self.global_config['max_workers'] = '8'
+        self.global_config.validate()
+        self.assertEqual(self.global_config['max_workers'], 8)
+
+    def test_validate_persist_state(self):
+        """
+        Test validation of options of the state file
+        """
+        self.global_config.validate()
+        self.assertTrue(self.global_config['persist_state'])
+        self.assertEqual(self.global_config['state_file'], '/var/lib/virt-who/state.json')
+        self.global_config['persist_state'] = 'false'
+        self.global_config['state_file'] = '/tmp/virt-who-state.json'
+        self.global_config.validate()
+        self.assertFalse(self.global_config['persist_state'])
+        self.assertEqual(self.global_config['state_file'], '/tmp/virt-who-state.json')
+
+    def test_validate_stagger_options(self):
+        """
+        Test validation of options spreading the first polls
+        """
+        self.global_config.validate()
+        self.assertEqual(self.global_config['poll_splay'], 0)
+        self.assertEqual(self.global_config['max_concurrent_logins'], 0)
+        self.global_config['poll_splay'] = '600'
+        self.global_config['max_concurrent_logins'] = 'many'
+        result = self.global_config.validate()
+        self.assertEqual(self.global_config['poll_splay'], 600)
+        self.assertEqual(self.global_config['max_concurrent_logins'], 0)
+        self.assertIn('warning', [message[0] for message in result])
+
+    def test_validate_adaptive_interval(self):
+        """
+        Test validation of options of the adaptive interval
+        """
+        self.global_config.validate()
+        self.assertFalse(self.global_config['adaptive_interval'])
+        self.assertEqual(self.global_config['min_interval'], MinimumSendInterval)
+        self.assertEqual(self.global_config['max_interval'], 0)
+        self.global_config['adaptive_interval'] = 'true'
+        self.global_config['min_interval'] = '10'
+        self.global_config['max_interval'] = '14400'
+        result = self.global_config.validate()
+        self.assertTrue(self.global_config['adaptive_interval'])
+        self.assertEqual(self.global_config['min_interval'], MinimumSendInterval)
+        self.assertEqual(self.global_config['max_interval'], 14400)
+        self.assertIn('warning', [message[0] for message in result])
+
+    def test_validate_metrics_options(self):
+        """
+        Test validation of options of the metrics exporters
+        """
+        self.global_config.validate()
+        self.assertIsNone(self.global_config['metrics_listen'])
+        self.assertIsNone(self.global_config['metrics_file'])
+        self.global_config['metrics_listen'] = 'localhost:http'
+        self.global_config['metrics_file'] = '/var/lib/node_exporter/virt-who.prom'
+        result = self.global_config.validate()
+        self.assertIsNone(self.global_config['metrics_listen'])
+        self.assertEqual(self.global_config['metrics_file'], '/var/lib/node_exporter/virt-who.prom')
+        self.assertIn('warning', [message[0] for message in result])
+
+    def test_validate_wrong_full_resync_interval(self):
+        """
+        Test validation of wrong interval of full resync
+        """
+        for value in ('-1', 'daily'):
+            self.global_config['full_resync_interval'] = value
+            result = self.global_config._validate_non_negative_integer('full_resync_interval')
+            self.assertEqual(result[0], 'warning')
+            self.assertEqual(self.global_config['full_resync_interval'], DefaultFullResyncInterval)
+
     def test_validate_configs(self):
         """
         Test validation of configs (list of paths to config files)
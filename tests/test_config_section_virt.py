@@ -276,6 +276,68 @@ class TestVirtConfigSection(TestBase):
         result = self.virt_config._validate_filter('filter_hosts')
         self.assertIsNone(result)
 
+    def test_host_filter_compiled_at_validation(self):
+        """
+        Test that matchers of host filters are created during validation
+        """
+        self.init_virt_config_section()
+        self.assertIsNone(self.virt_config.host_filter('filter_hosts'))
+        self.virt_config.validate()
+        host_filter = self.virt_config.host_filter('filter_hosts')
+        self.assertEqual(host_filter.patterns, ('*.example.com',))
+        self.assertEqual(host_filter.filter_type, 'wildcards')
+        self.assertTrue(host_filter.match('host.example.com'))
+        self.assertFalse(host_filter.match('host.example.org'))
+        # The matcher is created only once
+        self.assertIs(self.virt_config.host_filter('filter_hosts'), host_filter)
+        # Option exclude_hosts is not set
+        self.assertIsNone(self.virt_config.host_filter('exclude_hosts'))
+
+    def test_host_filter_changed(self):
+        """
+        Test that matcher of host filter is recreated, when filter is changed
+        """
+        self.init_virt_config_section()
+        self.virt_config.validate()
+        host_filter = self.virt_config.host_filter('filter_hosts')
+        self.virt_config['filter_hosts'] = ['*.example.org']
+        self.virt_config.validate()
+        new_host_filter = self.virt_config.host_filter('filter_hosts')
+        self.assertIsNot(new_host_filter, host_filter)
+        self.assertTrue(new_host_filter.match('host.example.org'))
+
+    def test_validate_invalid_regex_filter(self):
+        """
+        Test validation of host filter with invalid regular expression
+        """
+        self.init_virt_config_section()
+        self.virt_config['filter_type'] = 'regex'
+        self.virt_config['filter_hosts'] = ['host-[0-9]+', 'host-(']
+        result = self.virt_config._validate_filter('filter_hosts')
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0][0], 'error')
+        self.assertIn('host-(', result[0][1])
+
+    def test_validate_invalid_regex_filter_without_filter_type(self):
+        """
+        Test validation of host filter with invalid regular expression,
+        when filter_type is not set (wildcards could be used)
+        """
+        self.init_virt_config_section()
+        del self.virt_config['filter_type']
+        self.virt_config['filter_hosts'] = ['host-(']
+        result = self.virt_config._validate_filter('filter_hosts')
+        self.assertEqual([level for level, message in result], ['warning', 'warning'])
+
+    def test_validate_invalid_wildcards_filter(self):
+        """
+        Test validation of host filter with wildcards, that are not valid regular expressions
+        """
+        self.init_virt_config_section()
+        self.virt_config['filter_hosts'] = ['*.example.com', 'host-(']
+        result = self.virt_config._validate_filter('filter_hosts')
+        self.assertIsNone(result)
+
     def test_validate_missing_filter_type(self):
         """
         Test validation of missing filter type
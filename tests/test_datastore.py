@@ -1,8 +1,11 @@
 from __future__ import print_function
+import time
 from base import TestBase
-from mock import sentinel, patch, MagicMock
-from threading import Lock
+from benchmark import BenchmarkBase, generate_hypervisors, GUEST_COUNTS
+from mock import sentinel, patch, MagicMock, Mock
+from threading import Lock, Thread
 from virtwho.datastore import Datastore
+from virtwho.virt import HostGuestAssociationReport
 
 
 class TestDatastore(TestBase):
@@ -140,3 +143,121 @@ class TestDatastore(TestBase):
         expected_value = sentinel.deep_copy_value_1
         mock_internal_ds.__setitem__.assert_called_with(test_key,
                                                         expected_value)
+
+    def test_put_frozen_value_is_not_copied(self):
+        # Frozen values are immutable, only the reference is stored
+        datastore = Datastore()
+        frozen_value = Mock()
+        frozen_value.frozen = True
+        datastore.put("test_item", frozen_value)
+        self.mock_copy.deepcopy.assert_not_called()
+        self.assertIs(datastore.get("test_item"), frozen_value)
+
+    def test_remove(self):
+        datastore = Datastore()
+        datastore.put("test_item", Mock(frozen=True))
+        datastore.remove("test_item")
+        self.assertRaises(KeyError, datastore.get, "test_item")
+        # Removing missing item is not an error
+        datastore.remove("test_item")
+
+    def test_remove_then_put(self):
+        # Value stored again after it was removed is reported as a change
+        datastore = Datastore()
+        datastore.put('a', Mock(frozen=True))
+        since = datastore.generations(['a'])
+        datastore.remove('a')
+        datastore.put('a', Mock(frozen=True))
+        self.assertEqual(datastore.wait_for_change(['a'], timeout=0, since=since), {'a': 3})
+        self.assertEqual(datastore.wait_for_change(['a'], timeout=0, since={'a': 1}), {'a': 3})
+
+    def test_put_increases_generation(self):
+        datastore = Datastore()
+        self.assertEqual(datastore.generations(['a', 'b']), {'a': 0, 'b': 0})
+        datastore.put('a', 'value')
+        datastore.put('a', 'value')
+        self.assertEqual(datastore.generations(['a', 'b']), {'a': 2, 'b': 0})
+
+    def test_wait_for_change_timeout(self):
+        datastore = Datastore()
+        datastore.put('b', 'value')
+        self.assertEqual(datastore.wait_for_change(['a'], timeout=0.01), {})
+
+    def test_wait_for_change_since(self):
+        # Changes made before the call are reported when the caller has
+        # seen older generations
+        datastore = Datastore()
+        since = datastore.generations(['a', 'b'])
+        datastore.put('a', 'value')
+        self.assertEqual(datastore.wait_for_change(['a', 'b'], timeout=0, since=since), {'a': 1})
+
+    def test_wait_for_change_wakes_on_put(self):
+        self.mock_copy.deepcopy.side_effect = lambda x: x
+        datastore = Datastore()
+        result = {}
+
+        def wait():
+            result.update(datastore.wait_for_change(['a'], timeout=10, since={'a': 0}))
+
+        thread = Thread(target=wait)
+        thread.start()
+        datastore.put('a', 'value')
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result, {'a': 1})
+
+    def test_interrupt(self):
+        datastore = Datastore()
+        thread = Thread(target=datastore.wait_for_change, args=(['a'],))
+        thread.start()
+        while thread.is_alive():
+            datastore.interrupt()
+            thread.join(0.1)
+        self.assertFalse(thread.is_alive())
+
+    def test_interrupt_waiter(self):
+        # Only the waiter that is interrupted stops waiting
+        datastore = Datastore()
+        waiters = [Mock(), Mock()]
+        results = {}
+
+        def wait(waiter):
+            results[waiter] = datastore.wait_for_change(['a'], timeout=0.5, waiter=waiter)
+
+        threads = [Thread(target=wait, args=(waiter,)) for waiter in waiters]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        datastore.interrupt(waiters[0])
+        threads[0].join(5)
+        self.assertFalse(threads[0].is_alive())
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(threads[1].is_alive())
+        threads[1].join(5)
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        self.assertEqual(results, {waiters[0]: {}, waiters[1]: {}})
+
+    def test_interrupt_waiter_before_wait(self):
+        # Waiter interrupted before it starts waiting doesn't block
+        datastore = Datastore()
+        waiter = Mock()
+        datastore.interrupt(waiter)
+        self.assertEqual(datastore.wait_for_change(['a'], waiter=waiter), {})
+
+
+class TestDatastoreBenchmark(BenchmarkBase):
+
+    def test_put_get(self):
+        config, d = self.create_fake_config('test')
+        rows = []
+        for guest_count in GUEST_COUNTS:
+            hypervisors = generate_hypervisors(guest_count)
+            datastore = Datastore()
+            report = HostGuestAssociationReport(config, {'hypervisors': hypervisors})
+            put_copy = self.measure(lambda: datastore.put('source', report))
+            frozen_report = HostGuestAssociationReport(config, {'hypervisors': hypervisors}).freeze()
+            put_frozen = self.measure(lambda: datastore.put('source', frozen_report), number=1000)
+            get = self.measure(lambda: datastore.get('source'), number=1000)
+            rows.append((guest_count, put_copy, put_frozen, get))
+        self.print_results('Datastore put/get (seconds per call)',
+                           ('guests', 'put (deepcopy)', 'put (frozen)', 'get'), rows)
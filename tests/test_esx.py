@@ -20,20 +20,37 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import gzip
+import io
 import os
+import sys
+import time
 import requests
 import suds
+from collections import defaultdict
 from mock import patch, ANY, MagicMock, Mock
-from threading import Event
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from threading import Event, Thread
+from xml.etree import ElementTree
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 from base import TestBase
-from virtwho import DefaultInterval
+from benchmark import BenchmarkBase, GUEST_COUNTS, generate_esx_update_set
+from virtwho import DefaultInterval, metrics
 from virtwho.datastore import Datastore
 from virtwho.virt.esx import Esx
 from virtwho.virt import VirtError, Guest, Hypervisor, HostGuestAssociationReport
 from proxy import Proxy
 
-from virtwho.virt.esx.esx import EsxConfigSection
+from requests.packages.urllib3.exceptions import ProtocolError, ReadTimeoutError
+from virtwho.virt.esx.esx import EsxConfigSection, RequestsTransport, ResponseStream, create_client, \
+    clear_client_cache
+from virtwho.virt.esx.updates import parse_update_set, wait_for_updates_request, SoapFault, \
+    UpdateSetParseError, ManagedObjectReference
 
 
 class TestEsx(TestBase):
@@ -63,7 +80,7 @@ class TestEsx(TestBase):
         self.esx._interval = 0
         self.esx._run()
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_connect(self, mock_client):
         mock_client.return_value.service.WaitForUpdatesEx.return_value = None
         self.run_once()
@@ -73,7 +90,7 @@ class TestEsx(TestBase):
         mock_client.return_value.service.RetrieveServiceContent.assert_called_once_with(_this=ANY)
         mock_client.return_value.service.Login.assert_called_once_with(_this=ANY, userName='username', password='password')
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_connect_utf_password(self, mock_client):
         mock_client.return_value.service.WaitForUpdatesEx.return_value = None
         # Change password to include some UTF character
@@ -87,17 +104,17 @@ class TestEsx(TestBase):
             _this=ANY, userName='username', password=u'Žluťoučký_kůň'
         )
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_connection_timeout(self, mock_client):
         mock_client.side_effect = requests.Timeout('timed out')
         self.assertRaises(VirtError, self.run_once)
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_invalid_login(self, mock_client):
         mock_client.return_value.service.Login.side_effect = suds.WebFault('Permission to perform this operation was denied.', '')
         self.assertRaises(VirtError, self.run_once)
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_disable_simplified_vim(self, mock_client):
         self.esx.config.simplified_vim = False
         mock_client.return_value.service.RetrievePropertiesEx.return_value = None
@@ -110,7 +127,7 @@ class TestEsx(TestBase):
         mock_client.return_value.service.RetrieveServiceContent.assert_called_once_with(_this=ANY)
         mock_client.return_value.service.Login.assert_called_once_with(_this=ANY, userName='username', password='password')
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_getHostGuestMapping(self, mock_client):
         expected_hostname = 'hostname.domainname'
         expected_hypervisorId = 'Fake_uuid'
@@ -165,7 +182,7 @@ class TestEsx(TestBase):
         result = self.esx.getHostGuestMapping()['hypervisors'][0]
         self.assertEqual(expected_result.toDict(), result.toDict())
 
-    @patch('suds.client.Client')
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_getHostGuestMapping_incomplete_data(self, mock_client):
         expected_hostname = 'hostname.domainname'
         expected_hypervisorId = 'Fake_uuid'
@@ -219,9 +236,96 @@ class TestEsx(TestBase):
         result = self.esx.getHostGuestMapping()['hypervisors'][0]
         self.assertEqual(expected_result.toDict(), result.toDict())
 
-    @patch('suds.client.Client')
+    def test_getHostGuestMapping_host_parents(self):
+        self.esx.vms = {}
+        self.esx.clusters = {}
+        self.esx.hosts = {}
+        for host_index, parent_id in enumerate(['domain-c7', 'domain-c8', 'domain-s9']):
+            fake_parent = MagicMock()
+            fake_parent.value = parent_id
+            fake_parent._type = 'ClusterComputeResource'
+            self.esx.hosts['host-%d' % host_index] = {
+                'hardware.systemInfo.uuid': 'uuid-%d' % host_index,
+                'hardware.cpuInfo.numCpuPackages': '1',
+                'parent': fake_parent,
+                'vm': MagicMock(ManagedObjectReference=[]),
+            }
+            self.esx.clusters[parent_id] = {'name': 'cluster-%d' % host_index}
+
+        def hypervisor_ids():
+            return sorted(h.hypervisorId for h in self.esx.getHostGuestMapping()['hypervisors'])
+
+        self.esx.config['exclude_host_parents'] = 'domain-c7'
+        self.esx.config.validate()
+        self.assertEqual(hypervisor_ids(), ['uuid-1', 'uuid-2'])
+
+        self.esx.config['filter_host_parents'] = 'domain-c*'
+        self.esx.config.validate()
+        self.assertEqual(hypervisor_ids(), ['uuid-1'])
+
+    def _fake_inventory(self, host_count=2):
+        self.esx.vms = {}
+        self.esx.clusters = {'domain-c7': {'name': 'cluster'}}
+        self.esx.hosts = {}
+        for host_index in range(host_count):
+            fake_parent = MagicMock(value='domain-c7', _type='ClusterComputeResource')
+            vm_ids = [MagicMock(value='vm-%d' % host_index)]
+            self.esx.vms['vm-%d' % host_index] = {
+                'config.uuid': 'guest-%d' % host_index,
+                'runtime.powerState': 'poweredOn',
+            }
+            self.esx.hosts['host-%d' % host_index] = {
+                'hardware.systemInfo.uuid': 'uuid-%d' % host_index,
+                'hardware.cpuInfo.numCpuPackages': '1',
+                'parent': fake_parent,
+                'vm': MagicMock(ManagedObjectReference=vm_ids),
+            }
+
+    def _hypervisors(self):
+        return dict((h.hypervisorId, h) for h in self.esx.getHostGuestMapping()['hypervisors'])
+
+    def test_getHostGuestMapping_reuses_unchanged_hosts(self):
+        self._fake_inventory()
+        first = self._hypervisors()
+
+        change = Mock(spec=['op', 'name', 'val'], op='assign', val='poweredOff')
+        change.name = 'runtime.powerState'
+        objectSet = Mock(kind='modify', changeSet=[change])
+        objectSet.obj.value = 'vm-1'
+        self.esx.applyVirtualMachineUpdate(objectSet)
+
+        second = self._hypervisors()
+        # Host of the changed guest is built again, the other one is reused
+        self.assertIs(second['uuid-0'], first['uuid-0'])
+        self.assertIsNot(second['uuid-1'], first['uuid-1'])
+        self.assertEqual(second['uuid-1'].guestIds[0].state, Guest.STATE_SHUTOFF)
+
+    def test_getHostGuestMapping_cluster_update(self):
+        self._fake_inventory()
+        first = self._hypervisors()
+
+        change = Mock(spec=['op', 'name', 'val'], op='assign', val='renamed')
+        change.name = 'name'
+        objectSet = Mock(kind='enter', changeSet=[change])
+        objectSet.obj.value = 'domain-c7'
+        self.esx.applyClusterComputeResource(objectSet)
+
+        second = self._hypervisors()
+        for hypervisor_id, hypervisor in second.items():
+            self.assertIsNot(hypervisor, first[hypervisor_id])
+            self.assertEqual(hypervisor.facts[Hypervisor.HYPERVISOR_CLUSTER], 'renamed')
+
+    def test_getHostGuestMapping_host_leave(self):
+        self._fake_inventory()
+        self._hypervisors()
+        objectSet = Mock(kind='leave')
+        objectSet.obj.value = 'host-0'
+        self.esx.applyHostSystemUpdate(objectSet)
+        self.assertEqual(list(self._hypervisors()), ['uuid-1'])
+
+    @patch('virtwho.virt.esx.esx.create_client')
     def test_oneshot(self, mock_client):
-        expected_assoc = '"well formed HostGuestMapping"'
+        expected_assoc = {'hypervisors': [Hypervisor('hypervisor_id', [])]}
         expected_report = HostGuestAssociationReport(self.esx.config, expected_assoc)
         updateSet = Mock()
         updateSet.version = 'some_new_version_string'
@@ -236,7 +340,132 @@ class TestEsx(TestBase):
         result_report = datastore.get(self.esx.config.name)
         self.assertEqual(expected_report.config.name, result_report.config.name)
         self.assertEqual(expected_report.config._values, result_report.config._values)
-        self.assertEqual(expected_report._assoc, result_report._assoc)
+        self.assertEqual(expected_report.association, result_report.association)
+
+    @patch('virtwho.virt.esx.esx.create_client')
+    def test_truncated_update_set(self, mock_client):
+        self.esx.config['max_object_updates'] = '100'
+        self.esx.config.validate()
+        pages = []
+        for version, truncated in (('1_1', True), ('1_2', True), ('1', False)):
+            updateSet = Mock()
+            updateSet.version = version
+            updateSet.truncated = truncated
+            updateSet.filterSet = [Mock(objectSet=[Mock(), Mock()])]
+            pages.append(updateSet)
+        wait = mock_client.return_value.service.WaitForUpdatesEx
+        wait.side_effect = pages
+        self.esx.applyUpdates = Mock(side_effect=lambda updateSet: setattr(
+            self.esx, 'object_updates', self.esx.object_updates + 2))
+        self.esx.getHostGuestMapping = Mock(return_value={'hypervisors': []})
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+        self.run_once()
+        # Whole update set is gathered before the report is sent
+        self.esx.getHostGuestMapping.assert_called_once_with()
+        self.assertEqual([kwargs['version'] for args, kwargs in wait.call_args_list], ['', '1_1', '1_2'])
+        for args, kwargs in wait.call_args_list:
+            self.assertEqual(kwargs['options'], {'maxObjectUpdates': 100})
+        self.assertEqual(metrics.ESX_UPDATE_PAGES.get(config='test'), 3)
+        self.assertEqual(metrics.ESX_UPDATE_OBJECTS.get(config='test'), 6)
+
+    def run_updates(self, responses):
+        """
+        Run ESX in oneshot mode, WaitForUpdatesEx returns (or raises)
+        `responses`. Return versions used in the calls.
+        """
+        self.esx._prepare = Mock()
+        self.esx.client = Mock()
+        self.esx.sc = Mock()
+        wait = self.esx.client.service.WaitForUpdatesEx
+        wait.side_effect = responses
+        self.esx.applyUpdates = Mock()
+        self.esx.getHostGuestMapping = Mock(return_value={'hypervisors': []})
+        self.run_once()
+        return [kwargs['version'] for args, kwargs in wait.call_args_list]
+
+    @staticmethod
+    def update_set(version, truncated=False):
+        return Mock(version=version, truncated=truncated)
+
+    def test_resume_after_timeout(self):
+        versions = self.run_updates([self.update_set('1_1', True), requests.exceptions.Timeout(),
+                                     self.update_set('1')])
+        # Update set continues from the last known version, without login
+        self.assertEqual(versions, ['', '1_1', '1_1'])
+        self.esx._prepare.assert_called_once_with()
+        self.assertEqual(self.esx.applyUpdates.call_count, 2)
+
+    def test_resume_after_fault(self):
+        fault = SoapFault(Mock(faultstring='Unexpected error', detail=None))
+        versions = self.run_updates([self.update_set('1_1', True), fault, fault, fault, fault,
+                                     self.update_set('1')])
+        # Complete inventory is requested after MAX_RESUME_ATTEMPTS failures
+        self.assertEqual(versions, ['', '1_1', '1_1', '1_1', '1_1', ''])
+        self.assertEqual(self.esx._prepare.call_count, 2)
+
+    def test_invalid_version(self):
+        fault = suds.WebFault(Mock(faultstring='InvalidCollectorVersion',
+                                   detail=Mock(spec=['InvalidCollectorVersionFault'])), None)
+        versions = self.run_updates([self.update_set('1_1', True), fault, self.update_set('2')])
+        # Whole inventory is requested, but the session and filter are kept
+        self.assertEqual(versions, ['', '1_1', ''])
+        self.esx._prepare.assert_called_once_with()
+
+    def test_not_authenticated(self):
+        fault = suds.WebFault(Mock(faultstring='The session is not authenticated.', detail=None), None)
+        versions = self.run_updates([self.update_set('1_1', True), fault, self.update_set('2')])
+        self.assertEqual(versions, ['', '1_1', ''])
+        self.assertEqual(self.esx._prepare.call_count, 2)
+
+    @staticmethod
+    def response(data, error=None):
+        """
+        Streamed response with body `data`, `error` is raised when
+        the body is read.
+        """
+        source = io.BytesIO(data)
+
+        def read(size=None):
+            chunk = source.read(size)
+            if not chunk and error is not None:
+                raise error
+            return chunk
+        resp = Mock()
+        resp.raw.read.side_effect = read
+        return resp
+
+    def test_resume_after_broken_stream(self):
+        self.esx.config['stream_updates'] = True
+        self.esx._prepare = Mock()
+        self.esx.client = Mock()
+        self.esx.sc = Mock()
+        self.esx.sc.propertyCollector = ManagedObjectReference('propertyCollector', 'PropertyCollector')
+        self.esx.applyUpdates = Mock()
+        self.esx.getHostGuestMapping = Mock(return_value={'hypervisors': []})
+        first = generate_esx_update_set(1).replace(b'</version>', b'</version><truncated>true</truncated>')
+        last = generate_esx_update_set(1, version=2)
+        responses = [
+            self.response(first),
+            self.response(last[:200], ReadTimeoutError(None, None, 'Read timed out.')),
+            self.response(last[:200], ProtocolError('Connection broken', None)),
+            self.response(last),
+        ]
+        transport = RequestsTransport()
+        self.esx.transport = Mock()
+        self.esx.transport.post_stream.side_effect = [ResponseStream(transport, resp, 0) for resp in responses]
+        self.run_once()
+        versions = [ElementTree.fromstring(args[1]).find('.//{urn:vim25}version').text or ''
+                    for args, kwargs in self.esx.transport.post_stream.call_args_list]
+        # Broken responses are requested again from the last known version, without login
+        self.assertEqual(versions, ['', '1', '1', '1'])
+        self.esx._prepare.assert_called_once_with()
+        self.assertEqual(self.esx.applyUpdates.call_count, 2)
+        # Wait is canceled after each broken response and in cleanup
+        self.assertEqual(self.esx.client.service.CancelWaitForUpdates.call_count, 3)
+        for resp in responses[1:3]:
+            resp.close.assert_called_once_with()
+            resp.raw.release_conn.assert_not_called()
 
     def test_proxy(self):
         self.esx.config['simplified_vim'] = True
@@ -392,3 +621,308 @@ class TestEsx(TestBase):
 
         expected = dict()
         self.assertDictEqual(self.esx.vms[objectSet.obj.value], expected)
+
+
+ESX_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'complex', 'data', 'esx')
+
+FAULT_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <soapenv:Fault>
+      <faultcode>ServerFaultCode</faultcode>
+      <faultstring>The session is not authenticated.</faultstring>
+    </soapenv:Fault>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+def minimal_wsdl():
+    directory = os.path.dirname(os.path.abspath(sys.modules[Esx.__module__].__file__))
+    return 'file://%s/vimServiceMinimal.wsdl' % directory
+
+
+def suds_client():
+    return suds.client.Client(minimal_wsdl(), location='https://localhost/sdk', transport=RequestsTransport(),
+                              cache=None)
+
+
+def suds_update_set(client, data):
+    """
+    Parse WaitForUpdatesEx response `data` by suds.
+    """
+    property_collector = suds.sudsobject.Property('propertyCollector')
+    property_collector._type = 'PropertyCollector'
+    return client.service.WaitForUpdatesEx(_this=property_collector, version='', options={},
+                                           __inject={'reply': data})
+
+
+class TestUpdateSetParser(TestBase):
+    def setUp(self):
+        config = EsxConfigSection('test', None)
+        config.update(type='esx', server='localhost', username='username', password='password',
+                      owner='owner', env='env')
+        config.validate()
+        self.config = config
+
+    @staticmethod
+    def normalize(value):
+        if isinstance(value, int):
+            return value
+        if not value:
+            # Empty array is empty string in suds
+            return None
+        if hasattr(value, 'ManagedObjectReference'):
+            return [TestUpdateSetParser.normalize(reference) for reference in value.ManagedObjectReference]
+        if hasattr(value, '_type'):
+            return (str(value.value), value._type)
+        return str(value)
+
+    def applied(self, update_set):
+        """
+        Return properties of the objects after `update_set` is applied.
+        """
+        esx = Esx(self.logger, self.config, None, interval=DefaultInterval)
+        esx.hosts = defaultdict(dict)
+        esx.vms = defaultdict(dict)
+        esx.clusters = defaultdict(dict)
+        esx.applyUpdates(update_set)
+        return [dict((object_id, dict((name, self.normalize(value)) for name, value in properties.items()))
+                     for object_id, properties in items.items())
+                for items in (esx.hosts, esx.vms, esx.clusters)]
+
+    def test_same_as_suds(self):
+        client = suds_client()
+        for name in ('esx_waitforupdatesexresponse_0.xml', 'esx_waitforupdatesexresponse_1.xml'):
+            with open(os.path.join(ESX_DATA_DIR, name), 'rb') as f:
+                data = f.read()
+            expected = suds_update_set(client, data)
+            update_set = parse_update_set(io.BytesIO(data), set(Esx.VM_PROPERTIES + Esx.HOST_PROPERTIES +
+                                                                Esx.CLUSTER_PROPERTIES))
+            self.assertEqual(update_set.version, expected.version)
+            self.assertEqual(self.applied(update_set), self.applied(expected))
+
+    def test_properties(self):
+        data = generate_esx_update_set(2, version=7)
+        update_set = parse_update_set(io.BytesIO(data), set(['config.uuid']))
+        self.assertEqual(update_set.version, '7')
+        self.assertFalse(update_set.truncated)
+        vm, host = update_set.filterSet[0].objectSet[0], update_set.filterSet[0].objectSet[2]
+        self.assertEqual(vm.kind, 'enter')
+        self.assertEqual((vm.obj.value, vm.obj._type), ('vm-0', 'VirtualMachine'))
+        self.assertEqual([change.name for change in vm.changeSet], ['config.uuid'])
+        self.assertEqual(host.changeSet, [])
+
+        update_set = parse_update_set(io.BytesIO(data))
+        host = update_set.filterSet[0].objectSet[2]
+        changes = dict((change.name, change.val) for change in host.changeSet)
+        self.assertEqual(changes['hardware.cpuInfo.numCpuPackages'], 2)
+        self.assertEqual(changes['parent']._type, 'ClusterComputeResource')
+        self.assertEqual([vm.value for vm in changes['vm'].ManagedObjectReference], ['vm-0', 'vm-1'])
+
+    def test_fault(self):
+        with self.assertRaises(SoapFault) as context:
+            parse_update_set(io.BytesIO(FAULT_RESPONSE))
+        self.assertEqual(context.exception.fault.faultstring, 'The session is not authenticated.')
+        self.assertIsNone(context.exception.fault.detail)
+
+    def test_fault_detail(self):
+        data = FAULT_RESPONSE.replace(b'</faultstring>', b'</faultstring><detail>'
+                                      b'<InvalidCollectorVersionFault xmlns="urn:vim25"/></detail>')
+        with self.assertRaises(SoapFault) as context:
+            parse_update_set(io.BytesIO(data))
+        self.assertTrue(Esx._is_invalid_version_fault(context.exception))
+
+    def test_invalid(self):
+        self.assertRaises(UpdateSetParseError, parse_update_set, io.BytesIO(b'<html><body>'))
+        self.assertRaises(UpdateSetParseError, parse_update_set, io.BytesIO(b'<html></html>'))
+
+    def test_request(self):
+        data = wait_for_updates_request(ManagedObjectReference('propertyCollector', 'PropertyCollector'),
+                                        '3&4', 60, 1000)
+        request = ElementTree.fromstring(data)
+        body = request.find('{http://schemas.xmlsoap.org/soap/envelope/}Body')[0]
+        self.assertEqual(body.tag, '{urn:vim25}WaitForUpdatesEx')
+        self.assertEqual(body.find('{urn:vim25}_this').get('type'), 'PropertyCollector')
+        self.assertEqual(body.find('{urn:vim25}version').text, '3&4')
+        self.assertEqual(body.find('{urn:vim25}options/{urn:vim25}maxWaitSeconds').text, '60')
+        self.assertEqual(body.find('{urn:vim25}options/{urn:vim25}maxObjectUpdates').text, '1000')
+
+    def test_wait_for_updates(self):
+        self.config['stream_updates'] = True
+        self.config.validate()
+        esx = Esx(self.logger, self.config, None, interval=DefaultInterval)
+        esx.client = Mock()
+        esx.client.service.WaitForUpdatesEx.method.soap.action = '"urn:vim25/5.0"'
+        esx.sc = Mock()
+        esx.sc.propertyCollector = ManagedObjectReference('propertyCollector', 'PropertyCollector')
+        esx.transport = MagicMock()
+        stream = esx.transport.post_stream.return_value
+        stream.__enter__.return_value = io.BytesIO(generate_esx_update_set(1))
+        update_set = esx.waitForUpdates('', {'maxWaitSeconds': 10})
+        self.assertEqual(len(update_set.filterSet[0].objectSet), 3)
+        esx.transport.post_stream.assert_called_once_with('https://localhost/sdk', ANY, ANY)
+        stream.__exit__.assert_called_once_with(None, None, None)
+        esx.client.service.WaitForUpdatesEx.assert_not_called()
+
+
+
+class SoapHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.requests.append((self.client_address, self.headers.get('Accept-Encoding')))
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip_compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SoapServer(ThreadingMixIn, HTTPServer):
+    # Kept-alive connections must not block the server
+    daemon_threads = True
+
+
+def gzip_compress(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class TestRequestsTransport(TestBase):
+    def setUp(self):
+        self.server = SoapServer(('127.0.0.1', 0), SoapHandler)
+        self.server.requests = []
+        self.server.body = generate_esx_update_set(100)
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/sdk' % self.server.server_address[1]
+        self.name = 'transport-%s' % self.id()
+
+    def test_session_options(self):
+        transport = RequestsTransport(pool_size=3, compression=False)
+        adapter = transport._session.get_adapter('https://esx/sdk')
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertFalse(transport._session.verify)
+        self.assertEqual(transport._session.headers['Accept-Encoding'], 'identity')
+
+    def test_compression(self):
+        transport = RequestsTransport(name=self.name)
+        message = wait_for_updates_request(ManagedObjectReference('propertyCollector', 'PropertyCollector'), '')
+        expected = parse_update_set(io.BytesIO(self.server.body))
+        for _ in range(2):
+            with transport.post_stream(self.url, message, {}) as stream:
+                update_set = parse_update_set(stream)
+            self.assertEqual(len(update_set.filterSet[0].objectSet), len(expected.filterSet[0].objectSet))
+        # Both requests use the same connection
+        self.assertEqual([encoding for _, encoding in self.server.requests], ['gzip', 'gzip'])
+        self.assertEqual(self.server.requests[0][0], self.server.requests[1][0])
+        compressed = len(gzip_compress(self.server.body))
+        self.assertEqual(metrics.ESX_REQUEST_BYTES.get(config=self.name), 2 * len(message))
+        self.assertEqual(metrics.ESX_RESPONSE_BYTES.get(config=self.name), 2 * compressed)
+        self.assertEqual(metrics.ESX_RESPONSE_DECODED_BYTES.get(config=self.name), 2 * len(self.server.body))
+        self.assertLess(compressed, len(self.server.body))
+
+    def test_no_compression(self):
+        transport = RequestsTransport(compression=False, name=self.name)
+        reply = transport.send(suds.transport.Request(self.url, b'<request/>'))
+        self.assertEqual(reply.message, self.server.body)
+        self.assertEqual(self.server.requests[0][1], 'identity')
+        self.assertEqual(metrics.ESX_REQUEST_BYTES.get(config=self.name), len(b'<request/>'))
+        self.assertEqual(metrics.ESX_RESPONSE_BYTES.get(config=self.name), len(self.server.body))
+        self.assertEqual(metrics.ESX_RESPONSE_DECODED_BYTES.get(config=self.name), len(self.server.body))
+
+
+class TestClientCache(TestBase):
+    def setUp(self):
+        clear_client_cache()
+        self.addCleanup(clear_client_cache)
+
+    def test_shared_wsdl(self):
+        with patch('suds.client.Client', side_effect=suds.client.Client) as client_class:
+            clients = [create_client(minimal_wsdl(), transport=RequestsTransport(), cache=None,
+                                     location='https://esx%d/sdk' % index) for index in range(2)]
+        # WSDL is parsed only once
+        client_class.assert_called_once_with(minimal_wsdl(), transport=ANY, cache=None,
+                                             location='https://esx0/sdk')
+        self.assertIs(clients[0].wsdl, clients[1].wsdl)
+        self.assertIsNot(clients[0].options.transport, clients[1].options.transport)
+        self.assertEqual(clients[1].options.location, 'https://esx1/sdk')
+        clients[1].set_options(timeout=10)
+        self.assertEqual(clients[1].options.transport.options.timeout, 10)
+        self.assertNotEqual(clients[0].options.transport.options.timeout, 10)
+
+        with open(os.path.join(ESX_DATA_DIR, 'esx_waitforupdatesexresponse_0.xml'), 'rb') as f:
+            update_set = suds_update_set(clients[1], f.read())
+        self.assertEqual(update_set.version, '1')
+
+    def test_failed_parsing(self):
+        with patch('suds.client.Client', side_effect=requests.Timeout('timed out')):
+            self.assertRaises(requests.Timeout, create_client, minimal_wsdl(), transport=RequestsTransport())
+        # Failure is not cached
+        self.assertIsNotNone(create_client(minimal_wsdl(), transport=RequestsTransport(), cache=None))
+
+
+class TestClientBenchmark(BenchmarkBase):
+    CLIENT_COUNT = 100
+
+    def test_create_client(self):
+        def parse():
+            for index in range(self.CLIENT_COUNT):
+                suds.client.Client(minimal_wsdl(), transport=RequestsTransport(), cache=None)
+
+        def cached():
+            clear_client_cache()
+            for index in range(self.CLIENT_COUNT):
+                create_client(minimal_wsdl(), transport=RequestsTransport(), cache=None)
+        self.addCleanup(clear_client_cache)
+        self.print_results(
+            'Creating %d clients of simplified vim WSDL' % self.CLIENT_COUNT,
+            ('method', 'time [s]'),
+            [('parse every time', self.measure(parse)), ('shared WSDL', self.measure(cached))])
+
+
+class TestUpdateSetBenchmark(BenchmarkBase):
+    def measure_parser(self, func):
+        """
+        Return time of `func` call and peak memory (in kB) it allocated.
+        """
+        start = time.time()
+        if tracemalloc is None:
+            func()
+            return time.time() - start, None
+        tracemalloc.start()
+        try:
+            func()
+            duration = time.time() - start
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return duration, peak // 1024
+
+    def test_parser(self):
+        client = suds_client()
+        properties = set(Esx.VM_PROPERTIES + Esx.HOST_PROPERTIES + Esx.CLUSTER_PROPERTIES)
+        rows = []
+        for vm_count in GUEST_COUNTS[:2] + (30000,):
+            data = generate_esx_update_set(vm_count)
+            suds_time, suds_peak = self.measure_parser(lambda: suds_update_set(client, data))
+            stream_time, stream_peak = self.measure_parser(
+                lambda: parse_update_set(io.BytesIO(data), properties))
+            rows.append((vm_count, len(data) // 1024, suds_time, suds_peak, stream_time, stream_peak))
+        self.print_results(
+            'Parsing of WaitForUpdatesEx response',
+            ('VMs', 'response [kB]', 'suds [s]', 'suds peak [kB]', 'stream [s]', 'stream peak [kB]'),
+            rows)
@@ -19,15 +19,28 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import json
 import os
 import logging
+import time
 from tempfile import mkdtemp
 import shutil
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    from time import process_time
+except ImportError:
+    # Python 2, CPU time on unix
+    from time import clock as process_time
 
-from base import TestBase
+from base import TestBase, unittest
+from benchmark import BenchmarkBase, GUEST_COUNTS, GUESTS_PER_HOST, write_inventory
 
-from virtwho.config import DestinationToSourceMapper, init_config
-from virtwho.virt import Virt, Hypervisor, VirtError
+from virtwho.config import DestinationToSourceMapper, init_config, VW_GLOBAL
+from virtwho.datastore import Datastore
+from virtwho.virt import Virt, Hypervisor, VirtError, DestinationThread, AbstractVirtReport
 from virtwho.virt.fakevirt import FakeVirt
 
 
@@ -165,3 +178,135 @@ file=%s
         effective_config = init_config({}, {}, config_dir=self.config_dir)
         # This is an invalid case, the config section that is invalid should have been dropped
         self.assertNotIn('test', effective_config)
+
+
+class FakeManager(object):
+    """
+    In-process destination, the mapping is serialized like by the real
+    managers and the job is finished immediately.
+    """
+
+    def __init__(self):
+        self.payload_size = 0
+
+    def hypervisorCheckIn(self, report, options=None):
+        mapping = {'hypervisors': [hypervisor.toDict() for hypervisor in report.association['hypervisors']]}
+        self.payload_size = len(json.dumps(mapping))
+        report.state = AbstractVirtReport.STATE_FINISHED
+        return {'id': 'job'}
+
+    def sendVirtGuests(self, report, options=None):
+        pass
+
+    def check_report_state(self, report):
+        pass
+
+
+class TestPipelineBenchmark(BenchmarkBase):
+    """
+    Reports go through the whole pipeline (fake backend, datastore,
+    destination and in-process manager). Numbers of guests can be changed
+    by the VIRTWHO_BENCHMARK_GUESTS environment variable, e.g. "1000,50000".
+    """
+    STAGES = ('collect', 'store', 'gather', 'checkin')
+    CHURN = 0.01
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inventory_file = os.path.join(self.directory, 'inventory.json')
+
+    @staticmethod
+    def guest_counts():
+        guest_counts = os.environ.get('VIRTWHO_BENCHMARK_GUESTS')
+        if guest_counts:
+            return [int(count) for count in guest_counts.split(',')]
+        return list(GUEST_COUNTS) + [500000]
+
+    def create_pipeline(self, delta_reporting=False):
+        config_file = os.path.join(self.directory, 'test.conf')
+        with open(config_file, 'w') as f:
+            f.write("[test]\ntype=fake\nis_hypervisor=true\nowner=owner\nenv=env\nfile=%s\n" %
+                    self.inventory_file)
+        effective_config = init_config({}, {}, config_dir=self.directory)
+        config = DestinationToSourceMapper(effective_config).configs[0][1]
+        datastore = Datastore()
+        virt = Virt.from_config(self.logger, config, datastore, interval=3600)
+        manager = FakeManager()
+        destination = DestinationThread(self.logger, config, source_keys=[config.name],
+                                        source=datastore, dest=manager, interval=3600,
+                                        options={VW_GLOBAL: {'print': False}},
+                                        delta_reporting=delta_reporting)
+        return virt, destination, manager
+
+    @staticmethod
+    def run_cycle(virt, destination):
+        """
+        Pass one report through the pipeline.
+
+        @return: dict of stage name to (wall time, CPU time)
+        """
+        times = {}
+        data = [None]
+
+        def stage(name, func, *args):
+            start, start_cpu = time.time(), process_time()
+            data[0] = func(*args)
+            times[name] = (time.time() - start, process_time() - start_cpu)
+
+        stage('collect', virt._get_data)
+        stage('store', virt._send_data, data[0])
+        stage('gather', destination._get_data)
+        stage('checkin', destination._send_data, data[0])
+        return times
+
+    def test_pipeline(self):
+        rows = []
+        for guest_count in self.guest_counts():
+            host_count = max(1, guest_count // GUESTS_PER_HOST)
+            write_inventory(self.inventory_file, host_count)
+            virt, destination, manager = self.create_pipeline()
+            times = self.run_cycle(virt, destination)
+            latency = sum(wall for wall, cpu in times.values())
+            rows.append((guest_count, guest_count / latency, latency) +
+                        tuple(times[name][1] for name in self.STAGES) +
+                        (manager.payload_size // 1024,))
+        self.print_results(
+            'Pipeline fake -> datastore -> destination -> manager',
+            ('guests', 'guests/s', 'latency [s]') + tuple('%s CPU [s]' % name for name in self.STAGES) +
+            ('payload [kB]',),
+            rows)
+
+    def test_churn(self):
+        rows = []
+        for guest_count in self.guest_counts():
+            host_count = max(1, guest_count // GUESTS_PER_HOST)
+            write_inventory(self.inventory_file, host_count)
+            virt, destination, manager = self.create_pipeline(delta_reporting=True)
+            self.run_cycle(virt, destination)
+            write_inventory(self.inventory_file, host_count, churn=self.CHURN, seed=1)
+            times = self.run_cycle(virt, destination)
+            rows.append((guest_count, sum(wall for wall, cpu in times.values()),
+                         manager.payload_size // 1024))
+        self.print_results(
+            'Pipeline with delta reporting after %d%% of guests changed' % (self.CHURN * 100),
+            ('guests', 'latency [s]', 'payload [kB]'),
+            rows)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_memory(self):
+        rows = []
+        for guest_count in self.guest_counts():
+            write_inventory(self.inventory_file, max(1, guest_count // GUESTS_PER_HOST))
+            virt, destination, manager = self.create_pipeline()
+            tracemalloc.start()
+            try:
+                self.run_cycle(virt, destination)
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            rows.append((guest_count, current // 1024, peak // 1024))
+        self.print_results(
+            'Memory of the pipeline (traced allocations)',
+            ('guests', 'retained [kB]', 'peak [kB]'),
+            rows)
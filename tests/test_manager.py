@@ -19,6 +19,7 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import json
 import os
 import shutil
 import tempfile
@@ -28,6 +29,7 @@ from base import TestBase, unittest
 
 from virtwho.config import VirtConfigSection
 from virtwho.manager import Manager, ManagerError
+from virtwho.manager.serializer import iter_mapping
 from virtwho.virt import Guest, Hypervisor, HostGuestAssociationReport, DomainListReport
 
 import rhsm.config as rhsm_config
@@ -171,3 +173,30 @@ class TestSatellite(TestManager):
             }],
             [0, "crawl_ended", "system", {}]
         ])
+
+
+class TestSerializer(TestBase):
+    def setUp(self):
+        guest1 = Guest('guest-b', 'esx', Guest.STATE_RUNNING)
+        guest2 = Guest('guest-a', 'esx', Guest.STATE_SHUTOFF)
+        guest3 = Guest(u'guest-\u010d', 'esx', Guest.STATE_PAUSED)
+        self.hypervisors = [
+            Hypervisor('host-1', [guest1, guest2], name='host-1.example.com',
+                       facts={Hypervisor.CPU_SOCKET_FACT: '2', Hypervisor.HYPERVISOR_TYPE_FACT: 'esx'}),
+            Hypervisor('host-2', [guest3]),
+            Hypervisor(u'host-\u0161"\\', []),
+        ]
+
+    def expected(self, hypervisors):
+        return {'hypervisors': [hypervisor.toDict() for hypervisor in hypervisors]}
+
+    def test_iter_mapping(self):
+        data = ''.join(iter_mapping(self.hypervisors))
+        self.assertEqual(json.loads(data), json.loads(json.dumps(self.expected(self.hypervisors))))
+
+    def test_iter_mapping_same_as_json(self):
+        data = ''.join(iter_mapping(self.hypervisors))
+        self.assertEqual(data, json.dumps(self.expected(self.hypervisors), sort_keys=True))
+
+    def test_iter_mapping_empty(self):
+        self.assertEqual(json.loads(''.join(iter_mapping([]))), {'hypervisors': []})
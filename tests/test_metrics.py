@@ -0,0 +1,205 @@
+from __future__ import print_function
+"""
+Test of the metrics exported in Prometheus text format.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import requests
+
+from base import TestBase
+
+from mock import Mock
+
+from virtwho import metrics
+from virtwho.datastore import Datastore
+from virtwho.metrics import Registry, MetricsServer, MetricsFile, parse_address
+from virtwho.virt import Virt, Hypervisor, Guest, DestinationThread, HostGuestAssociationReport, \
+    AbstractVirtReport
+
+
+class TestRegistry(TestBase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_total', 'Test counter', ['config'])
+        counter.inc(config='a')
+        counter.inc(2, config='a')
+        counter.inc(config='b "quoted"')
+        self.assertEqual(counter.get(config='a'), 3)
+        self.assertEqual(self.registry.render(), (
+            '# HELP test_total Test counter\n'
+            '# TYPE test_total counter\n'
+            'test_total{config="a"} 3\n'
+            'test_total{config="b \\"quoted\\""} 1\n'
+        ))
+
+    def test_wrong_labels(self):
+        counter = self.registry.counter('test_total', 'Test counter', ['config'])
+        self.assertRaises(ValueError, counter.inc, destination='a')
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('test_gauge', 'Test gauge')
+        gauge.set(1.5)
+        gauge.set(2.5)
+        self.assertIn('test_gauge 2.5\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Test histogram', ['thread'], buckets=(1, 10))
+        for value in (0.5, 1, 5, 20):
+            histogram.observe(value, thread='a')
+        self.assertEqual(histogram.get(thread='a'), (4, 26.5))
+        self.assertEqual(self.registry.render(), (
+            '# HELP test_seconds Test histogram\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{thread="a",le="1"} 2\n'
+            'test_seconds_bucket{thread="a",le="10"} 3\n'
+            'test_seconds_bucket{thread="a",le="+Inf"} 4\n'
+            'test_seconds_sum{thread="a"} 26.5\n'
+            'test_seconds_count{thread="a"} 4\n'
+        ))
+
+    def test_clear(self):
+        counter = self.registry.counter('test_total', 'Test counter')
+        counter.inc()
+        self.registry.clear()
+        self.assertEqual(counter.get(), 0)
+
+    def test_changes(self):
+        # Changes of the values are added to the values of another registry
+        registries = [Registry(), Registry()]
+        for registry in registries:
+            registry.counter('test_total', 'Test counter', ['config'])
+            registry.gauge('test_gauge', 'Test gauge')
+            registry.histogram('test_seconds', 'Test histogram', ['thread'], buckets=(1, 10))
+        counter, gauge, histogram = registries[0]._metrics
+        target = registries[1]
+        target._metrics[0].inc(5, config='a')
+        snapshot = registries[0].snapshot()
+        self.assertEqual(registries[0].changes(snapshot, registries[0].snapshot()), [])
+        counter.inc(2, config='a')
+        gauge.set(3)
+        histogram.observe(5, thread='b')
+        new = registries[0].snapshot()
+        target.apply_changes(registries[0].changes(snapshot, new))
+        counter.inc(config='a')
+        histogram.observe(20, thread='b')
+        target.apply_changes(registries[0].changes(new, registries[0].snapshot()))
+        self.assertEqual(target._metrics[0].get(config='a'), 8)
+        self.assertEqual(target._metrics[1].get(), 3)
+        self.assertEqual(target._metrics[2].get(thread='b'), (2, 25))
+        self.assertIn('test_seconds_bucket{thread="b",le="10"} 1\n', target.render())
+        # Unknown metrics are ignored
+        target.apply_changes([('unknown_total', (), 1)])
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('9464'), ('localhost', 9464))
+        self.assertEqual(parse_address('0.0.0.0:9464'), ('0.0.0.0', 9464))
+        self.assertEqual(parse_address('[::1]:9464'), ('::1', 9464))
+        for address in ('localhost', 'localhost:-1', 'localhost:99999'):
+            self.assertRaises(ValueError, parse_address, address)
+
+
+class TestExporters(TestBase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.counter('test_total', 'Test counter').inc()
+
+    def test_server(self):
+        server = MetricsServer('127.0.0.1:0', self.registry, logger=Mock())
+        server.start()
+        self.addCleanup(server.stop)
+        response = requests.get('http://127.0.0.1:%d/metrics' % server.port)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('test_total 1\n', response.text)
+        response = requests.get('http://127.0.0.1:%d/other' % server.port)
+        self.assertEqual(response.status_code, 404)
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'virt-who.prom')
+        scheduler = Mock()
+        metrics_file = MetricsFile(path, self.registry, logger=Mock(), interval=30, scheduler=scheduler)
+        metrics_file.start()
+        with open(path) as f:
+            self.assertIn('test_total 1\n', f.read())
+        scheduler.call_later.assert_called_once_with(30, metrics_file._tick)
+        self.registry.counter('other_total', 'Other counter').inc()
+        metrics_file.stop()
+        scheduler.call_later.return_value.cancel.assert_called_once_with()
+        # The final values are written when stopped
+        with open(path) as f:
+            self.assertIn('other_total 1\n', f.read())
+        self.assertEqual(os.listdir(directory), ['virt-who.prom'])
+
+    def test_file_write_fails(self):
+        logger = Mock()
+        metrics_file = MetricsFile('/nonexistent/virt-who.prom', self.registry, logger=logger,
+                                   scheduler=Mock())
+        metrics_file.write()
+        metrics_file.write()
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertEqual(logger.debug.call_count, 1)
+
+
+class TestVirtMetrics(TestBase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+
+    def test_report_metrics(self):
+        config, d = self.create_fake_config('test')
+        virt = Virt(self.logger, config, Datastore(), interval=3600)
+        hypervisors = [Hypervisor('a', [Guest('guest-1', 'fake', 1), Guest('guest-2', 'fake', 1)]),
+                       Hypervisor('b', [])]
+        virt.getHostGuestMapping = Mock(return_value={'hypervisors': hypervisors})
+        virt.prepare = Mock()
+        virt.poll()
+        self.assertEqual(metrics.REPORTS.get(config='test', type='association'), 1)
+        self.assertEqual(metrics.REPORT_HYPERVISORS.get(config='test'), 2)
+        self.assertEqual(metrics.REPORT_GUESTS.get(config='test'), 2)
+        self.assertEqual(metrics.GET_DATA_SECONDS.get(thread='test')[0], 1)
+
+    def test_handle_429(self):
+        Virt.handle_429(10, 1)
+        self.assertEqual(metrics.RATE_LIMITED.get(), 1)
+
+    def test_job_duration(self):
+        config, d = self.create_fake_config('test')
+        manager = Mock()
+
+        def check_report_state(report):
+            report.state = AbstractVirtReport.STATE_FINISHED
+        manager.check_report_state.side_effect = check_report_state
+        destination = DestinationThread(self.logger, config, source_keys=['source'], source=Datastore(),
+                                        dest=manager, interval=60, options=Mock())
+        destination.wait = Mock()
+        report = HostGuestAssociationReport(config, {'hypervisors': []})
+        destination._checkin_times[report] = time.time() - 5
+        destination.check_report_status(report)
+        count, total = metrics.JOB_SECONDS.get(destination='test', state='finished')
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(total, 5)
+        # The job is observed only once
+        destination.check_report_status(report)
+        self.assertEqual(metrics.JOB_SECONDS.get(destination='test', state='finished')[0], 1)
@@ -0,0 +1,67 @@
+from __future__ import print_function
+"""
+Test of the scheduler shared by virt-who threads.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from threading import Event
+
+from base import TestBase
+
+from mock import Mock
+
+from virtwho.scheduler import Scheduler, get_scheduler, reset_scheduler
+
+
+class TestScheduler(TestBase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def test_call_later_order(self):
+        calls = []
+        done = Event()
+        self.scheduler.call_later(0.2, lambda: (calls.append(2), done.set()))
+        self.scheduler.call_later(0.1, lambda: calls.append(1))
+        # New first timer must wake up the waiting scheduler thread
+        self.scheduler.call_later(0, lambda: calls.append(0))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_cancel(self):
+        callback = Mock()
+        done = Event()
+        timer = self.scheduler.call_later(0.05, callback)
+        self.assertEqual(len(self.scheduler), 1)
+        timer.cancel()
+        self.assertEqual(len(self.scheduler), 0)
+        self.scheduler.call_later(0.1, done.set)
+        self.assertTrue(done.wait(5))
+        callback.assert_not_called()
+
+    def test_failing_callback(self):
+        done = Event()
+        self.scheduler.call_later(0, Mock(side_effect=Exception))
+        self.scheduler.call_later(0.01, done.set)
+        self.assertTrue(done.wait(5))
+
+    def test_shared_scheduler(self):
+        self.assertIs(get_scheduler(), get_scheduler())
+
+    def test_reset_scheduler(self):
+        scheduler = get_scheduler()
+        reset_scheduler()
+        self.assertIsNot(get_scheduler(), scheduler)
@@ -0,0 +1,102 @@
+from __future__ import print_function
+"""
+Test of the state kept across restarts of virt-who.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from base import TestBase
+
+from mock import Mock, patch
+
+from virtwho.config import Satellite6DestinationInfo
+from virtwho.state import StateFile, destination_key
+
+
+class TestStateFile(TestBase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'virt-who', 'state.json')
+        self.logger = Mock()
+
+    def test_missing_file(self):
+        state_file = StateFile(self.path, self.logger)
+        state_file.load()
+        self.assertIsNone(state_file.get('dest'))
+        self.logger.warning.assert_not_called()
+
+    def test_set_and_load(self):
+        state = {'last_report_for_source': {'source1': 'digest'}}
+        state_file = StateFile(self.path, self.logger)
+        state_file.set('dest', state)
+        # Changes of the passed dict don't affect the stored state
+        state['last_report_for_source']['source1'] = 'other'
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['state.json'])
+
+        loaded = StateFile(self.path, self.logger)
+        loaded.load()
+        self.assertEqual(loaded.get('dest'), {'last_report_for_source': {'source1': 'digest'}})
+
+    def test_unchanged_state_not_written(self):
+        state_file = StateFile(self.path, self.logger)
+        state_file.set('dest', {'a': 1})
+        with patch.object(state_file, '_write') as write:
+            state_file.set('dest', {'a': 1})
+            write.assert_not_called()
+
+    def test_invalid_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"version": 1, "destinations": ')
+        state_file = StateFile(self.path, self.logger)
+        state_file.load()
+        self.assertIsNone(state_file.get('dest'))
+        self.logger.warning.assert_called_once()
+
+    def test_unsupported_version(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            json.dump({'version': 0, 'destinations': {'dest': {}}}, f)
+        state_file = StateFile(self.path, self.logger)
+        state_file.load()
+        self.assertIsNone(state_file.get('dest'))
+
+    def test_write_failure(self):
+        # Parent of the state file is a regular file
+        with open(os.path.join(self.directory, 'virt-who'), 'w'):
+            pass
+        state_file = StateFile(self.path, self.logger)
+        state_file.set('dest', {'a': 1})
+        state_file.set('dest', {'a': 2})
+        # The failure is reported only once
+        self.logger.warning.assert_called_once()
+        self.assertEqual(state_file.get('dest'), {'a': 2})
+
+
+class TestDestinationKey(TestBase):
+    def test_destination_key(self):
+        info = Satellite6DestinationInfo(env='env', owner='owner', rhsm_password='secret')
+        other = Satellite6DestinationInfo(env='env', owner='owner', rhsm_password='secret')
+        other.name = 'destination_1'
+        self.assertEqual(destination_key(info), destination_key(other))
+        self.assertNotIn('secret', destination_key(info))
+        self.assertNotEqual(destination_key(info),
+                            destination_key(Satellite6DestinationInfo(env='env', owner='other')))
@@ -66,7 +66,7 @@ class TestSubscriptionManager(TestBase):
         self.sm.sendVirtGuests(report)
         self.sm.connection.updateConsumer.assert_called_with(
             123,
-            guest_uuids=[g.toDict() for g in self.guestList],
+            guest_uuids=[g.toDict() for g in sorted(self.guestList, key=lambda g: g.uuid)],
             hypervisor_id=self.hypervisor_id)
 
     def test_hypervisorCheckIn(self):
@@ -0,0 +1,123 @@
+from __future__ import print_function
+"""
+Test of tracing of the reports.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from base import TestBase
+
+from mock import Mock
+
+from virtwho.datastore import Datastore
+from virtwho.tracing import Tracer, get_tracer, set_tracer
+from virtwho.virt import Virt, Hypervisor, DestinationThread
+
+
+class TestTracer(TestBase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'trace.jsonl')
+
+    def read_spans(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        self.assertIsNone(tracer.new_trace_id())
+        tracer.record('test', ['abc'], 0)
+
+    def test_record(self):
+        tracer = Tracer(self.path)
+        self.addCleanup(tracer.close)
+        trace_id = tracer.new_trace_id()
+        tracer.record('collect', [trace_id, None], 10.0, 12.5, config='esx')
+        with tracer.span('checkin', [trace_id], destination='satellite'):
+            pass
+        spans = self.read_spans()
+        self.assertEqual(len(spans), 2)
+        self.assertEqual(spans[0]['trace_id'], trace_id)
+        self.assertEqual(spans[0]['span'], 'collect')
+        self.assertEqual(spans[0]['start'], 10.0)
+        self.assertEqual(spans[0]['duration'], 2.5)
+        self.assertEqual(spans[0]['config'], 'esx')
+        self.assertEqual(spans[1]['span'], 'checkin')
+        self.assertEqual(spans[1]['destination'], 'satellite')
+
+    def test_log_spans(self):
+        logger = Mock()
+        tracer = Tracer(log_spans=True, logger=logger)
+        self.assertTrue(tracer.enabled)
+        tracer.record('collect', ['abc'], 10.0, 11.0)
+        logger.info.assert_called_once()
+        self.assertEqual(json.loads(logger.info.call_args[0][1])['span'], 'collect')
+
+    def test_set_tracer(self):
+        tracer = Tracer(self.path)
+        set_tracer(tracer)
+        self.assertIs(get_tracer(), tracer)
+        set_tracer(None)
+        self.assertFalse(get_tracer().enabled)
+        # Previous tracer is closed
+        self.assertFalse(tracer.enabled)
+
+
+class TestReportTracing(TestBase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'trace.jsonl')
+        set_tracer(Tracer(self.path))
+        self.addCleanup(set_tracer, None)
+
+    def read_spans(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_trace(self):
+        config, d = self.create_fake_config('source', owner='owner')
+        datastore = Datastore()
+        virt = Virt(self.logger, config, datastore, interval=3600)
+        virt.prepare = Mock()
+        virt.getHostGuestMapping = Mock(return_value={'hypervisors': [Hypervisor('a')]})
+        virt.poll()
+        report = datastore.get('source')
+        self.assertEqual(len(report.trace_ids), 1)
+        self.assertIsNotNone(report.stored_time)
+
+        dest_config, d = self.create_fake_config('destination', owner='owner')
+        manager = Mock()
+        manager.hypervisorCheckIn.return_value = {'id': 'job'}
+        options = Mock()
+        options.print_ = False
+        destination = DestinationThread(self.logger, dest_config, source_keys=['source'],
+                                        source=datastore, dest=manager, interval=60,
+                                        options=options)
+        destination._send_data({'source': report})
+        checked_in = manager.hypervisorCheckIn.call_args[0][0]
+        self.assertEqual(checked_in.trace_ids, report.trace_ids)
+
+        spans = self.read_spans()
+        self.assertEqual([span['span'] for span in spans], ['collect', 'hash', 'datastore', 'checkin'])
+        self.assertEqual(set(span['trace_id'] for span in spans), set(report.trace_ids))
+        self.assertEqual(spans[3]['hypervisors'], 1)
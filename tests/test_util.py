@@ -1,9 +1,16 @@
 from __future__ import print_function
-from mock import patch, MagicMock, PropertyMock
+import fnmatch
+import os
+import re
+import shutil
+import stat
+import tempfile
+from mock import patch, MagicMock, Mock, PropertyMock
 
 from base import TestBase
+from benchmark import BenchmarkBase
 
-from virtwho.util import RequestsXmlrpcTransport
+from virtwho.util import RequestsXmlrpcTransport, HostFilter, write_file_atomically, WriteFailureLog
 
 
 class FakeParser(object):
@@ -27,3 +34,152 @@ class TestRequestsXmlrpcTransport(TestBase):
         transport.parse_response(resp)
 
         assert p.called, 'Response.content should be used instead'
+
+
+class TestHostFilter(TestBase):
+    def test_wildcards(self):
+        host_filter = HostFilter(['host-1', '*.Example.com', 'host-[23]'], 'wildcards')
+        self.assertTrue(host_filter.match('host-1'))
+        self.assertTrue(host_filter.match('HOST-1'))
+        self.assertTrue(host_filter.match('foo.example.COM'))
+        self.assertTrue(host_filter.match('host-3'))
+        self.assertFalse(host_filter.match('host-4'))
+        self.assertFalse(host_filter.match('host-10'))
+        self.assertFalse(host_filter.match('fooXexample.com'))
+
+    def test_regex(self):
+        host_filter = HostFilter(['host-1', r'.*\.Example\.com', 'host-[23]'], 'regex')
+        self.assertTrue(host_filter.match('host-1'))
+        self.assertTrue(host_filter.match('HOST-1'))
+        self.assertTrue(host_filter.match('foo.example.COM'))
+        self.assertTrue(host_filter.match('host-2'))
+        self.assertFalse(host_filter.match('host-10'))
+        self.assertFalse(host_filter.match('xhost-1'))
+        self.assertFalse(host_filter.match('fooXexample.com'))
+
+    def test_wildcards_and_regex(self):
+        host_filter = HostFilter(['host-?', 'foo.+'])
+        self.assertTrue(host_filter.match('host-1'))
+        self.assertTrue(host_filter.match('foo.bar'))
+        self.assertFalse(host_filter.match('host-10'))
+
+    def test_invalid_regex(self):
+        host_filter = HostFilter(['host-(', 'host-1'])
+        self.assertTrue(host_filter.match('host-('))
+        self.assertTrue(host_filter.match('host-1'))
+        self.assertFalse(host_filter.match('host-2'))
+        host_filter = HostFilter(['host-('], 'regex')
+        self.assertFalse(host_filter.match('host-('))
+
+    def test_empty(self):
+        self.assertFalse(HostFilter([]).match('host-1'))
+
+    def test_wildcards_like_fnmatch(self):
+        patterns = ['*', 'a?c', '[ab]c', '[!ab]c', '[]]c', '[!]]c', '[c', 'a.c', 'a+c', 'a\\c', 'a(c', '[a-c]x']
+        names = ['abc', 'ac', 'bc', 'cc', ']c', '[c', 'a.c', 'axc', 'a+c', 'aac', 'a\\c', 'a(c', 'bx', 'dx']
+        for pattern in patterns:
+            host_filter = HostFilter([pattern], 'wildcards')
+            for name in names:
+                self.assertEqual(host_filter.match(name), fnmatch.fnmatch(name, pattern), (pattern, name))
+
+    def test_backreference(self):
+        host_filter = HostFilter([r'(a+)-\1', r'(b)(c)-\2', 'host-.*'], 'regex')
+        self.assertTrue(host_filter.match('aa-aa'))
+        self.assertFalse(host_filter.match('aa-a'))
+        self.assertTrue(host_filter.match('bc-c'))
+        self.assertFalse(host_filter.match('bc-b'))
+        self.assertTrue(host_filter.match('host-1'))
+
+    def test_invalid_regexes(self):
+        self.assertEqual(HostFilter.invalid_regexes(['host-(', 'host-[0-9]+', '*', 'host']),
+                         ['host-(', '*'])
+
+
+def legacy_filter(host, filterlist, filter_type=None):
+    """
+    Matching of hosts as it was done before HostFilter was introduced
+    """
+    for i in filterlist:
+        if filter_type in (None, 'wildcards'):
+            if fnmatch.fnmatch(host.lower(), i.lower()):
+                return True
+        if filter_type in (None, 'regex'):
+            try:
+                if re.match("^" + i + "$", host, re.IGNORECASE):
+                    return True
+            except re.error:
+                pass
+    return False
+
+
+class TestWriteFileAtomically(TestBase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_write(self):
+        path = os.path.join(self.directory, 'sub', 'file')
+        write_file_atomically(path, 'old', make_dirs=True)
+        write_file_atomically(path, 'new', mode=0o644)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['file'])
+
+    def test_write_fails(self):
+        # Temporary file is removed and the original file is kept
+        path = os.path.join(self.directory, 'file')
+        write_file_atomically(path, 'old')
+        with patch('os.rename', side_effect=OSError('rename failed')):
+            self.assertRaises(OSError, write_file_atomically, path, 'new')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.directory), ['file'])
+
+    def test_missing_directory(self):
+        path = os.path.join(self.directory, 'sub', 'file')
+        self.assertRaises((IOError, OSError), write_file_atomically, path, 'data')
+
+
+class TestWriteFailureLog(TestBase):
+    def test_repeated_failures(self):
+        logger = Mock()
+        failures = WriteFailureLog(logger)
+        failures.failure('failed %s', 1)
+        failures.failure('failed %s', 2)
+        logger.warning.assert_called_once_with('failed %s', 1)
+        logger.debug.assert_called_once_with('failed %s', 2)
+        # Failure after a successful write is logged as warning again
+        failures.success()
+        failures.failure('failed %s', 3)
+        self.assertEqual(logger.warning.call_count, 2)
+
+
+class TestHostFilterBenchmark(BenchmarkBase):
+    HOST_COUNT = 8000
+    PATTERN_COUNT = 300
+
+    def test_host_filter(self):
+        hosts = ['esx-%05d.dc%d.example.com' % (index, index % 4) for index in range(self.HOST_COUNT)]
+        pattern_sets = [
+            ('literals', 'wildcards', ['esx-%05d.dc%d.example.com' % (index * 7, index * 7 % 4)
+                                       for index in range(self.PATTERN_COUNT)]),
+            ('wildcards', 'wildcards', ['esx-%03d*.dc?.example.com' % index
+                                        for index in range(self.PATTERN_COUNT)]),
+            ('regex', 'regex', [r'esx-%03d\d+\.dc[0-3]\.example\.com' % index
+                                for index in range(self.PATTERN_COUNT)]),
+            ('mixed', None, ['esx-%05d.dc%d.example.com' % (index * 7, index * 7 % 4)
+                             for index in range(self.PATTERN_COUNT // 2)] +
+                            ['esx-%03d*.dc?.example.com' % index
+                             for index in range(self.PATTERN_COUNT // 2)]),
+        ]
+        rows = []
+        for name, filter_type, patterns in pattern_sets:
+            host_filter = HostFilter(patterns, filter_type)
+            self.assertEqual([host_filter.match(host) for host in hosts],
+                             [legacy_filter(host, patterns, filter_type) for host in hosts])
+            legacy = self.measure(lambda: [legacy_filter(host, patterns, filter_type) for host in hosts], repeat=1)
+            compiled = self.measure(lambda: [host_filter.match(host) for host in hosts])
+            rows.append((name, len(patterns), legacy, compiled))
+        self.print_results('Filtering of %d hosts' % self.HOST_COUNT,
+                           ('patterns', 'count', 'legacy [s]', 'HostFilter [s]'), rows)
@@ -1,21 +1,35 @@
 from __future__ import print_function
 
 import os
+import copy
+import time
+import json
+import hashlib
 import tempfile
 import shutil
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
-from base import TestBase
+from base import TestBase, unittest
+from benchmark import BenchmarkBase, generate_hypervisors, GUEST_COUNTS
 from stubs import StubEffectiveConfig
 
 from mock import Mock, patch, call
-from threading import Event
+from threading import Event, Lock
 
-from virtwho import MinimumJobPollInterval
+from virtwho import MinimumJobPollInterval, MinimumSendInterval
+from virtwho.datastore import Datastore
 from virtwho.config import DestinationToSourceMapper, VW_GLOBAL, EffectiveConfig, parse_file, \
-    VirtConfigSection
-from virtwho.manager import ManagerThrottleError
+    VirtConfigSection, Satellite6DestinationInfo
+from virtwho.manager import ManagerThrottleError, ManagerError
+from virtwho.state import StateFile, destination_key
+from virtwho.util import HostFilter
 from virtwho.virt import HostGuestAssociationReport, Hypervisor, Guest, \
-    DestinationThread, ErrorReport, AbstractVirtReport, DomainListReport
+    DestinationThread, ErrorReport, AbstractVirtReport, DomainListReport, \
+    Virt, VirtError, VirtPool
+from virtwho.virt.virt import ChunkedReport, LoginLimiter, AdaptiveInterval, start_delay
 
 
 xvirt = type("", (), {'CONFIG_TYPE': 'xxx'})()
@@ -112,6 +126,474 @@ env=env
                 included_hypervisor
             ]
         }
+        # Matcher compiled during validation of config is used
+        for key in ('filter_hosts', 'exclude_hosts'):
+            if key in config:
+                self.assertIs(config.host_filter(key), report._host_filter(key, config[key]))
+
+
+class TestFrozenReport(TestBase):
+    def setUp(self):
+        self.config, d = self.create_fake_config('test')
+        self.guest = Guest('guest-1', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)
+        self.hypervisor = Hypervisor('12345', guestIds=[self.guest], facts={'a': 'b'})
+
+    def test_freeze_host_guest_association_report(self):
+        report = HostGuestAssociationReport(self.config, {'hypervisors': [self.hypervisor]})
+        expected_hash = report.hash
+        self.assertIs(report.freeze(), report)
+        self.assertTrue(report.frozen)
+        self.assertTrue(self.hypervisor.frozen)
+        self.assertTrue(self.guest.frozen)
+        self.assertEqual(report.hash, expected_hash)
+        self.assertRaises(AttributeError, setattr, self.guest, 'state', Guest.STATE_SHUTOFF)
+        self.assertRaises(AttributeError, setattr, self.hypervisor, 'name', 'name')
+        self.assertIsInstance(self.hypervisor.guestIds, tuple)
+        self.assertRaises(TypeError, self.hypervisor.facts.update, {'c': 'd'})
+        # State of the report is still tracked
+        report.state = AbstractVirtReport.STATE_FINISHED
+        self.assertEqual(report.state, AbstractVirtReport.STATE_FINISHED)
+
+    def test_freeze_domain_list_report(self):
+        report = DomainListReport(self.config, [self.guest], hypervisor_id='12345')
+        expected_hash = report.hash
+        report.freeze()
+        self.assertTrue(self.guest.frozen)
+        self.assertEqual(report.hash, expected_hash)
+
+    def test_freeze_twice(self):
+        self.assertIs(self.hypervisor.freeze(), self.hypervisor)
+        self.assertIs(self.hypervisor.freeze(), self.hypervisor)
+        self.assertIs(self.guest.freeze(), self.guest)
+
+    def test_deepcopy(self):
+        copied = copy.deepcopy(self.hypervisor)
+        self.assertIsNot(copied, self.hypervisor)
+        self.assertIsNot(copied.guestIds[0], self.guest)
+        self.assertFalse(copied.frozen)
+        self.assertEqual(copied.toDict(), self.hypervisor.toDict())
+        self.hypervisor.freeze()
+        self.assertIs(copy.deepcopy(self.hypervisor), self.hypervisor)
+
+
+class TestModel(TestBase):
+    def setUp(self):
+        self.guest = Guest('guest-1', xvirt.CONFIG_TYPE, Guest.STATE_PAUSED)
+        self.hypervisor = Hypervisor(u'host-\u010d', guestIds=[
+            Guest('guest-2', xvirt.CONFIG_TYPE, Guest.STATE_SHUTOFF), self.guest
+        ], name='host.example.com', facts={'b': '1', 'a': '2'})
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.guest, '__dict__'))
+        self.assertFalse(hasattr(self.hypervisor, '__dict__'))
+
+    def test_interned_virt_type(self):
+        virt_type = ''.join(['x', 'xx'])
+        guest = Guest('guest-3', virt_type, Guest.STATE_RUNNING)
+        self.assertIs(guest.virtWhoType, self.guest.virtWhoType)
+
+    def test_to_json(self):
+        self.assertEqual(self.guest.toJSON(), json.dumps(self.guest.toDict(), sort_keys=True))
+        expected = json.dumps(self.hypervisor.toDict(), sort_keys=True)
+        self.assertEqual(self.hypervisor.toJSON(), expected)
+        self.assertEqual(Hypervisor('host').toJSON(), json.dumps(Hypervisor('host').toDict(), sort_keys=True))
+        self.hypervisor.freeze()
+        self.assertEqual(self.hypervisor.toJSON(), expected)
+
+
+class TestReportAssociation(TestBase):
+    def setUp(self):
+        self.hypervisors = [
+            Hypervisor('host-%d' % index, guestIds=[
+                Guest('guest-%d' % index, xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)
+            ]) for index in range(4)
+        ]
+
+    def test_association_memoized_for_frozen_report(self):
+        config, d = self.create_fake_config('test', exclude_hosts=['host-0'])
+        report = HostGuestAssociationReport(config, {'hypervisors': self.hypervisors})
+        self.assertIsNot(report.association, report.association)
+        report.freeze()
+        association = report.association
+        self.assertEqual([h.hypervisorId for h in association['hypervisors']], ['host-1', 'host-2', 'host-3'])
+        with patch.object(HostFilter, 'match') as match:
+            self.assertIs(report.association, association)
+            match.assert_not_called()
+
+    def test_explicit_filters(self):
+        config, d = self.create_fake_config('test', filter_type='regex')
+        report = HostGuestAssociationReport(config, {'hypervisors': self.hypervisors},
+                                            exclude_hosts=['host-0'], filter_hosts=['host-[0-2]'])
+        self.assertEqual([h.hypervisorId for h in report.association['hypervisors']], ['host-1', 'host-2'])
+
+    def test_empty_filter_hosts(self):
+        config, d = self.create_fake_config('test', filter_hosts=[])
+        report = HostGuestAssociationReport(config, {'hypervisors': self.hypervisors})
+        self.assertEqual(report.association['hypervisors'], [])
+
+
+class TestVirtPool(TestBase):
+    def create_virt(self, name, oneshot=True, interval=3600, error=None, **kwargs):
+        config, d = self.create_fake_config(name, **kwargs)
+        config.get.side_effect = d.get
+        virt = Virt(self.logger, config, Datastore(), interval=interval, oneshot=oneshot)
+        virt.prepare = Mock()
+        virt.getHostGuestMapping = Mock(return_value={'hypervisors': [Hypervisor(name)]},
+                                        side_effect=error)
+        return virt
+
+    def test_poll(self):
+        virt = self.create_virt('test')
+        self.assertGreater(virt.poll(), 0)
+        virt.prepare.assert_called_once_with()
+        self.assertIsInstance(virt.dest.get('test'), HostGuestAssociationReport)
+        self.assertTrue(virt.is_terminated())
+
+    def test_poll_error(self):
+        virt = self.create_virt('test', oneshot=False, error=VirtError('failed'))
+        self.assertEqual(virt.poll(), 3600)
+        self.assertIsInstance(virt.dest.get('test'), ErrorReport)
+        self.assertFalse(virt.is_terminated())
+        # Backend is prepared again after the error
+        virt.poll()
+        self.assertEqual(virt.prepare.call_count, 2)
+
+    def test_oneshot(self):
+        virts = [self.create_virt('test-%d' % index) for index in range(5)]
+        pool = VirtPool(self.logger, 2)
+        self.addCleanup(pool.stop)
+        for virt in virts:
+            pool.add(virt)
+        pool.start()
+        for virt in virts:
+            self.assertTrue(virt.wait_terminated(5))
+            self.assertIsInstance(virt.dest.get(virt.config.name), HostGuestAssociationReport)
+        self.assertEqual(len(pool._workers), 2)
+
+    def test_polled_in_interval(self):
+        virt = self.create_virt('test', oneshot=False, interval=0.01)
+        polled = Event()
+
+        def get_mapping():
+            if virt.getHostGuestMapping.call_count >= 3:
+                polled.set()
+            return {'hypervisors': []}
+        virt.getHostGuestMapping.side_effect = get_mapping
+
+        pool = VirtPool(self.logger, 1)
+        pool.add(virt)
+        pool.start()
+        self.assertTrue(polled.wait(5))
+        pool.stop()
+        # No more polls after the pool is stopped
+        call_count = virt.getHostGuestMapping.call_count
+        time.sleep(0.05)
+        self.assertEqual(virt.getHostGuestMapping.call_count, call_count)
+
+    def test_server_of(self):
+        for server, expected in (
+            ('https://RHEVM.example.com:8443/ovirt-engine', 'rhevm.example.com'),
+            ('hyperv.example.com', 'hyperv.example.com'),
+        ):
+            virt = self.create_virt('test', server=server)
+            self.assertEqual(VirtPool.server_of(virt), expected)
+        self.assertIsNone(VirtPool.server_of(self.create_virt('test')))
+
+    def test_max_polls_per_server(self):
+        lock = Lock()
+        running = []
+        max_running = []
+
+        def get_mapping():
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return {'hypervisors': []}
+
+        virts = [self.create_virt('test-%d' % index, server='https://server.example.com/api')
+                 for index in range(4)]
+        other = self.create_virt('other', server='other.example.com')
+        for virt in virts + [other]:
+            virt.getHostGuestMapping.side_effect = get_mapping
+        pool = VirtPool(self.logger, 3, max_polls_per_server=1)
+        self.addCleanup(pool.stop)
+        for virt in virts + [other]:
+            pool.add(virt)
+        pool.start()
+        for virt in virts + [other]:
+            self.assertTrue(virt.wait_terminated(5))
+        # Only the other server was polled at the same time
+        self.assertLessEqual(max(max_running), 2)
+
+    def test_stopped_virt_is_not_polled(self):
+        virt = self.create_virt('test', oneshot=False)
+        virt.stop()
+        pool = VirtPool(self.logger, 1)
+        pool.add(virt)
+        pool.start()
+        pool.stop()
+        virt.getHostGuestMapping.assert_not_called()
+
+    def test_start_delay(self):
+        virt = self.create_virt('test')
+        virt.start_delay = 0.05
+        pool = VirtPool(self.logger, 1)
+        self.addCleanup(pool.stop)
+        start_time = time.time()
+        pool.add(virt)
+        pool.start()
+        self.assertTrue(virt.wait_terminated(5))
+        self.assertGreaterEqual(time.time() - start_time, 0.05)
+
+    def test_max_concurrent_logins(self):
+        lock = Lock()
+        running = []
+        max_running = []
+
+        def get_mapping():
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return {'hypervisors': []}
+
+        limiter = LoginLimiter(2)
+        virts = [self.create_virt('test-%d' % index) for index in range(6)]
+        pool = VirtPool(self.logger, 6)
+        self.addCleanup(pool.stop)
+        for virt in virts:
+            virt.getHostGuestMapping.side_effect = get_mapping
+            virt.login_limiter = limiter
+            pool.add(virt)
+        pool.start()
+        for virt in virts:
+            self.assertTrue(virt.wait_terminated(5))
+        self.assertEqual(max(max_running), 2)
+        self.assertEqual(limiter._running, 0)
+
+
+class TestStagger(TestBase):
+    def test_start_delay(self):
+        delays = [start_delay('reporter/config-%d' % index, 600) for index in range(100)]
+        self.assertTrue(all(0 <= delay < 600 for delay in delays))
+        # Same name gets the same delay every time
+        self.assertEqual(delays[0], start_delay('reporter/config-0', 600))
+        # The delays are spread over the whole splay
+        self.assertLess(min(delays), 100)
+        self.assertGreater(max(delays), 500)
+        self.assertEqual(start_delay('reporter/config-0', 0), 0)
+
+    def test_login_limiter_interrupt(self):
+        config, d = self.create_fake_config('test')
+        limiter = LoginLimiter(1)
+        virt = Virt(self.logger, config, Datastore(), interval=3600)
+        virt.login_limiter = limiter
+        self.assertTrue(limiter.acquire(virt))
+        virt.getHostGuestMapping = Mock(return_value={'hypervisors': []})
+        virt.start()
+        # The thread waits for the login until it's stopped
+        self.assertFalse(virt.wait_terminated(0.05))
+        virt.getHostGuestMapping.assert_not_called()
+        virt.stop()
+        virt.join(5)
+        self.assertFalse(virt.is_alive())
+        virt.getHostGuestMapping.assert_not_called()
+        limiter.release()
+        self.assertEqual(limiter._running, 0)
+
+    def test_thread_delays_first_run(self):
+        config, d = self.create_fake_config('test')
+        virt = Virt(self.logger, config, Datastore(), interval=3600, oneshot=True)
+        virt.start_delay = 0.05
+        virt.getHostGuestMapping = Mock(return_value={'hypervisors': []})
+        start_time = time.time()
+        virt.start()
+        virt.join(5)
+        self.assertGreaterEqual(time.time() - start_time, 0.05)
+        virt.getHostGuestMapping.assert_called_once_with()
+
+
+class TestAdaptiveInterval(TestBase):
+    def test_observe(self):
+        interval = AdaptiveInterval(600, 60, 2400)
+        interval.observe('a')
+        self.assertEqual(interval.current, 600)
+        # Stable reports make the interval longer, up to max_interval
+        expected = [600, 600, 1200, 1200, 1200, 2400, 2400, 2400, 2400]
+        for value in expected:
+            interval.observe('a')
+            self.assertEqual(interval.current, value)
+        # Change makes it shortest possible
+        interval.observe('b')
+        self.assertEqual(interval.current, 60)
+        for _ in range(AdaptiveInterval.STABLE_POLLS):
+            interval.observe('b')
+        self.assertEqual(interval.current, 120)
+
+    def test_bounds_include_interval(self):
+        interval = AdaptiveInterval(600, 900, 300)
+        self.assertEqual(interval.min_interval, 600)
+        self.assertEqual(interval.max_interval, 600)
+
+    def test_poll(self):
+        config, d = self.create_fake_config('test')
+        virt = Virt(self.logger, config, Datastore(), interval=600)
+        virt.adaptive_interval = AdaptiveInterval(600, 60, 2400)
+        virt.prepare = Mock()
+        mappings = [{'hypervisors': [Hypervisor('a')]}, {'hypervisors': [Hypervisor('b')]}]
+        virt.getHostGuestMapping = Mock(side_effect=mappings)
+        self.assertAlmostEqual(virt.poll(), 600, delta=1)
+        # Changed report is followed by a quick poll
+        self.assertAlmostEqual(virt.poll(), 60, delta=1)
+
+
+class TestReportHash(TestBase):
+    def setUp(self):
+        self.config, d = self.create_fake_config('test')
+
+    def create_hypervisors(self):
+        return [
+            Hypervisor('hypervisor_id_1', [Guest('guest-1', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)]),
+            Hypervisor('hypervisor_id_2', [Guest('guest-2', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)]),
+        ]
+
+    def test_hash_does_not_depend_on_order(self):
+        hypervisors = self.create_hypervisors()
+        report1 = HostGuestAssociationReport(self.config, {'hypervisors': hypervisors})
+        report2 = HostGuestAssociationReport(self.config, {'hypervisors': hypervisors[::-1]})
+        self.assertEqual(report1.hash, report2.hash)
+
+    def test_hash_changes_with_guest(self):
+        report1 = HostGuestAssociationReport(self.config, {'hypervisors': self.create_hypervisors()})
+        hypervisors = self.create_hypervisors()
+        hypervisors[1].guestIds[0].state = Guest.STATE_SHUTOFF
+        report2 = HostGuestAssociationReport(self.config, {'hypervisors': hypervisors})
+        self.assertNotEqual(report1.hash, report2.hash)
+
+    def test_unfrozen_hypervisor_hash_is_not_cached(self):
+        hypervisor = self.create_hypervisors()[0]
+        digest = hypervisor.getHash()
+        hypervisor.guestIds.append(Guest('guest-3', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING))
+        self.assertNotEqual(hypervisor.getHash(), digest)
+
+    def test_frozen_hypervisor_hash_is_computed_once(self):
+        hypervisors = self.create_hypervisors()
+        report = HostGuestAssociationReport(self.config, {'hypervisors': hypervisors}).freeze()
+        expected_hash = report.hash
+        with patch.object(Hypervisor, 'toJSON') as to_json:
+            # New batch report made of already hashed hypervisors
+            batch_report = HostGuestAssociationReport(self.config, {'hypervisors': hypervisors})
+            self.assertEqual(batch_report.hash, expected_hash)
+            self.assertEqual(report.hash, expected_hash)
+            to_json.assert_not_called()
+
+    def test_hash_of_serialized_hypervisor(self):
+        hypervisor = Hypervisor('hypervisor_id_1', [
+            Guest('guest-2', xvirt.CONFIG_TYPE, Guest.STATE_SHUTOFF),
+            Guest('guest-1', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING),
+        ], name='host', facts={Hypervisor.CPU_SOCKET_FACT: '2'})
+        expected = hashlib.sha256(json.dumps(hypervisor.toDict(), sort_keys=True).encode('utf-8')).hexdigest()
+        self.assertEqual(hypervisor.getHash(), expected)
+        self.assertEqual(hypervisor.freeze().getHash(), expected)
+
+
+class TestReportHashBenchmark(BenchmarkBase):
+
+    def test_hash(self):
+        config, d = self.create_fake_config('test')
+        rows = []
+        for guest_count in GUEST_COUNTS:
+            hypervisors = generate_hypervisors(guest_count)
+            report = HostGuestAssociationReport(config, {'hypervisors': hypervisors})
+            serialized = self.measure(lambda: hashlib.sha256(json.dumps(
+                report.serializedAssociation, sort_keys=True).encode('utf-8')).hexdigest())
+            unfrozen = self.measure(lambda: report.hash)
+            report.freeze()
+            first = self.measure(lambda: report.hash, repeat=1)
+            # A new batch made of the same (already hashed) hypervisors
+            batch = self.measure(lambda: HostGuestAssociationReport(
+                config, {'hypervisors': hypervisors}).hash)
+            rows.append((guest_count, serialized, unfrozen, first, batch))
+        self.print_results('Report hash (seconds per call)',
+                           ('guests', 'full serialization', 'not frozen', 'frozen, first', 'frozen, batch'),
+                           rows)
+
+
+class LegacyGuest(object):
+    """
+    Guest model as it was before `__slots__` and interning.
+    """
+    def __init__(self, uuid, virt_type, state):
+        self.uuid = uuid
+        self.virtWhoType = virt_type
+        self.state = state
+
+
+class LegacyHypervisor(object):
+    def __init__(self, hypervisorId, guestIds=None, name=None, facts=None):
+        self.hypervisorId = hypervisorId
+        self.guestIds = guestIds or []
+        self.name = name
+        self.facts = facts
+
+
+@unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+class TestModelMemoryBenchmark(BenchmarkBase):
+
+    @staticmethod
+    def build(data, guest_class, hypervisor_class):
+        # Data are parsed like by the backends, every value is a new string
+        return [
+            hypervisor_class(
+                host['uuid'],
+                [guest_class(guest['guestId'], guest['virtWhoType'], guest['state']) for guest in host['guests']],
+                host['name'],
+                host['facts'])
+            for host in json.loads(data)
+        ]
+
+    @staticmethod
+    def traced(func):
+        """
+        Return memory (in kB) retained by the result of `func` and peak memory during the call.
+        """
+        tracemalloc.start()
+        try:
+            result = func()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del result
+        return current // 1024, peak // 1024
+
+    def test_memory(self):
+        rows = []
+        for guest_count in GUEST_COUNTS:
+            data = json.dumps([{
+                'uuid': hypervisor.hypervisorId,
+                'name': hypervisor.name,
+                'facts': hypervisor.facts,
+                'guests': [{
+                    'guestId': guest.uuid,
+                    'virtWhoType': guest.virtWhoType,
+                    'state': guest.state,
+                } for guest in hypervisor.guestIds],
+            } for hypervisor in generate_hypervisors(guest_count)])
+            legacy, _ = self.traced(lambda: self.build(data, LegacyGuest, LegacyHypervisor))
+            current, _ = self.traced(lambda: self.build(data, Guest, Hypervisor))
+            hypervisors = self.build(data, Guest, Hypervisor)
+            _, to_dict_peak = self.traced(lambda: sum(len(json.dumps(h.toDict(), sort_keys=True)) for h in hypervisors))
+            _, to_json_peak = self.traced(lambda: sum(len(h.toJSON()) for h in hypervisors))
+            rows.append((guest_count, legacy, current, to_dict_peak, to_json_peak))
+        self.print_results(
+            'Memory of host-to-guest model (kB)',
+            ('guests', 'legacy model', 'slots model', 'toDict peak', 'toJSON peak'),
+            rows)
 
 
 class TestDestinationThread(TestBase):
@@ -589,6 +1071,416 @@ class TestDestinationThread(TestBase):
         }
         self.assertEqual(next_data_to_send, expected_next_data_to_send)
 
+    def create_delta_destination_thread(self, source_keys, datastore, manager, **kwargs):
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=source_keys,
+                                               source=datastore,
+                                               dest=manager,
+                                               interval=10,
+                                               terminate_event=Mock(),
+                                               oneshot=False, options=self.options,
+                                               delta_reporting=True, **kwargs)
+        destination_thread.is_initial_run = False
+        destination_thread.is_terminated = Mock(return_value=False)
+        destination_thread.wait = Mock()
+        return destination_thread
+
+    def test_send_data_delta_reporting(self):
+        """
+        Test that only hypervisors that were added, changed or removed since
+        the last report processed by the server are sent in delta reporting mode
+        """
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        config2, d2 = self.create_fake_config('source2', **self.default_config_args)
+
+        def hypervisor(hypervisor_id, *guest_ids):
+            return Hypervisor(hypervisor_id, [Guest(guest_id, 'esx', Guest.STATE_RUNNING) for guest_id in guest_ids])
+
+        report1 = HostGuestAssociationReport(config1, {'hypervisors': [
+            hypervisor('host1', 'guest1'), hypervisor('host2', 'guest2'), hypervisor('host3', 'guest3')
+        ]}).freeze()
+        report2 = HostGuestAssociationReport(config2, {'hypervisors': [hypervisor('host4', 'guest4')]}).freeze()
+        datastore = {'source1': report1, 'source2': report2}
+        manager = Mock()
+        sent_hypervisors = []
+
+        def hypervisorCheckIn(report, options=None):
+            sent_hypervisors.append(dict((h.hypervisorId, [g.uuid for g in h.guestIds])
+                                         for h in report.association['hypervisors']))
+            report.state = AbstractVirtReport.STATE_FINISHED
+            return report
+        manager.hypervisorCheckIn = Mock(side_effect=hypervisorCheckIn)
+        destination_thread = self.create_delta_destination_thread(['source1', 'source2'], datastore, manager)
+
+        # Nothing was acknowledged yet, everything is sent
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(sent_hypervisors[-1], {
+            'host1': ['guest1'], 'host2': ['guest2'], 'host3': ['guest3'], 'host4': ['guest4']
+        })
+
+        # guest2 migrated to host1, host3 was removed and host5 added
+        datastore['source1'] = HostGuestAssociationReport(config1, {'hypervisors': [
+            hypervisor('host1', 'guest1', 'guest2'), hypervisor('host2'), hypervisor('host5', 'guest5')
+        ]}).freeze()
+        data_to_send = destination_thread._get_data()
+        self.assertEqual(list(data_to_send.keys()), ['source1'])
+        destination_thread._send_data(data_to_send)
+        self.assertEqual(sent_hypervisors[-1], {
+            'host1': ['guest1', 'guest2'], 'host2': [], 'host3': [], 'host5': ['guest5']
+        })
+
+        # guest4 stopped
+        datastore['source2'] = HostGuestAssociationReport(config2, {'hypervisors': [
+            hypervisor('host4')
+        ]}).freeze()
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(sent_hypervisors[-1], {'host4': []})
+        self.assertEqual(destination_thread.acknowledged_digests_for_source['source1'],
+                         dict((h.hypervisorId, h.getHash())
+                              for h in datastore['source1'].association['hypervisors']))
+
+    def test_send_data_delta_reporting_failed_job(self):
+        """
+        Test that changes of failed job are sent again in delta reporting mode
+        """
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        hypervisors = [Hypervisor('host%d' % index, []) for index in range(3)]
+        datastore = {'source1': HostGuestAssociationReport(config1, {'hypervisors': hypervisors[:1]}).freeze()}
+        manager = Mock()
+        states = [AbstractVirtReport.STATE_FINISHED, AbstractVirtReport.STATE_FAILED,
+                  AbstractVirtReport.STATE_FINISHED]
+        sent_hypervisors = []
+
+        def hypervisorCheckIn(report, options=None):
+            sent_hypervisors.append(sorted(h.hypervisorId for h in report.association['hypervisors']))
+            report.state = states.pop(0)
+            return report
+        manager.hypervisorCheckIn = Mock(side_effect=hypervisorCheckIn)
+        destination_thread = self.create_delta_destination_thread(['source1'], datastore, manager)
+
+        destination_thread._send_data(destination_thread._get_data())
+        datastore['source1'] = HostGuestAssociationReport(config1, {'hypervisors': hypervisors[:2]}).freeze()
+        destination_thread._send_data(destination_thread._get_data())
+        datastore['source1'] = HostGuestAssociationReport(config1, {'hypervisors': hypervisors}).freeze()
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(sent_hypervisors, [['host0'], ['host1'], ['host1', 'host2']])
+
+    @patch('virtwho.virt.virt.time')
+    def test_send_data_delta_reporting_full_resync(self, mock_time):
+        """
+        Test that complete mapping of all sources is sent when full resync
+        interval expires in delta reporting mode
+        """
+        mock_time.time.return_value = 1000
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        config2, d2 = self.create_fake_config('source2', **self.default_config_args)
+        report1 = HostGuestAssociationReport(config1, {'hypervisors': [
+            Hypervisor('host1', []), Hypervisor('host2', [])
+        ]}).freeze()
+        report2 = HostGuestAssociationReport(config2, {'hypervisors': [Hypervisor('host3', [])]}).freeze()
+        datastore = {'source1': report1, 'source2': report2}
+        manager = Mock()
+        sent_hypervisors = []
+
+        def hypervisorCheckIn(report, options=None):
+            sent_hypervisors.append(sorted(h.hypervisorId for h in report.association['hypervisors']))
+            report.state = AbstractVirtReport.STATE_FINISHED
+            return report
+        manager.hypervisorCheckIn = Mock(side_effect=hypervisorCheckIn)
+        destination_thread = self.create_delta_destination_thread(['source1', 'source2'], datastore, manager,
+                                                                  full_resync_interval=3600)
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(destination_thread.last_full_report_time, 1000)
+
+        # Nothing has changed, nothing is sent
+        mock_time.time.return_value = 2000
+        self.assertEqual(destination_thread._get_data(), {})
+
+        datastore['source1'] = HostGuestAssociationReport(config1, {'hypervisors': [
+            Hypervisor('host1', [])
+        ]}).freeze()
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(sent_hypervisors[-1], ['host2'])
+        self.assertEqual(destination_thread.last_full_report_time, 1000)
+
+        # Complete mapping of all sources is sent again
+        mock_time.time.return_value = 5000
+        data_to_send = destination_thread._get_data()
+        self.assertEqual(sorted(data_to_send.keys()), ['source1', 'source2'])
+        destination_thread._send_data(data_to_send)
+        self.assertEqual(sent_hypervisors[-1], ['host1', 'host3'])
+        self.assertEqual(destination_thread.last_full_report_time, 5000)
+
+    def test_split_hypervisors(self):
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        hypervisors = [
+            Hypervisor('host%d' % index, [Guest('guest%d-%d' % (index, guest), 'esx', Guest.STATE_RUNNING)
+                                          for guest in range(guest_count)])
+            for index, guest_count in enumerate([1, 5, 2, 2, 0, 3])
+        ]
+
+        def split(**kwargs):
+            destination_thread = DestinationThread(Mock(), config, source_keys=['source1'], options=self.options,
+                                                   **kwargs)
+            return [[h.hypervisorId for h in chunk] for chunk in destination_thread._split_hypervisors(hypervisors)]
+
+        self.assertEqual(split(), [['host0', 'host1', 'host2', 'host3', 'host4', 'host5']])
+        self.assertEqual(split(max_hypervisors_per_checkin=4),
+                         [['host0', 'host1', 'host2', 'host3'], ['host4', 'host5']])
+        self.assertEqual(split(max_guests_per_checkin=4),
+                         [['host0'], ['host1'], ['host2', 'host3', 'host4'], ['host5']])
+        self.assertEqual(split(max_hypervisors_per_checkin=2, max_guests_per_checkin=4),
+                         [['host0'], ['host1'], ['host2', 'host3'], ['host4', 'host5']])
+
+    def test_chunked_report_state(self):
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        chunks = [HostGuestAssociationReport(config, {'hypervisors': []}) for _ in range(3)]
+        report = ChunkedReport(config, chunks)
+        self.assertEqual(report.state, AbstractVirtReport.STATE_CREATED)
+        chunks[0].state = AbstractVirtReport.STATE_FINISHED
+        chunks[1].state = AbstractVirtReport.STATE_PROCESSING
+        chunks[2].state = AbstractVirtReport.STATE_FAILED
+        self.assertEqual(report.state, AbstractVirtReport.STATE_PROCESSING)
+        chunks[1].state = AbstractVirtReport.STATE_FINISHED
+        self.assertEqual(report.state, AbstractVirtReport.STATE_FAILED)
+        chunks[2].state = AbstractVirtReport.STATE_FINISHED
+        self.assertEqual(report.state, AbstractVirtReport.STATE_FINISHED)
+
+    def test_send_data_chunked_hypervisor_checkin(self):
+        """
+        Test that large mapping is sent in several requests and the reports
+        are considered processed only when all the jobs are finished
+        """
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        hypervisors = [Hypervisor('host%d' % index, [Guest('guest%d' % index, 'esx', Guest.STATE_RUNNING)])
+                       for index in range(5)]
+        report1 = HostGuestAssociationReport(config1, {'hypervisors': hypervisors}).freeze()
+        datastore = {'source1': report1}
+        manager = Mock()
+        sent_chunks = []
+
+        def hypervisorCheckIn(report, options=None):
+            sent_chunks.append([h.hypervisorId for h in report.association['hypervisors']])
+            report.job_id = 'job%d' % len(sent_chunks)
+            report.state = AbstractVirtReport.STATE_CREATED
+            return report
+        manager.hypervisorCheckIn = Mock(side_effect=hypervisorCheckIn)
+        # First job finishes after the first check, the others after the second one
+        job_states = {
+            'job1': [AbstractVirtReport.STATE_FINISHED],
+            'job2': [AbstractVirtReport.STATE_PROCESSING, AbstractVirtReport.STATE_FINISHED],
+            'job3': [AbstractVirtReport.STATE_PROCESSING, AbstractVirtReport.STATE_FINISHED],
+        }
+
+        def check_report_state(report):
+            report.state = job_states[report.job_id].pop(0)
+        manager.check_report_state = Mock(side_effect=check_report_state)
+
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config, source_keys=['source1'], source=datastore,
+                                               dest=manager, interval=10, terminate_event=Mock(),
+                                               oneshot=False, options=self.options,
+                                               max_hypervisors_per_checkin=2)
+        destination_thread.is_initial_run = False
+        destination_thread.is_terminated = Mock(return_value=False)
+        destination_thread.wait = Mock()
+        destination_thread._send_data(destination_thread._get_data())
+        self.assertEqual(sent_chunks, [['host0', 'host1'], ['host2', 'host3'], ['host4']])
+        submitted_report = destination_thread.submitted_report_and_hash_for_source['source1'][0]
+        self.assertIsInstance(submitted_report, ChunkedReport)
+        self.assertEqual(submitted_report.job_id, 'job1, job2, job3')
+
+        # Some of the jobs are still processing
+        self.assertEqual(destination_thread._get_data(), {})
+        self.assertEqual(manager.check_report_state.call_count, 3)
+        self.assertEqual(submitted_report.state, AbstractVirtReport.STATE_PROCESSING)
+        # All jobs are finished now, only unfinished jobs are checked
+        self.assertEqual(destination_thread._get_data(), {})
+        self.assertEqual(manager.check_report_state.call_count, 5)
+        self.assertEqual(submitted_report.state, AbstractVirtReport.STATE_FINISHED)
+        self.assertEqual(destination_thread.last_report_for_source, {'source1': report1.hash})
+
+    def test_send_data_chunked_hypervisor_checkin_error(self):
+        """
+        Test that the rest of the mapping is not sent when one of the requests fails
+        """
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        hypervisors = [Hypervisor('host%d' % index, []) for index in range(5)]
+        report1 = HostGuestAssociationReport(config1, {'hypervisors': hypervisors}).freeze()
+        manager = Mock()
+        manager.hypervisorCheckIn = Mock(side_effect=[Mock(), ManagerError('failed'), Mock()])
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config, source_keys=['source1'],
+                                               source={'source1': report1}, dest=manager, interval=10,
+                                               terminate_event=Mock(), oneshot=False, options=self.options,
+                                               max_hypervisors_per_checkin=2)
+        destination_thread.is_terminated = Mock(return_value=False)
+        destination_thread._send_data({'source1': report1})
+        self.assertEqual(manager.hypervisorCheckIn.call_count, 2)
+        self.assertEqual(destination_thread.submitted_report_and_hash_for_source, {})
+
+    def test_get_data_initial_waits_for_reports(self):
+        # Show that the initial run waits for the datastore to notify about
+        # new reports instead of polling it
+        source_keys = ['source1', 'source2']
+        report1 = Mock(frozen=True, hash="report1_hash")
+        report2 = Mock(frozen=True, hash="report2_hash")
+        datastore = Datastore()
+        datastore.put('source1', report1)
+
+        def put_report2(source_keys, timeout=None, since=None, waiter=None):
+            self.assertEqual(set(source_keys), set(['source2']))
+            self.assertEqual(since['source2'], 0)
+            datastore.put('source2', report2)
+            return {'source2': 1}
+
+        datastore.wait_for_change = Mock(side_effect=put_report2)
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=source_keys,
+                                               source=datastore,
+                                               dest=Mock(),
+                                               interval=3600,
+                                               terminate_event=Event(),
+                                               oneshot=False, options=self.options)
+        result_data = destination_thread._get_data()
+        self.assertEqual(result_data, {'source1': report1, 'source2': report2})
+        self.assertEqual(datastore.wait_for_change.call_count, 1)
+        self.assertFalse(destination_thread.is_initial_run)
+        self.assertEqual(destination_thread.source_generations, {'source1': 1, 'source2': 0})
+
+    def test_wait_for_next_run(self):
+        # Show that the destination thread waits for new reports, but not
+        # sooner than MinimumSendInterval after previous run
+        source_keys = ['source1']
+        datastore = Mock()
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=source_keys,
+                                               source=datastore,
+                                               dest=Mock(),
+                                               interval=3600,
+                                               terminate_event=Event(),
+                                               oneshot=False, options=self.options)
+        destination_thread.wait = Mock()
+        destination_thread.source_generations = {'source1': 3}
+        # Previous run took 10 seconds
+        destination_thread._wait_for_next_run(3590)
+        destination_thread.wait.assert_called_once_with(MinimumSendInterval - 10)
+        datastore.wait_for_change.assert_called_once_with(
+            source_keys, timeout=3590 - MinimumSendInterval + 10, since={'source1': 3},
+            waiter=destination_thread)
+
+    def test_stop_interrupts_datastore(self):
+        datastore = Mock()
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=['source1'],
+                                               source=datastore,
+                                               dest=Mock(),
+                                               interval=3600,
+                                               terminate_event=Event(),
+                                               oneshot=False, options=self.options)
+        destination_thread.stop()
+        self.assertTrue(destination_thread.is_terminated())
+        datastore.interrupt.assert_called_once_with(destination_thread)
+
+
+class TestDestinationThreadState(TestBase):
+    def setUp(self):
+        self.options = StubEffectiveConfig({VW_GLOBAL: {'print': False}})
+        self.config = Satellite6DestinationInfo(env='env', owner='owner')
+        self.config.name = 'destination'
+        self.source_config, d = self.create_fake_config('source1', owner='owner')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.state_file = StateFile(os.path.join(directory, 'state.json'))
+        self.datastore = Datastore()
+
+    def create_report(self, guest_uuid):
+        return HostGuestAssociationReport(self.source_config, {'hypervisors': [
+            Hypervisor('host-1', [Guest(guest_uuid, xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)])
+        ]}).freeze()
+
+    def create_thread(self, manager, oneshot=False, **kwargs):
+        # Each thread stands for one run of virt-who
+        state_file = StateFile(self.state_file.path)
+        state_file.load()
+        destination_thread = DestinationThread(Mock(), self.config, source_keys=['source1'],
+                                               source=self.datastore, dest=manager, interval=3600,
+                                               terminate_event=Event(), oneshot=oneshot,
+                                               options=self.options, state_file=state_file, **kwargs)
+        destination_thread.wait = Mock()
+        return destination_thread
+
+    def check_in(self, report, options=None):
+        report.job_id = 'job-1'
+        return {'id': 'job-1'}
+
+    def finish_job(self, report):
+        self.assertEqual(report.job_id, 'job-1')
+        report.state = AbstractVirtReport.STATE_FINISHED
+
+    def test_unchanged_report_not_sent_after_restart(self):
+        self.datastore.put('source1', self.create_report('guest-1'))
+        manager = Mock()
+        manager.hypervisorCheckIn.side_effect = self.check_in
+        destination_thread = self.create_thread(manager)
+        destination_thread._send_data(destination_thread._get_data())
+        destination_thread._save_state()
+        self.assertEqual(manager.hypervisorCheckIn.call_count, 1)
+
+        # Job of the report is checked by the next run, the report is not sent again
+        manager = Mock()
+        manager.check_report_state.side_effect = self.finish_job
+        destination_thread = self.create_thread(manager)
+        self.assertEqual(destination_thread._get_data(), {})
+        self.assertEqual(manager.check_report_state.call_count, 1)
+        destination_thread._save_state()
+
+        destination_thread = self.create_thread(manager)
+        self.assertEqual(destination_thread._get_data(), {})
+        self.assertEqual(manager.check_report_state.call_count, 1)
+
+        # Changed report is sent
+        report = self.create_report('guest-2')
+        self.datastore.put('source1', report)
+        destination_thread = self.create_thread(manager)
+        self.assertEqual(destination_thread._get_data(), {'source1': report})
+
+    def test_failed_job_sent_again_after_restart(self):
+        report = self.create_report('guest-1')
+        self.datastore.put('source1', report)
+        manager = Mock()
+        manager.hypervisorCheckIn.side_effect = self.check_in
+        destination_thread = self.create_thread(manager)
+        destination_thread._send_data(destination_thread._get_data())
+        destination_thread._save_state()
+
+        manager.check_report_state.side_effect = lambda report: setattr(
+            report, 'state', AbstractVirtReport.STATE_FAILED)
+        destination_thread = self.create_thread(manager)
+        self.assertEqual(destination_thread._get_data(), {'source1': report})
+
+    def test_oneshot_ignores_state(self):
+        self.state_file.set(destination_key(self.config), {'last_report_for_source': {'source1': 'digest'}})
+        destination_thread = self.create_thread(Mock(), oneshot=True)
+        self.assertIsNone(destination_thread.state_file)
+        self.assertEqual(destination_thread.last_report_for_source, {})
+
+    def test_delta_reporting_state(self):
+        self.state_file.set(destination_key(self.config), {
+            'last_report_for_source': {'source1': 'digest', 'removed_source': 'digest'},
+            'acknowledged_digests_for_source': {'source1': {'host-1': 'digest'}},
+            'last_full_report_time': 1000,
+            'pending': {},
+        })
+        destination_thread = self.create_thread(Mock(), delta_reporting=True)
+        self.assertEqual(destination_thread.last_report_for_source, {'source1': 'digest'})
+        self.assertEqual(destination_thread.acknowledged_digests_for_source, {'source1': {'host-1': 'digest'}})
+        self.assertEqual(destination_thread.last_full_report_time, 1000)
+
 
 class TestDestinationThreadTiming(TestBase):
     """
@@ -3,7 +3,8 @@ from base import TestBase
 
 from mock import patch, Mock, sentinel, call
 from virtwho.virt import IntervalThread
-from threading import Event
+import time
+from threading import Event, Thread
 from datetime import datetime
 
 class TestIntervalThreadTiming(TestBase):
@@ -115,17 +116,20 @@ class TestIntervalThreadTiming(TestBase):
 
     def test_wait(self):
         interval_thread = self.setup_interval_thread()
-        interval_thread.is_terminated = Mock()
-        interval_thread.is_terminated.return_value = False
-        # The total time we expect to be waited
-        wait_time = 10
-        # The time we expect to be waited each interval
-        expected_wait_interval = 1
-        expected_calls = [call(expected_wait_interval) for x in range(wait_time)]
-
-        interval_thread.wait(wait_time=wait_time)
-        self.assertEqual(interval_thread.is_terminated.call_count, wait_time)
-        self.mock_time.assert_has_calls(expected_calls)
+        interval_thread.scheduler = Mock()
+        timer = interval_thread.scheduler.call_later.return_value
+        interval_thread.wait(wait_time=10)
+        interval_thread.scheduler.call_later.assert_called_once_with(10, interval_thread._wakeup.set)
+        interval_thread._wakeup.wait.assert_called_once_with()
+        timer.cancel.assert_called_once_with()
+        self.mock_time.assert_not_called()
+
+    def test_wait_terminated(self):
+        interval_thread = self.setup_interval_thread()
+        interval_thread.scheduler = Mock()
+        self.terminate_event.is_set.return_value = True
+        interval_thread.wait(wait_time=10)
+        interval_thread.scheduler.call_later.assert_not_called()
 
     def test_is_terminated_terminate_event(self):
         interval_thread = self.setup_interval_thread()
@@ -150,6 +154,7 @@ class TestIntervalThreadTiming(TestBase):
         interval_thread = self.setup_interval_thread()
         interval_thread.stop()
         self.mock_internal_terminate_event.set.assert_called()
+        interval_thread._wakeup.set.assert_called()
 
     def test_run(self):
         oneshot = False
@@ -185,3 +190,30 @@ class TestIntervalThreadTiming(TestBase):
         interval_thread.wait = Mock()
         interval_thread.run()
         interval_thread.wait.assert_not_called()
+
+
+class TestIntervalThreadWait(TestBase):
+    def test_stop_interrupts_wait(self):
+        interval_thread = IntervalThread(self.logger, Mock(), interval=3600)
+        waiter = Thread(target=interval_thread.wait, args=(3600,))
+        waiter.start()
+        # Give the thread a chance to block on its timer
+        time.sleep(0.05)
+        start = time.time()
+        interval_thread.stop()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_elapses(self):
+        interval_thread = IntervalThread(self.logger, Mock(), interval=1)
+        start = time.time()
+        interval_thread.wait(0.1)
+        self.assertGreaterEqual(time.time() - start, 0.09)
+        self.assertFalse(interval_thread.is_terminated())
+
+    def test_wait_terminated(self):
+        interval_thread = IntervalThread(self.logger, Mock(), interval=1)
+        self.assertFalse(interval_thread.wait_terminated(0.01))
+        interval_thread.stop()
+        self.assertTrue(interval_thread.wait_terminated())
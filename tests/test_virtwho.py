@@ -22,15 +22,17 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import sys
 import copy
 import os
+import shutil
+import tempfile
 import pytest
 import six
 
-from mock import patch, Mock, call
+from mock import patch, Mock, ANY
 
 from base import TestBase
 
 from virtwho import util
-from virtwho.config import VW_GLOBAL, VW_ENV_CLI_SECTION_NAME
+from virtwho.config import VW_GLOBAL, VW_ENV_CLI_SECTION_NAME, init_config
 from virtwho.parser import parse_options, OptionError
 from virtwho.executor import Executor
 
@@ -315,17 +317,107 @@ class TestExecutor(TestBase):
 
         threads = [mock_thread1, mock_thread2]
 
-        mock_time.sleep = Mock()
         Executor.wait_on_threads(threads)
-        mock_time.sleep.assert_has_calls([
-            call(1),
-            call(1),
-        ])
+        mock_thread1.wait_terminated.assert_called_once_with(ANY)
+        mock_thread2.wait_terminated.assert_called_once_with(ANY)
+        mock_time.sleep.assert_not_called()
         mock_terminate_threads.assert_not_called()
 
+    @patch.object(Executor, 'terminate_threads')
+    def test_wait_on_threads_timeout(self, mock_terminate_threads):
+        mock_thread = Mock()
+        mock_thread.is_terminated = Mock(return_value=False)
+        self.assertEqual(Executor.wait_on_threads([mock_thread], max_wait_time=0), [mock_thread])
+        mock_terminate_threads.assert_not_called()
+        self.assertEqual(Executor.wait_on_threads([mock_thread], max_wait_time=0, kill_on_timeout=True), [])
+        mock_terminate_threads.assert_called_once_with([mock_thread])
+
     def test_terminate_threads(self):
         threads = [Mock(), Mock()]
         Executor.terminate_threads(threads)
         for mock_thread in threads:
             mock_thread.stop.assert_called()
             mock_thread.join.assert_called()
+
+
+class TestExecutorReload(TestBase):
+    HYPERVISOR_JSON = '{"hypervisors": [{"uuid": "host-1", "guests": []}]}'
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.config_dir)
+        self.hypervisor_file = os.path.join(self.config_dir, "hypervisor.json")
+        with open(self.hypervisor_file, "w") as f:
+            f.write(self.HYPERVISOR_JSON)
+        # Threads are not really started
+        start_patcher = patch('virtwho.virt.virt.IntervalThread.start')
+        start_patcher.start()
+        self.addCleanup(start_patcher.stop)
+        manager_patcher = patch('virtwho.executor.Manager')
+        manager_patcher.start()
+        self.addCleanup(manager_patcher.stop)
+        # Don't start the thread of the queue logger
+        log_patcher = patch('virtwho.executor.log')
+        log_patcher.start()
+        self.addCleanup(log_patcher.stop)
+
+    def write_config(self, owners, interval=3600):
+        with open(os.path.join(self.config_dir, "test.conf"), "w") as f:
+            for name, owner in sorted(owners.items()):
+                f.write("[%s]\ntype=fake\nis_hypervisor=true\nowner=%s\nenv=env\nfile=%s\n\n" %
+                        (name, owner, self.hypervisor_file))
+        effective_config = init_config({}, {'interval': interval}, config_dir=self.config_dir)
+        effective_config[VW_GLOBAL]['persist_state'] = False
+        return effective_config
+
+    def create_executor(self, effective_config):
+        executor = Executor(Mock(), effective_config)
+        executor.virts = executor._create_virt_backends()
+        executor.destinations = executor._create_destinations()
+        return executor
+
+    def test_reload_unchanged(self):
+        executor = self.create_executor(self.write_config({'test1': 'owner', 'test2': 'owner'}))
+        virts = list(executor.virts)
+        destinations = list(executor.destinations)
+        self.assertFalse(executor.reload(self.write_config({'test1': 'owner', 'test2': 'owner'})))
+        self.assertEqual(executor.virts, virts)
+        self.assertEqual(executor.destinations, destinations)
+        self.assertFalse(any(virt.is_terminated() for virt in virts))
+
+    def test_reload_changed_config(self):
+        executor = self.create_executor(self.write_config({'test1': 'owner', 'test2': 'owner'}))
+        virt1, virt2 = sorted(executor.virts, key=lambda virt: virt.config.name)
+        report = Mock(frozen=True)
+        executor.datastore.put('test1', report)
+        executor.datastore.put('test2', report)
+
+        # test2 is moved to another owner, so it has its own destination
+        self.assertFalse(executor.reload(self.write_config({'test1': 'owner', 'test2': 'other'})))
+        self.assertIn(virt1, executor.virts)
+        self.assertNotIn(virt2, executor.virts)
+        self.assertFalse(virt1.is_terminated())
+        self.assertTrue(virt2.is_terminated())
+        self.assertEqual(sorted(virt.config.name for virt in executor.virts), ['test1', 'test2'])
+        self.assertEqual(sorted(sorted(destination.source_keys) for destination in executor.destinations),
+                         [['test1'], ['test2']])
+        # Report of unchanged config is kept
+        self.assertIs(executor.datastore.get('test1'), report)
+        self.assertRaises(KeyError, executor.datastore.get, 'test2')
+
+        # Removing test2 keeps the destination of test1
+        destinations = list(executor.destinations)
+        self.assertFalse(executor.reload(self.write_config({'test1': 'owner'})))
+        self.assertEqual([virt.config.name for virt in executor.virts], ['test1'])
+        self.assertEqual(len(executor.destinations), 1)
+        self.assertIn(executor.destinations[0], destinations)
+
+    def test_reload_changed_global_options(self):
+        executor = self.create_executor(self.write_config({'test1': 'owner'}))
+        virts = list(executor.virts)
+        datastore = executor.datastore
+        effective_config = self.write_config({'test1': 'owner'}, interval=7200)
+        self.assertTrue(executor.reload(effective_config))
+        self.assertTrue(virts[0].is_terminated())
+        self.assertIsNot(executor.datastore, datastore)
+        self.assertIs(executor.options, effective_config)
@@ -0,0 +1,139 @@
+from __future__ import print_function
+"""
+Test of running virt backends in worker processes.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import logging
+import time
+from threading import Event
+
+from base import TestBase
+
+from mock import Mock
+
+from virtwho import metrics
+from virtwho.datastore import Datastore
+from virtwho.virt import (DomainListReport, ErrorReport, Guest,
+                          HostGuestAssociationReport, Hypervisor, Virt)
+from virtwho.workers import WorkerProcess, decode_report, encode_report
+
+
+class TestReportEncoding(TestBase):
+    def setUp(self):
+        self.config, d = self.create_fake_config('test')
+        self.guests = [
+            Guest('guest-1', 'esx', Guest.STATE_RUNNING),
+            Guest('guest-2', 'esx', Guest.STATE_SHUTOFF),
+        ]
+
+    def test_host_guest_association(self):
+        report = HostGuestAssociationReport(self.config, {'hypervisors': [
+            Hypervisor('host-1', self.guests, name='host-1.example.com', facts={'cpu.cpu_socket(s)': '2'}),
+            Hypervisor('host-2'),
+        ]}, exclude_hosts=['host-2'])
+        decoded = decode_report(self.config, encode_report(report))
+        self.assertIsInstance(decoded, HostGuestAssociationReport)
+        self.assertIs(decoded.config, self.config)
+        self.assertEqual(decoded.hash, report.hash)
+        self.assertEqual([h.hypervisorId for h in decoded.association['hypervisors']], ['host-1'])
+
+    def test_domain_list(self):
+        report = DomainListReport(self.config, self.guests, hypervisor_id='host-1')
+        decoded = decode_report(self.config, encode_report(report))
+        self.assertIsInstance(decoded, DomainListReport)
+        self.assertEqual(decoded.hypervisor_id, 'host-1')
+        self.assertEqual(decoded.hash, report.hash)
+
+    def test_error(self):
+        decoded = decode_report(self.config, encode_report(ErrorReport(self.config)))
+        self.assertIsInstance(decoded, ErrorReport)
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, encode_report, object())
+        self.assertRaises(ValueError, decode_report, self.config, ('unknown',))
+
+
+class TestWorkerProcess(TestBase):
+    def test_reports_sent_to_parent(self):
+        config, d = self.create_fake_config('test')
+        guests = [Guest('guest-1', 'esx', Guest.STATE_RUNNING)]
+        report = DomainListReport(config, guests, hypervisor_id='host-1')
+
+        def create_virt_backends(configs, dest):
+            # Runs in the worker process
+            self.assertEqual(configs, [('test', config)])
+            dest.put('test', report)
+            return []
+
+        executor = Mock()
+        executor.logger = logging.getLogger('virtwho.test_workers')
+        executor._create_virt_backends.side_effect = create_virt_backends
+        datastore = Datastore()
+        worker = WorkerProcess(executor, 0, [('test', config)], datastore)
+        worker.start()
+        self.assertTrue(worker.wait_terminated(10))
+        worker.join(10)
+        self.assertEqual(worker.process.exitcode, 0)
+        stored = datastore.get('test')
+        self.assertIsInstance(stored, DomainListReport)
+        self.assertTrue(stored.frozen)
+        self.assertEqual(stored.hash, report.hash)
+
+    def test_metrics_sent_to_parent(self):
+        config, d = self.create_fake_config('test')
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+        metrics.REPORTS.inc(config='test', type='domains')
+
+        def create_virt_backends(configs, dest):
+            # Runs in the worker process, metrics are recorded like by a source
+            virt = Virt(executor.logger, config, dest, interval=3600)
+            virt._observe_get_data(time.time())
+            virt._send_data(DomainListReport(config, [Guest('guest-1', 'esx', Guest.STATE_RUNNING)],
+                                             hypervisor_id='host-1'))
+            # Recorded after the last report, sent when the worker exits
+            metrics.ESX_RESPONSE_BYTES.inc(100, config='test')
+            return []
+
+        executor = Mock()
+        executor.logger = logging.getLogger('virtwho.test_workers')
+        executor._create_virt_backends.side_effect = create_virt_backends
+        worker = WorkerProcess(executor, 0, [('test', config)], Datastore())
+        worker.start()
+        self.assertTrue(worker.wait_terminated(10))
+        worker.join(10)
+        self.assertEqual(worker.process.exitcode, 0)
+        # Values of the parent are increased by the worker
+        self.assertEqual(metrics.REPORTS.get(config='test', type='domains'), 2)
+        self.assertEqual(metrics.REPORT_GUESTS.get(config='test'), 1)
+        self.assertEqual(metrics.GET_DATA_SECONDS.get(thread='test')[0], 1)
+        self.assertEqual(metrics.ESX_RESPONSE_BYTES.get(config='test'), 100)
+
+    def test_stop(self):
+        config, d = self.create_fake_config('test')
+        executor = Mock()
+        executor.logger = logging.getLogger('virtwho.test_workers')
+        executor._create_virt_backends.return_value = []
+        executor.terminate_event = Event()
+        # Block the worker until it's terminated
+        executor.wait_on_threads.side_effect = lambda virts: executor.terminate_event.wait()
+        worker = WorkerProcess(executor, 0, [('test', config)], Datastore())
+        worker.start()
+        self.assertFalse(worker.wait_terminated(0.1))
+        worker.stop()
+        self.assertTrue(worker.wait_terminated(10))
+        worker.join(10)
@@ -160,6 +160,7 @@ fi
 %{_mandir}/man5/virt-who-config.5.gz
 %attr(700, root, root) %{_sharedstatedir}/%{name}
 %ghost %{_sharedstatedir}/%{name}/key
+%ghost %{_sharedstatedir}/%{name}/state.json
 %{_datadir}/zsh/site-functions/_virt-who
 %{_sysconfdir}/virt-who.d/template.conf
 %attr(600, root, root) %config(noreplace) %{_sysconfdir}/virt-who.conf
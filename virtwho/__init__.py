@@ -4,6 +4,8 @@ from __future__ import print_function
 DefaultInterval = 3600  # One per hour
 MinimumSendInterval = 60  # One minute
 MinimumJobPollInterval = 15
+# Default interval for sending complete mapping in delta reporting mode
+DefaultFullResyncInterval = 86400  # One per day
 
 SAT5 = "satellite"
 SAT6 = "sam"
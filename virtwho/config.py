@@ -31,6 +31,7 @@ from virtwho import log, SAT5, SAT6
 from .password import Password
 from binascii import unhexlify
 from . import util
+from . import metrics, state
 
 try:
     from collections import OrderedDict
@@ -55,6 +56,8 @@ FILTER_TYPES = ("regex", "wildcards")
 # Default interval for sending list of UUIDs
 DefaultInterval = 3600  # One per hour
 MinimumSendInterval = 60  # One minute
+# Default interval for sending complete mapping in delta reporting mode
+DefaultFullResyncInterval = 86400  # One per day
 
 
 class InvalidOption(Error):
@@ -378,6 +381,23 @@ class DestinationToSourceMapper(object):
     def add_config(self, config):
         self._configs.append(config)
 
+    def shard(self, count, names=None):
+        """
+        Split source configs into at most `count` groups of similar size,
+        used to run the virt backends in several processes.
+
+        @param count: number of groups
+        @type count: int
+        @param names: names of the configs to split, all configs by default
+        @type names: list
+        @return: list of non-empty lists of (name, config) tuples
+        @rtype: list
+        """
+        configs = sorted([(name, config) for name, config in self._configs
+                          if names is None or name in names], key=lambda item: item[0])
+        shards = [configs[index::count] for index in range(count)]
+        return [shard for shard in shards if shard]
+
 
 def _all_parser_sections(parser):
     all_sections = {}
@@ -772,6 +792,21 @@ class ConfigSection(collections.MutableMapping):
         section.update(**values)
         return section
 
+    def _validate_non_negative_integer(self, key):
+        result = None
+        try:
+            self._values[key] = int(self._values[key])
+            if self._values[key] < 0:
+                raise ValueError("negative value")
+        except (TypeError, ValueError) as e:
+            result = (
+                'warning',
+                '%s was not set to a valid non-negative integer: %s, using default: %s' %
+                (key, str(e), self.defaults[key])
+            )
+            self._values[key] = self.defaults[key]
+        return result
+
     def _validate_str_to_bool(self, key):
         result = None
         try:
@@ -920,6 +955,8 @@ class VirtConfigSection(ConfigSection):
         self.add_key('rhsm_port', validation_method=self._validate_non_empty_string)
         self.add_key('rhsm_prefix', validation_method=self._validate_non_empty_string)
         self.add_key('rhsm_insecure', validation_method=self._validate_non_empty_string)
+        # Compiled matchers of filter options
+        self._host_filters = {}
 
     def __setitem__(self, key, value):
         for old_key, new_key in self.RENAMED_OPTIONS:
@@ -953,6 +990,32 @@ class VirtConfigSection(ConfigSection):
                     self._required_keys.discard('env')
         super(VirtConfigSection, self)._pre_validate()
 
+    def _post_validate(self):
+        super(VirtConfigSection, self)._post_validate()
+        # Compile all filter options now, reports just reuse the matchers
+        for key, validation_method in self.validation_methods.items():
+            if validation_method == self._validate_filter:
+                self.host_filter(key)
+
+    def host_filter(self, key):
+        """
+        Get compiled matcher for filter option (e.g. 'filter_hosts', 'exclude_hosts')
+        :param key: key of filter option
+        :return: instance of util.HostFilter or None, when the option is not set
+        """
+        patterns = self._values.get(key)
+        if patterns is None or patterns is NotSetSentinel or isinstance(patterns, six.string_types):
+            # The option is not set or it was not validated yet
+            self._host_filters.pop(key, None)
+            return None
+        filter_type = self._values.get('filter_type')
+        host_filter = self._host_filters.get(key)
+        if host_filter is None or host_filter.patterns != tuple(patterns) or \
+                host_filter.filter_type != filter_type:
+            host_filter = util.HostFilter(patterns, filter_type)
+            self._host_filters[key] = host_filter
+        return host_filter
+
     def _validate_sm_type(self, key):
         result = None
         try:
@@ -1188,6 +1251,23 @@ class VirtConfigSection(ConfigSection):
                 (filter_key, ', '.join(FILTER_TYPES))
             ))
 
+        # Regular expressions are compiled by util.HostFilter, reject invalid ones now
+        filter_type = self._values.get('filter_type')
+        if filter_type in (None, 'regex'):
+            invalid_regexes = util.HostFilter.invalid_regexes(self._values[filter_key])
+            if len(invalid_regexes) > 0 and filter_type == 'regex':
+                result.append((
+                    'error',
+                    'Filter values: "%s" of "%s" are not valid regular expressions' %
+                    ('", "'.join(invalid_regexes), filter_key)
+                ))
+            elif len(invalid_regexes) > 0:
+                result.append((
+                    'warning',
+                    'Filter values: "%s" of "%s" are not valid regular expressions, using them only as wildcards' %
+                    ('", "'.join(invalid_regexes), filter_key)
+                ))
+
         if len(result) == 0:
             result = None
 
@@ -1212,6 +1292,47 @@ class GlobalSection(ConfigSection):
         self.add_key('interval',  validation_method=self._validate_interval, default=DefaultInterval)
         self.add_key('log_file', validation_method=self._validate_non_empty_string, default=log.DEFAULT_LOG_FILE)
         self.add_key('log_dir', validation_method=self._validate_non_empty_string, default=log.DEFAULT_LOG_DIR)
+        self.add_key('delta_reporting', validation_method=self._validate_str_to_bool, default=False)
+        self.add_key('full_resync_interval', validation_method=self._validate_non_negative_integer,
+                     default=DefaultFullResyncInterval)
+        self.add_key('max_hypervisors_per_checkin', validation_method=self._validate_non_negative_integer,
+                     default=0)
+        self.add_key('max_guests_per_checkin', validation_method=self._validate_non_negative_integer,
+                     default=0)
+        self.add_key('max_workers', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('max_polls_per_server', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('workers', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('poll_splay', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('max_concurrent_logins', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('adaptive_interval', validation_method=self._validate_str_to_bool, default=False)
+        self.add_key('min_interval', validation_method=self._validate_min_interval, default=MinimumSendInterval)
+        self.add_key('max_interval', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('metrics_listen', validation_method=self._validate_metrics_listen, default=None)
+        self.add_key('metrics_file', validation_method=self._validate_non_empty_string, default=None)
+        self.add_key('trace_file', validation_method=self._validate_non_empty_string, default=None)
+        self.add_key('trace_log', validation_method=self._validate_str_to_bool, default=False)
+        self.add_key('persist_state', validation_method=self._validate_str_to_bool, default=True)
+        self.add_key('state_file', validation_method=self._validate_non_empty_string,
+                     default=state.DEFAULT_STATE_FILE)
+
+    def _validate_min_interval(self, key):
+        result = self._validate_non_negative_integer(key)
+        if result is None and self._values[key] < MinimumSendInterval:
+            result = ('warning', "%s value can't be lower than %d seconds, it will be used instead" %
+                      (key, MinimumSendInterval))
+            self._values[key] = MinimumSendInterval
+        return result
+
+    def _validate_metrics_listen(self, key):
+        result = self._validate_non_empty_string(key)
+        if result is None:
+            try:
+                metrics.parse_address(self._values[key])
+            except ValueError as e:
+                result = ('warning', '%s is not a valid address ([host:]port): %s, metrics are not served' %
+                          (key, str(e)))
+                self._values[key] = None
+        return result
 
     def _validate_interval(self, key):
         result = None
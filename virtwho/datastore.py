@@ -20,15 +20,33 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 import copy
-from threading import Lock
+import time
+import weakref
+from threading import Lock, Condition
 
 
 class Datastore(object):
-    """ This class is a threadsafe datastore"""
+    """
+    This class is a threadsafe datastore
+
+    Values are deep-copied when they are stored, unless they are frozen
+    (see `virtwho.virt.AbstractVirtReport.freeze`). Frozen values can't be
+    modified, so only the reference to them is stored and `put`/`get` don't
+    depend on the size of the value.
+
+    Every key has a generation counter that is increased by each `put`
+    and `remove`. Consumers can block in `wait_for_change` until a value
+    for one of the keys they are interested in is stored.
+    """
 
     def __init__(self, *args, **kwargs):
         self._datastore = dict()
         self._datastore_lock = Lock()
+        self._generations = dict()
+        self._interrupts = 0
+        # Waiters that were interrupted and haven't returned from wait yet
+        self._interrupted = weakref.WeakSet()
+        self._changed = Condition()
 
     def put(self, key, value):
         """
@@ -40,9 +58,15 @@ class Datastore(object):
 
         @param value: The object to store
         """
-        to_store = copy.deepcopy(value)
+        if getattr(value, 'frozen', False) is True:
+            to_store = value
+        else:
+            to_store = copy.deepcopy(value)
         with self._datastore_lock:
             self._datastore[key] = to_store
+        with self._changed:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._changed.notify_all()
 
     def get(self, key, default=None):
         """
@@ -65,3 +89,95 @@ class Datastore(object):
                 if default:
                     return default
                 raise
+
+    def remove(self, key):
+        """
+        Removes the value for the given key, if there is any. Used when
+        the source of the value is no longer used.
+
+        @param key: The unique identifier for the value
+        @type  key: str
+        """
+        with self._datastore_lock:
+            self._datastore.pop(key, None)
+        with self._changed:
+            # Value stored under the same key later must not look like
+            # the one that was removed
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._changed.notify_all()
+
+    def generations(self, keys):
+        """
+        Returns current generations of given keys. Generation of a key
+        that has never been stored is 0.
+
+        @param keys: The keys to get the generations for
+        @type keys: Iterable
+
+        @rtype: dict
+        """
+        with self._changed:
+            return dict((key, self._generations.get(key, 0)) for key in keys)
+
+    def _changed_keys(self, keys, since):
+        return dict((key, self._generations.get(key, 0)) for key in keys
+                    if self._generations.get(key, 0) != since.get(key, 0))
+
+    def wait_for_change(self, keys, timeout=None, since=None, waiter=None):
+        """
+        Blocks until a new value is stored for at least one of the keys,
+        the timeout expires or `interrupt` is called (for this waiter).
+
+        @param keys: The keys to watch
+        @type keys: Iterable
+
+        @param timeout: An optional max amount of seconds to wait
+        @type timeout: float
+
+        @param since: Generations of the keys (as returned by `generations`)
+        that the caller has already seen. Current generations are used by
+        default, so only subsequent `put` calls are reported.
+        @type since: dict
+
+        @param waiter: An optional object identifying the caller, that
+        can be passed to `interrupt` to wake up only this caller
+
+        @return: Generations of the keys that have changed, empty dict when
+        the timeout expired or waiting was interrupted
+        @rtype: dict
+        """
+        keys = list(keys)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            if since is None:
+                since = dict((key, self._generations.get(key, 0)) for key in keys)
+            interrupts = self._interrupts
+            changed = self._changed_keys(keys, since)
+            while not changed:
+                if interrupts != self._interrupts:
+                    break
+                if waiter is not None and waiter in self._interrupted:
+                    self._interrupted.discard(waiter)
+                    break
+                if deadline is None:
+                    self._changed.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                changed = self._changed_keys(keys, since)
+            return changed
+
+    def interrupt(self, waiter=None):
+        """
+        Wakes up the thread that is blocked in `wait_for_change` with given
+        `waiter`, all threads that are blocked in it when `waiter` is None.
+        Waiter that isn't blocked yet returns from the next call right away.
+        """
+        with self._changed:
+            if waiter is None:
+                self._interrupts += 1
+            else:
+                self._interrupted.add(waiter)
+            self._changed.notify_all()
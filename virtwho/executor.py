@@ -4,11 +4,16 @@ import time
 from threading import Event
 
 from virtwho import log
+from virtwho.metrics import MetricsServer, MetricsFile
+from virtwho.tracing import Tracer, set_tracer
 
 from virtwho.config import DestinationToSourceMapper, VW_GLOBAL
 from virtwho.datastore import Datastore
 from virtwho.manager import Manager
-from virtwho.virt import Virt, info_to_destination_class
+from virtwho.state import StateFile, destination_key
+from virtwho.virt import Virt, VirtPool, LoginLimiter, AdaptiveInterval, start_delay, \
+    info_to_destination_class
+from virtwho.workers import WorkerProcess
 
 try:
     from collections import OrderedDict
@@ -16,6 +21,10 @@ except ImportError:
     # Python 2.6 doesn't have OrderedDict, we need to have our own
     from .util import OrderedDict
 
+# The main thread never blocks without timeout, Python 2 wouldn't
+# run signal handlers (SIGHUP, SIGTERM) in the meantime
+MaximumBlockingWait = 60
+
 
 class ReloadRequest(Exception):
     ''' Reload of virt-who was requested by sending SIGHUP signal. '''
@@ -43,24 +52,65 @@ class Executor(object):
         self.terminate_event = Event()
         self.virts = []
         self.destinations = []
+        # Worker pool running polling virt backends, if enabled
+        self.pool = None
+        # Exporters of the metrics, if enabled
+        self.metrics_exporters = []
 
         # Queue for getting events from virt backends
         self.datastore = Datastore()
         self.reloading = False
 
-        self.dest_to_source_mapper = DestinationToSourceMapper(options)
+        # State of destinations kept across restarts, it's not reset by reload
+        self.state_file = None
+        self._set_options(options)
 
         for name, config in self.dest_to_source_mapper.configs:
             logger.info("Using config named '%s'" % name)
 
-    def _create_virt_backends(self):
+    def _set_options(self, options):
+        """
+        Use `options` (effective config) for virt backends and destinations
+        created from now on.
+        """
+        self.options = options
+        self.dest_to_source_mapper = DestinationToSourceMapper(options)
+        state_file = None
+        if options[VW_GLOBAL]['persist_state']:
+            state_file = StateFile(options[VW_GLOBAL]['state_file'], self.logger)
+            state_file.load()
+        self.state_file = state_file
+        max_concurrent_logins = options[VW_GLOBAL]['max_concurrent_logins']
+        self.login_limiter = LoginLimiter(max_concurrent_logins) if max_concurrent_logins else None
+
+    def _stagger(self, thread):
+        """
+        Set delay of the first run of `thread`, the threads start spread
+        over `poll_splay` seconds (at most the interval). The delay depends
+        on the name of the thread and the reporter_id, so it doesn't change
+        between restarts and differs between virt-who hosts.
+        """
+        if self.options[VW_GLOBAL]['oneshot']:
+            return
+        splay = min(self.options[VW_GLOBAL]['poll_splay'], self.options[VW_GLOBAL]['interval'])
+        key = '%s/%s' % (self.options[VW_GLOBAL]['reporter_id'], thread.config.name)
+        thread.start_delay = start_delay(key, splay)
+
+    def _create_virt_backends(self, configs=None, dest=None):
         """
         Create virts list with virt backend threads
+
+        @param configs: list of (name, config) tuples, all configs by default
+        @param dest: where the reports are placed, the datastore by default
         """
+        if configs is None:
+            configs = self.dest_to_source_mapper.configs
+        if dest is None:
+            dest = self.datastore
         virts = []
-        for name, config in self.dest_to_source_mapper.configs:
+        for name, config in configs:
             try:
-                virt = Virt.from_config(self.logger, config, self.datastore,
+                virt = Virt.from_config(self.logger, config, dest,
                                         terminate_event=self.terminate_event,
                                         interval=self.options[VW_GLOBAL]['interval'],
                                         oneshot=self.options[VW_GLOBAL]['oneshot'])
@@ -70,20 +120,87 @@ class Executor(object):
             virts.append(virt)
         return virts
 
-    def _create_destinations(self):
-        """Populate self.destinations with a list of  list with them
+    def _adaptive_interval(self, virt):
+        """
+        Return `AdaptiveInterval` for polling `virt` when `adaptive_interval`
+        is enabled, backends waiting for events keep the interval.
+        """
+        options = self.options[VW_GLOBAL]
+        if not options['adaptive_interval'] or options['oneshot'] or virt.event_driven:
+            return None
+        interval = options['interval']
+        # Without max_interval, the interval could grow four times
+        max_interval = options['max_interval'] or 4 * interval
+        return AdaptiveInterval(interval, options['min_interval'], max_interval)
+
+    def _start_virts(self, virts=None):
+        """
+        Start the virt backends, all of them by default. Polling backends
+        are run by the worker pool when `max_workers` is set, others get
+        a thread of their own.
+        """
+        if virts is None:
+            virts = self.virts
+        for virt in virts:
+            self._stagger(virt)
+            virt.login_limiter = self.login_limiter
+            virt.adaptive_interval = self._adaptive_interval(virt)
+        max_workers = self.options[VW_GLOBAL]['max_workers']
+        pooled = [virt for virt in virts if max_workers and not virt.event_driven]
+        if pooled:
+            if self.pool is None:
+                self.logger.debug("Polling %d configs using %d worker threads",
+                                  len(pooled), min(max_workers, len(pooled)))
+                self.pool = VirtPool(self.logger, min(max_workers, len(pooled)),
+                                     max_polls_per_server=self.options[VW_GLOBAL]['max_polls_per_server'])
+                self.pool.start()
+            for virt in pooled:
+                self.pool.add(virt)
+        for virt in virts:
+            if virt not in pooled:
+                virt.start()
+
+    def _start_sources(self):
+        """
+        Start the virt backends, in `workers` processes if it is set.
+        In that case `virts` are replaced by the worker processes.
+        """
+        workers = self.options[VW_GLOBAL]['workers']
+        if not workers:
+            self._start_virts()
+            return
+        names = [virt.config.name for virt in self.virts]
+        shards = self.dest_to_source_mapper.shard(workers, names)
+        self.logger.debug("Running %d configs in %d worker processes", len(names), len(shards))
+        self.virts = [WorkerProcess(self, index, configs, self.datastore)
+                      for index, configs in enumerate(shards)]
+        for worker in self.virts:
+            worker.start()
+
+    @staticmethod
+    def _destination_name(info):
+        """
+        Return name of the destination, it's the same for equal destination
+        infos, even in different configurations read by reload.
+        """
+        return "destination_%s" % destination_key(info)[:16]
+
+    def _create_destinations(self, infos=None):
+        """Create destination threads for given destination infos
 
-            @param reset: Whether to kill existing destinations or not, defaults
-            to false
-            @type: bool
+            @param infos: Destination infos, all destinations of the
+            configuration by default
+            @type: list
         """
+        if infos is None:
+            infos = self.dest_to_source_mapper.dests
         dests = []
-        for info in self.dest_to_source_mapper.dests:
+        for info in infos:
             # Dests should already include all destinations we want created
             # at this time. This method will make no assumptions of creating
             # defaults of any kind.
             source_keys = self.dest_to_source_mapper.dest_to_sources_map[info]
-            info.name = "destination_%s" % hash(info)
+            info.name = self._destination_name(info)
             logger = log.getLogger(name=info.name)
             manager = Manager.fromInfo(logger, self.options, info)
             dest_class = info_to_destination_class[type(info)]
@@ -93,7 +210,13 @@ class Executor(object):
                               source=self.datastore, dest=manager,
                               terminate_event=self.terminate_event,
                               interval=self.options[VW_GLOBAL]['interval'],
-                              oneshot=self.options[VW_GLOBAL]['oneshot'])
+                              oneshot=self.options[VW_GLOBAL]['oneshot'],
+                              delta_reporting=self.options[VW_GLOBAL]['delta_reporting'],
+                              full_resync_interval=self.options[VW_GLOBAL]['full_resync_interval'],
+                              max_hypervisors_per_checkin=self.options[VW_GLOBAL]['max_hypervisors_per_checkin'],
+                              max_guests_per_checkin=self.options[VW_GLOBAL]['max_guests_per_checkin'],
+                              state_file=self.state_file)
+            self._stagger(dest)
             dests.append(dest)
         return dests
 
@@ -118,24 +241,24 @@ class Executor(object):
         not quit yet.
         @rtype: list
         """
-        delta_time = 1.0
-        total_waited = 0
+        deadline = None if max_wait_time is None else time.time() + max_wait_time
         threads_not_terminated = list(threads)
-        while len(threads_not_terminated) > 0:
-            if max_wait_time is not None and total_waited > max_wait_time:
-                if kill_on_timeout:
-                    Executor.terminate_threads(threads_not_terminated)
-                    return []
-                return threads_not_terminated
-            for thread in threads_not_terminated:
-                if thread.is_terminated():
-                    threads_not_terminated.remove(thread)
+        while True:
+            threads_not_terminated = [thread for thread in threads_not_terminated
+                                      if not thread.is_terminated()]
             if not threads_not_terminated:
-                break
-            time.sleep(delta_time)
-            if max_wait_time is not None:
-                total_waited += 1 * 1.0/delta_time
-        return threads_not_terminated
+                return []
+            timeout = MaximumBlockingWait
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if kill_on_timeout:
+                        Executor.terminate_threads(threads_not_terminated)
+                        return []
+                    return threads_not_terminated
+                timeout = min(timeout, remaining)
+            # Remaining threads are checked once this one terminates
+            threads_not_terminated[0].wait_terminated(timeout)
 
     @staticmethod
     def terminate_threads(threads):
@@ -160,8 +283,8 @@ class Executor(object):
             self.logger.error(err)
             raise ExitRequest(code=1, message=err)
 
-        for thread in self.virts:
-            thread.start()
+        self._start_tracing()
+        self._start_sources()
 
         Executor.wait_on_threads(self.virts)
 
@@ -205,21 +328,71 @@ class Executor(object):
             self.logger.error(err)
             raise ExitRequest(code=1, message=err)
 
-        for thread in self.virts:
-            thread.start()
+        self._start_tracing()
+        self._start_sources()
+        # Started after the worker processes, they must not inherit the socket
+        self._start_metrics()
 
         for thread in self.destinations:
             thread.start()
 
-        # Interruptibly wait on the other threads to be terminated
-        self.wait_on_threads(self.destinations)
+        # Interruptibly wait on the other threads to be terminated,
+        # reload could replace the destinations in the meantime
+        destinations = None
+        while destinations is not self.destinations:
+            destinations = self.destinations
+            self.wait_on_threads(destinations)
 
         raise ExitRequest(code=0)
 
+    def _start_tracing(self):
+        """
+        Trace the reports when `trace_file` or `trace_log` is set. It's
+        started before the worker processes, they append to the same file.
+        """
+        path = self.options[VW_GLOBAL]['trace_file']
+        log_spans = self.options[VW_GLOBAL]['trace_log']
+        if not path and not log_spans:
+            return
+        try:
+            set_tracer(Tracer(path, log_spans=log_spans, logger=self.logger))
+        except (IOError, OSError) as e:
+            self.logger.error('Unable to open trace file "%s": %s', path, str(e))
+            set_tracer(Tracer(log_spans=log_spans, logger=self.logger))
+
+    def _start_metrics(self):
+        """
+        Serve the metrics over HTTP and/or write them to a file.
+        """
+        listen = self.options[VW_GLOBAL]['metrics_listen']
+        path = self.options[VW_GLOBAL]['metrics_file']
+        exporters = []
+        if listen:
+            exporters.append(MetricsServer(listen, logger=self.logger))
+        if path:
+            exporters.append(MetricsFile(path, logger=self.logger))
+        for exporter in exporters:
+            try:
+                exporter.start()
+            except (IOError, OSError) as e:
+                self.logger.error("Unable to serve metrics on %s: %s", listen, str(e))
+                continue
+            self.metrics_exporters.append(exporter)
+
+    def _stop_metrics(self):
+        for exporter in self.metrics_exporters:
+            exporter.stop()
+        self.metrics_exporters = []
+
     def stop_threads(self):
         self.terminate_event.set()
         self.terminate_threads(self.virts)
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
         self.terminate_threads(self.destinations)
+        self._stop_metrics()
+        set_tracer(None)
 
     def terminate(self):
         self.logger.debug("virt-who is shutting down")
@@ -228,10 +401,90 @@ class Executor(object):
         self.destinations = []
         self.datastore = None
 
-    def reload(self):
+    def reload(self, options=None):
         """
-        Causes all threads to be terminated in preparation for running again
+        Apply configuration `options` that was read again after SIGHUP.
+
+        Only virt backends and destinations whose configuration changed
+        are restarted, the others keep running with their sessions and
+        reports in the datastore. All threads are terminated in preparation
+        for running again when global options changed or no configuration
+        is given.
+
+        @param options: New effective config
+        @type options: EffectiveConfig
+
+        @return: True if all threads were terminated and `run` has to be
+        called again
+        @rtype: bool
         """
+        if options is not None and self._reload_changed(options):
+            return False
         self.stop_threads()
         self.terminate_event.clear()
         self.datastore = Datastore()
+        if options is not None:
+            self._set_options(options)
+        return True
+
+    @staticmethod
+    def _section_values(section):
+        return dict((key, section[key]) for key in section)
+
+    def _reload_changed(self, options):
+        """
+        Restart virt backends and destinations affected by changes
+        in `options`.
+
+        @return: False if it's not possible and everything has to be
+        restarted
+        @rtype: bool
+        """
+        if self.options[VW_GLOBAL]['oneshot'] or self.options[VW_GLOBAL]['workers']:
+            return False
+        if self._section_values(options[VW_GLOBAL]) != self._section_values(self.options[VW_GLOBAL]):
+            self.logger.debug("Global options changed, restarting everything")
+            return False
+        mapper = DestinationToSourceMapper(options)
+        if not mapper.configs:
+            return False
+        old_configs = dict(self.dest_to_source_mapper.configs)
+        new_configs = dict(mapper.configs)
+        changed = set(name for name in set(old_configs) | set(new_configs)
+                      if name not in old_configs or name not in new_configs or
+                      self._section_values(old_configs[name]) != self._section_values(new_configs[name]))
+
+        # Destinations are kept when they send reports of the same sources
+        running = dict((thread.config.name, thread) for thread in self.destinations
+                       if not thread.is_terminated())
+        kept_destinations = []
+        new_infos = []
+        for info in mapper.dests:
+            thread = running.pop(self._destination_name(info), None)
+            if thread is not None and \
+                    sorted(thread.source_keys) == sorted(mapper.dest_to_sources_map[info]):
+                kept_destinations.append(thread)
+            else:
+                if thread is not None:
+                    running[thread.config.name] = thread
+                new_infos.append(info)
+
+        stopped_virts = [virt for virt in self.virts if virt.config.name in changed]
+        self.logger.info("Configuration changed: restarting %d of %d configs and %d of %d destinations",
+                         len(changed & set(new_configs)), len(new_configs),
+                         len(new_infos), len(mapper.dests))
+        self.terminate_threads(stopped_virts + list(running.values()))
+        for name in changed:
+            self.datastore.remove(name)
+
+        self.options = options
+        self.dest_to_source_mapper = mapper
+        new_virts = self._create_virt_backends([(name, config) for name, config in mapper.configs
+                                                if name in changed])
+        new_destinations = self._create_destinations(new_infos)
+        self.virts = [virt for virt in self.virts if virt not in stopped_virts] + new_virts
+        self.destinations = kept_destinations + new_destinations
+        self._start_virts(new_virts)
+        for thread in new_destinations:
+            thread.start()
+        return True
@@ -36,7 +36,7 @@ from virtwho import log
 from virtwho.config import InvalidPasswordFormat, VW_GLOBAL
 from virtwho.daemon import daemon
 from virtwho.executor import Executor, ReloadRequest, ExitRequest
-from virtwho.parser import parse_options, OptionError
+from virtwho.parser import parse_options, reload_options, OptionError
 from virtwho.password import InvalidKeyFile
 from virtwho.virt import DomainListReport, HostGuestAssociationReport
 
@@ -105,8 +105,15 @@ def atexit_fn(*args, **kwargs):
 
 def reload(signal, stackframe):
     if executor:
-        executor.reload()
-        raise ReloadRequest()
+        effective_config = reload_options(executor.logger)
+        valid_virt_sections = [name for (name, section) in effective_config.virt_sections()
+                               if section.is_valid()]
+        if not effective_config[VW_GLOBAL].is_valid() or not valid_virt_sections:
+            executor.logger.error("Configuration is not valid, keeping the current configuration")
+            return
+        if executor.reload(effective_config):
+            raise ReloadRequest()
+        return
     exit(1, status="virt-who cannot reload, exiting")
 
 
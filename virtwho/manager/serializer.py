@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Streaming serialization of host-to-guest mapping.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+
+def iter_mapping(hypervisors):
+    """
+    Generate JSON text of the check-in body `{"hypervisors": [...]}`
+    piece by piece, one hypervisor at a time.
+
+    The output is the same as `json.dumps` of the mapping made
+    of `Hypervisor.toDict()` with sorted keys, but the dictionaries are
+    never created.
+
+    @param hypervisors: list of `Hypervisor` instances
+    @type hypervisors: list
+    """
+    yield '{"hypervisors": ['
+    separator = ''
+    for hypervisor in hypervisors:
+        yield separator + hypervisor.toJSON()
+        separator = ', '
+    yield ']}'
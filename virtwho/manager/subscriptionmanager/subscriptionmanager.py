@@ -22,6 +22,7 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
 import json
+import logging
 from six.moves.http_client import BadStatusLine
 from six import string_types
 
@@ -31,6 +32,7 @@ import rhsm.config as rhsm_config
 
 from virtwho.config import NotSetSentinel
 from virtwho.manager import Manager, ManagerError, ManagerFatalError, ManagerThrottleError
+from virtwho.manager.serializer import iter_mapping
 from virtwho.virt import AbstractVirtReport
 from virtwho.util import generate_correlation_id
 
@@ -221,11 +223,10 @@ class SubscriptionManager(Manager):
 
         `guests` is a list of `Guest` instances (or it children).
         """
-        guests = report.guests
         self._connect()
 
-        # Sort the list
-        guests.sort(key=lambda item: item.uuid)
+        # Sort the list (the report might be frozen, don't sort it in place)
+        guests = sorted(report.guests, key=lambda item: item.uuid)
 
         serialized_guests = [guest.toDict() for guest in guests]
         self.logger.info('Sending update in guests lists for config '
@@ -248,9 +249,14 @@ class SubscriptionManager(Manager):
 
         is_async = self._is_rhsm_server_async(report, connection)
         serialized_mapping = self._hypervisor_mapping(report, is_async, connection)
-        self.logger.debug("Host-to-guest mapping being sent to '{owner}': {mapping}".format(
-                          owner=report.config['owner'],
-                          mapping=json.dumps(serialized_mapping, indent=4)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # The mapping can be huge, don't serialize it unless it's logged
+            if is_async:
+                mapping = ''.join(iter_mapping(report.association['hypervisors']))
+            else:
+                mapping = json.dumps(serialized_mapping)
+            self.logger.debug("Host-to-guest mapping being sent to '%s': %s",
+                              report.config['owner'], mapping)
 
         # All subclasses of ConfigSection use dictionary like notation,
         # but RHSM uses attribute like notation
@@ -319,7 +325,7 @@ class SubscriptionManager(Manager):
 
         mapping = report.association
         serialized_mapping = {}
-        ids_seen = []
+        ids_seen = set()
 
         if is_async:
             hosts = []
@@ -329,7 +335,7 @@ class SubscriptionManager(Manager):
                     self.logger.warning("The hypervisor id '%s' is assigned to 2 different systems. "
                         "Only one will be recorded at the server." % hypervisor.hypervisorId)
                 hosts.append(hypervisor.toDict())
-                ids_seen.append(hypervisor.hypervisorId)
+                ids_seen.add(hypervisor.hypervisorId)
             serialized_mapping = {'hypervisors': hosts}
         else:
             # Reformat the data from the mapping to make it fit with
@@ -340,7 +346,7 @@ class SubscriptionManager(Manager):
                         "Only one will be recorded at the server." % hypervisor.hypervisorId)
                 guests = [g.toDict() for g in hypervisor.guestIds]
                 serialized_mapping[hypervisor.hypervisorId] = guests
-                ids_seen.append(hypervisor.hypervisorId)
+                ids_seen.add(hypervisor.hypervisorId)
 
         return serialized_mapping
 
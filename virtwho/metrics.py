@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Metrics of virt-who (durations of polls and check-ins, sizes of reports,
+rate limiting, ...) exported in Prometheus text format.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import bisect
+import logging
+from threading import Lock, Thread
+
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from virtwho import util
+from virtwho.scheduler import get_scheduler
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'Registry', 'REGISTRY',
+           'MetricsServer', 'MetricsFile', 'parse_address']
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets (in seconds) of histograms of durations
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# How often the metrics file is rewritten (in seconds)
+METRICS_FILE_INTERVAL = 60
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (label, _escape(label_value))
+                                  for label, label_value in labels)
+    return '%s %s' % (name, _format_value(value))
+
+
+class Metric(object):
+    """
+    Base class of the metrics, values are kept for every combination
+    of label values.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric %s has labels %s, not %s' %
+                             (self.name, ', '.join(self.labelnames), ', '.join(sorted(labels))))
+        return tuple(str(labels[label]) for label in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        Forget the value of given labels, e.g. of removed configuration.
+        """
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self):
+        """
+        Return copy of the values, keyed by tuples of label values.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def _change(self, old, new):
+        """
+        Return change from value `old` (None if it didn't exist) to `new`
+        that `_apply` adds to the value in another registry, None if
+        there's no change.
+        """
+        raise NotImplementedError()
+
+    def _apply(self, key, change):
+        raise NotImplementedError()
+
+    def samples(self):
+        """
+        Return list of (name, ((label, value), ...), value) tuples.
+        """
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace('\\', '\\\\').replace('\n', '\\n')),
+            '# TYPE %s %s' % (self.name, self.TYPE),
+        ]
+        lines.extend(_format_sample(*sample) for sample in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _change(self, old, new):
+        return new - (old or 0) if new != old else None
+
+    def _apply(self, key, change):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + change
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def _change(self, old, new):
+        return new if new != old else None
+
+    def _apply(self, key, change):
+        with self._lock:
+            self._values[key] = change
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ((0,) * (len(self.buckets) + 1), 0)
+            # Counts are not cumulative here, the last one is for +Inf
+            index = bisect.bisect_left(self.buckets, value)
+            counts = counts[:index] + (counts[index] + 1,) + counts[index + 1:]
+            self._values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """
+        Return (count, sum) of the observed values.
+        """
+        with self._lock:
+            counts, total = self._values.get(self._key(labels)) or ((0,), 0)
+            return sum(counts), total
+
+    def _change(self, old, new):
+        if new == old:
+            return None
+        old_counts, old_total = old or ((0,) * len(new[0]), 0)
+        return tuple(count - old_count for count, old_count in zip(new[0], old_counts)), new[1] - old_total
+
+    def _apply(self, key, change):
+        with self._lock:
+            counts, total = self._values.get(key) or ((0,) * (len(self.buckets) + 1), 0)
+            self._values[key] = (tuple(count + added for count, added in zip(counts, change[0])),
+                                 total + change[1])
+
+    def samples(self):
+        samples = []
+        for name, labels, (counts, total) in super(Histogram, self).samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((name + '_bucket', labels + (('le', _format_value(float(bound))),),
+                                cumulative))
+            samples.append((name + '_sum', labels, total))
+            samples.append((name + '_count', labels, cumulative))
+        return samples
+
+
+class Registry(object):
+    """
+    Set of metrics that are exported together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def clear(self):
+        """
+        Reset values of all the metrics (the metrics stay registered).
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.clear()
+
+    def snapshot(self):
+        """
+        Return values of all the metrics, to be passed to `changes`.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return dict((metric.name, metric.snapshot()) for metric in metrics)
+
+    def changes(self, old, new):
+        """
+        Return changes of the values between snapshots `old` and `new` as
+        list of (metric name, label values, change) tuples, that can be
+        added to the values of another registry (of another process) using
+        `apply_changes`. Counters and histograms are sent as increments,
+        gauges as their new values.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        changes = []
+        for metric in metrics:
+            old_values = old.get(metric.name, {})
+            for key, value in sorted(new.get(metric.name, {}).items()):
+                change = metric._change(old_values.get(key), value)
+                if change is not None:
+                    changes.append((metric.name, key, change))
+        return changes
+
+    def apply_changes(self, changes):
+        """
+        Add changes returned by `changes` to the values of the metrics,
+        changes of unknown metrics are ignored.
+        """
+        with self._lock:
+            metrics = dict((metric.name, metric) for metric in self._metrics)
+        for name, key, change in changes:
+            metric = metrics.get(name)
+            if metric is not None:
+                metric._apply(tuple(key), change)
+
+    def render(self):
+        """
+        Return all the metrics in Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+REGISTRY = Registry()
+
+GET_DATA_SECONDS = REGISTRY.histogram(
+    'virtwho_get_data_duration_seconds',
+    'Time spent gathering data by a thread (report of a virt backend, reports for a destination)',
+    ['thread'])
+SEND_DATA_SECONDS = REGISTRY.histogram(
+    'virtwho_send_data_duration_seconds',
+    'Time spent sending data by a thread (placing a report, checking in reports)',
+    ['thread'])
+REPORTS = REGISTRY.counter(
+    'virtwho_reports_total',
+    'Number of reports gathered by a virt backend',
+    ['config', 'type'])
+REPORT_HYPERVISORS = REGISTRY.gauge(
+    'virtwho_report_hypervisors',
+    'Number of hypervisors in the last report of a virt backend',
+    ['config'])
+REPORT_GUESTS = REGISTRY.gauge(
+    'virtwho_report_guests',
+    'Number of guests in the last report of a virt backend',
+    ['config'])
+REPORT_TIMESTAMP = REGISTRY.gauge(
+    'virtwho_report_timestamp_seconds',
+    'Time when the last report of a virt backend was gathered',
+    ['config'])
+CHECKIN_SECONDS = REGISTRY.histogram(
+    'virtwho_checkin_duration_seconds',
+    'Duration of a request sending a host-to-guest mapping',
+    ['destination'])
+CHECKINS = REGISTRY.counter(
+    'virtwho_checkins_total',
+    'Number of requests sending a host-to-guest mapping by result (success, throttled, error)',
+    ['destination', 'result'])
+RATE_LIMITED = REGISTRY.counter(
+    'virtwho_rate_limited_total',
+    'Number of responses with HTTP status 429 (too many requests)')
+JOB_SECONDS = REGISTRY.histogram(
+    'virtwho_job_duration_seconds',
+    'Time from the check-in until the server finished processing the job, by final state',
+    ['destination', 'state'])
+ESX_UPDATE_PAGES = REGISTRY.gauge(
+    'virtwho_esx_update_pages',
+    'Number of WaitForUpdatesEx responses the last complete update set of an ESX backend was split into',
+    ['config'])
+ESX_UPDATE_OBJECTS = REGISTRY.gauge(
+    'virtwho_esx_update_objects',
+    'Number of object updates in the last complete update set of an ESX backend',
+    ['config'])
+ESX_REQUEST_BYTES = REGISTRY.counter(
+    'virtwho_esx_request_bytes_total',
+    'Number of bytes of SOAP requests sent by an ESX backend',
+    ['config'])
+ESX_RESPONSE_BYTES = REGISTRY.counter(
+    'virtwho_esx_response_bytes_total',
+    'Number of bytes of SOAP responses received by an ESX backend, as transferred (compressed)',
+    ['config'])
+ESX_RESPONSE_DECODED_BYTES = REGISTRY.counter(
+    'virtwho_esx_response_decoded_bytes_total',
+    'Number of bytes of SOAP responses received by an ESX backend after decompression',
+    ['config'])
+
+
+def parse_address(address):
+    """
+    Parse `address` in form "host:port" or "port" (localhost is used).
+
+    @return: (host, port) tuple
+    @raise ValueError: when the port is not valid
+    """
+    host, _, port = address.rpartition(':')
+    port = int(port)
+    if not 0 <= port < 65536:
+        raise ValueError('port %d is out of range' % port)
+    return host.strip('[]') or 'localhost', port
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the log otherwise
+        pass
+
+
+class MetricsServer(object):
+    """
+    HTTP listener serving the metrics at /metrics.
+    """
+
+    def __init__(self, address, registry=REGISTRY, logger=None):
+        """
+        @param address: "host:port" to listen on
+        @type address: str
+        """
+        self.address = parse_address(address)
+        self.registry = registry
+        self.logger = logger or logging.getLogger(__name__)
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server is not None else None
+
+    def start(self):
+        self._server = HTTPServer(self.address, _MetricsHandler)
+        self._server.registry = self.registry
+        self._thread = Thread(target=self._server.serve_forever, name='virt-who-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.debug("Serving metrics on %s:%d", self.address[0], self.port)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+
+class MetricsFile(object):
+    """
+    File with the metrics, rewritten every `interval` seconds, e.g. for
+    the textfile collector of node_exporter.
+    """
+
+    def __init__(self, path, registry=REGISTRY, logger=None,
+                 interval=METRICS_FILE_INTERVAL, scheduler=None):
+        self.path = path
+        self.registry = registry
+        self.logger = logger or logging.getLogger(__name__)
+        self.interval = interval
+        self.scheduler = scheduler or get_scheduler()
+        self._timer = None
+        self._lock = Lock()
+        self._stopped = False
+        self._write_failures = util.WriteFailureLog(self.logger)
+
+    def start(self):
+        self._tick()
+
+    def _tick(self):
+        self.write()
+        with self._lock:
+            if not self._stopped:
+                self._timer = self.scheduler.call_later(self.interval, self._tick)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        # Keep the final values
+        self.write()
+
+    def write(self):
+        """
+        Replace the file atomically, readers never see it partially written.
+        """
+        try:
+            util.write_file_atomically(self.path, self.registry.render(), mode=0o644)
+            self._write_failures.success()
+        except (IOError, OSError) as e:
+            self._write_failures.failure('Unable to write metrics file "%s": %s', self.path, e)
@@ -210,6 +210,7 @@ def read_config_env_variables():
         "VIRTWHO_HYPERV": ("virt_type", store_const, "hyperv"),
         "VIRTWHO_KUBEVIRT": ("virt_type", store_const, "kubevirt"),
         "VIRTWHO_INTERVAL": ("interval", store_value),
+        "VIRTWHO_WORKERS": ("workers", store_value),
         "VIRTWHO_REPORTER_ID": ("reporter_id", store_value),
     }
 
@@ -339,6 +340,8 @@ def parse_cli_arguments():
                         help="Acquire list of virtual guest each N seconds. Send if changes are detected.")
     parser.add_argument("-p", "--print", action="store_true", dest="print_", default=False,
                         help="Print the host/guest association obtained from virtualization backend (implies oneshot)")
+    parser.add_argument("--workers", type=int, dest="workers", default=NotSetSentinel(),
+                        help="Run virtualization backends in N worker processes")
     parser.add_argument("-c", "--config", action="append", dest="configs", default=[],
                         help="Configuration file that will be processed and will override configuration \n"
                              "from other files. 'global' and 'default' sections are not read in files passed in via \n"
@@ -508,6 +511,40 @@ def parse_cli_arguments():
     return get_non_default_options(cli_options, defaults), errors, defaults
 
 
+def _read_effective_config(cli_options, errors):
+    """
+    Create the effective config from `cli_options`, environment variables
+    and configuration files. Errors are appended to `errors` list.
+    """
+    # Read configuration env. variables
+    env_options = read_config_env_variables()
+
+    if six.PY2:
+        # Read environments variables for virtualization backends
+        env_options, env_errors = read_vm_backend_env_variables(env_options)
+        errors.extend(env_errors)
+
+    # Create the effective config that virt-who will use to run
+    effective_config = init_config(env_options, cli_options)
+    # Ensure validation errors during effective config creation are logged
+    errors.extend(effective_config.validation_messages)
+    return effective_config
+
+
+def reload_options(logger):
+    """
+    Read the configuration again when virt-who is reloaded. Command line
+    arguments stay the same, configuration files could have changed.
+    :return: New effective config
+    """
+    cli_options, errors, defaults = parse_cli_arguments()
+    effective_config = _read_effective_config(cli_options, errors)
+    for err in errors:
+        if err[0] == 'error':
+            logger.error(err[1])
+    return effective_config
+
+
 def parse_options():
     """
     This function parses all options from command line and environment variables
@@ -528,18 +565,7 @@ def parse_options():
         print(get_version())
         exit(os.EX_OK)
 
-    # Read configuration env. variables
-    env_options = read_config_env_variables()
-
-    if six.PY2:
-        # Read environments variables for virtualization backends
-        env_options, env_errors = read_vm_backend_env_variables(env_options)
-        errors.extend(env_errors)
-
-    # Create the effective config that virt-who will use to run
-    effective_config = init_config(env_options, cli_options)
-    # Ensure validation errors during effective config creation are logged
-    errors.extend(effective_config.validation_messages)
+    effective_config = _read_effective_config(cli_options, errors)
 
     logger = log.getLogger(config=effective_config, queue=False)
 
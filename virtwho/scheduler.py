@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Timers shared by all virt-who threads.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import heapq
+import itertools
+import logging
+import time
+from threading import Condition, Lock, Thread
+
+__all__ = ['Scheduler', 'Timer', 'get_scheduler', 'reset_scheduler']
+
+log = logging.getLogger(__name__)
+
+# Clock that is not affected by changes of system time
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Timer(object):
+    """
+    Handle of a callback scheduled by `Scheduler.call_later`.
+    """
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Don't call the callback if it wasn't called yet.
+        """
+        self.cancelled = True
+        self.callback = None
+
+
+class Scheduler(object):
+    """
+    Heap of timers driven by a single thread.
+
+    Threads that need to sleep block on their own `Event` without timeout
+    and let the scheduler set it when the time comes. Idle threads therefore
+    don't wake up at all and can be woken up immediately by setting
+    the event.
+    """
+
+    def __init__(self):
+        self._timers = []
+        self._counter = itertools.count()
+        self._condition = Condition(Lock())
+        self._thread = None
+
+    def call_later(self, delay, callback):
+        """
+        Call `callback` (without arguments) from the scheduler thread
+        after `delay` seconds.
+
+        @return: the timer that can be used to cancel the call
+        @rtype: Timer
+        """
+        timer = Timer(_clock() + max(0, delay), callback)
+        with self._condition:
+            heapq.heappush(self._timers, (timer.deadline, next(self._counter), timer))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='virt-who-scheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._timers[0][2] is timer:
+                # The new timer is the first one, the scheduler thread
+                # needs to wait for shorter time
+                self._condition.notify()
+        return timer
+
+    def __len__(self):
+        with self._condition:
+            return sum(1 for _, _, timer in self._timers if not timer.cancelled)
+
+    def _next_due(self):
+        """
+        Wait until a timer is due and return it.
+        """
+        with self._condition:
+            while True:
+                while self._timers and self._timers[0][2].cancelled:
+                    heapq.heappop(self._timers)
+                if not self._timers:
+                    self._condition.wait()
+                    continue
+                remaining = self._timers[0][0] - _clock()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                return heapq.heappop(self._timers)[2]
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            callback = timer.callback
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception:
+                log.exception("Scheduled callback %r failed", callback)
+
+
+_scheduler = None
+_scheduler_lock = Lock()
+
+
+def get_scheduler():
+    """
+    Return the scheduler shared by all threads of the process.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def reset_scheduler():
+    """
+    Forget the shared scheduler. It must be called in a forked child
+    process, the scheduler thread of the parent doesn't run there.
+    """
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = Lock()
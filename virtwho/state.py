@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+State of the destinations that is kept across restarts of virt-who.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import copy
+import errno
+import hashlib
+import json
+import logging
+from threading import Lock
+
+from virtwho import util
+
+__all__ = ['StateFile', 'destination_key', 'DEFAULT_STATE_FILE']
+
+DEFAULT_STATE_FILE = '/var/lib/virt-who/state.json'
+
+
+def destination_key(info):
+    """
+    Return key of the destination that doesn't change between runs
+    of virt-who (unlike `hash(info)`). Values of the options are hashed,
+    so no credentials are written to the state file.
+
+    @param info: destination info from the configuration
+    @type info: virtwho.config.Info
+    """
+    options = sorted((key, str(value)) for key, value in info._options.items() if key != 'name')
+    data = json.dumps([type(info).__name__, options])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class StateFile(object):
+    """
+    JSON file with a state of every destination (digests of reports
+    that were sent, IDs of jobs that are processed by the server, ...).
+
+    The file is always replaced atomically, so it's either the old or
+    the new version when virt-who is killed while writing it. Failure to
+    read or write the file is not fatal, virt-who just sends complete
+    reports as if the file didn't exist.
+    """
+    VERSION = 1
+
+    def __init__(self, path, logger=None):
+        """
+        @param path: path of the state file
+        @type path: str
+        """
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self._destinations = {}
+        self._lock = Lock()
+        self._write_failures = util.WriteFailureLog(self.logger)
+
+    def load(self):
+        """
+        Read the state file, missing or invalid file is treated as empty.
+        """
+        destinations = {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                destinations = data.get('destinations', {})
+            else:
+                self.logger.warning('Ignoring state file "%s" with unsupported version', self.path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                self.logger.warning('Unable to read state file "%s": %s', self.path, e)
+        except (ValueError, AttributeError) as e:
+            self.logger.warning('Ignoring invalid state file "%s": %s', self.path, e)
+        with self._lock:
+            self._destinations = destinations
+
+    def get(self, key):
+        """
+        Return the state of destination `key` or None if it's not known.
+        """
+        with self._lock:
+            return copy.deepcopy(self._destinations.get(key))
+
+    def set(self, key, state):
+        """
+        Store the state of destination `key` and write the file.
+
+        @param state: state of the destination, it must be serializable to JSON
+        @type state: dict
+        """
+        with self._lock:
+            if self._destinations.get(key) == state:
+                return
+            self._destinations[key] = copy.deepcopy(state)
+            self._write()
+
+    def _write(self):
+        data = json.dumps({'version': self.VERSION, 'destinations': self._destinations}, sort_keys=True)
+        try:
+            util.write_file_atomically(self.path, data, make_dirs=True)
+            self._write_failures.success()
+        except (IOError, OSError) as e:
+            self._write_failures.failure('Unable to write state file "%s": %s', self.path, e)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Tracing of reports on their way from the virt backend to the server.
+
+Every report gets a trace ID when it's gathered. Each stage the report
+goes through (gathering, waiting in the datastore, check in, processing
+of the job on the server) is recorded as a span with the trace ID, so
+it's possible to find out where the time was spent.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Lock, current_thread
+
+from virtwho import util
+
+__all__ = ['Tracer', 'get_tracer', 'set_tracer']
+
+
+class Tracer(object):
+    """
+    Records spans as JSON objects, one per line, to the trace file and/or
+    to the log. Tracer without any output is disabled and doesn't create
+    trace IDs, so the reports are not traced at all.
+    """
+
+    def __init__(self, path=None, log_spans=False, logger=None):
+        """
+        @param path: file the spans are appended to
+        @type path: str
+        @param log_spans: log the spans using `logger`
+        @type log_spans: bool
+        """
+        self.path = path
+        self.log_spans = log_spans
+        self.logger = logger or logging.getLogger(__name__)
+        self._fd = None
+        self._lock = Lock()
+        self._write_failures = util.WriteFailureLog(self.logger)
+        if path:
+            # Appending is atomic, worker processes share the file
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    @property
+    def enabled(self):
+        return self._fd is not None or self.log_spans
+
+    def new_trace_id(self):
+        """
+        Return new trace ID or None when tracing is disabled.
+        """
+        if not self.enabled:
+            return None
+        return uuid.uuid4().hex[:16]
+
+    def record(self, name, trace_ids, start, end=None, **attributes):
+        """
+        Record span `name` of every trace in `trace_ids`.
+
+        @param start: time when the span started
+        @type start: float
+        @param end: time when the span ended, now by default
+        @type end: float
+        @param attributes: other values that are recorded with the span
+        """
+        if not self.enabled:
+            return
+        trace_ids = [trace_id for trace_id in trace_ids if trace_id]
+        if not trace_ids:
+            return
+        if end is None:
+            end = time.time()
+        lines = []
+        for trace_id in trace_ids:
+            span = dict(attributes)
+            span.update({
+                'trace_id': trace_id,
+                'span': name,
+                'start': round(start, 6),
+                'duration': round(end - start, 6),
+                'thread': current_thread().name,
+            })
+            lines.append(json.dumps(span, sort_keys=True))
+        if self.log_spans:
+            for line in lines:
+                self.logger.info("Trace span: %s", line)
+        if self._fd is not None:
+            self._write(''.join(line + '\n' for line in lines))
+
+    @contextmanager
+    def span(self, name, trace_ids, **attributes):
+        """
+        Record span `name` of the code run in the `with` block.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, trace_ids, start, **attributes)
+
+    def _write(self, data):
+        with self._lock:
+            if self._fd is None:
+                return
+            try:
+                os.write(self._fd, data.encode('utf-8'))
+                self._write_failures.success()
+            except OSError as e:
+                self._write_failures.failure('Unable to write trace file "%s": %s', self.path, e)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """
+    Return the tracer used by all the threads, it's disabled by default.
+    """
+    return _tracer
+
+
+def set_tracer(tracer=None):
+    """
+    Replace the tracer used by all the threads, the previous one is closed.
+    Without `tracer`, tracing is disabled.
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer or Tracer()
+    previous.close()
@@ -1,8 +1,11 @@
 from __future__ import print_function
+import os
+import re
 import socket
 import six
 from six.moves import xmlrpc_client
 import requests
+import tempfile
 from abc import ABCMeta
 import uuid
 
@@ -24,7 +27,8 @@ else:
     from string import ascii_letters as letters
 
 
-__all__ = ('OrderedDict', 'decode', 'generateReporterId', 'clean_filename', 'RequestsXmlrpcTransport')
+__all__ = ('OrderedDict', 'decode', 'generateReporterId', 'clean_filename', 'RequestsXmlrpcTransport',
+           'FrozenDict', 'HostFilter', 'write_file_atomically', 'WriteFailureLog')
 
 
 class Singleton(ABCMeta):
@@ -401,3 +405,212 @@ class DictItemsIter(object):
 
 def generate_correlation_id():
     return str(uuid.uuid4()).replace('-', '')  # FIXME cp should accept -
+
+
+class FrozenDict(dict):
+    """
+    A dictionary that can't be modified after it is created.
+
+    It is used for data of frozen reports that are shared between threads
+    without being copied.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'%s' object is immutable" % self.__class__.__name__)
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+def _translate_wildcards(pattern):
+    """
+    Translate shell-style wildcards to regular expression. It works like
+    fnmatch.translate, but the result contains no anchors or flags, so it
+    can be combined with other expressions.
+    """
+    i, n = 0, len(pattern)
+    result = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            result.append('.*')
+        elif c == '?':
+            result.append('.')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                result.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                result.append('[%s]' % stuff)
+        else:
+            result.append(re.escape(c))
+    return ''.join(result)
+
+
+class HostFilter(object):
+    """
+    Matcher of host names (or other IDs) against list of filter patterns
+    (`filter_hosts`, `exclude_hosts`, `filter_host_parents`, ...).
+
+    Patterns are interpreted according to `filter_type`: "wildcards"
+    (case insensitive shell-style wildcards), "regex" (case insensitive
+    regular expressions matching whole host name) or None, when both
+    interpretations are tried. Invalid regular expressions never match,
+    use `invalid_regexes` to find them.
+
+    Patterns are compiled only once, when the matcher is created. Patterns
+    without any special characters are looked up in a set of literals, all
+    other patterns are combined into one regular expression.
+    """
+    WILDCARD_CHARS = frozenset('*?[')
+    REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+    # Backreferences can't be combined, groups would be renumbered
+    BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, patterns, filter_type=None):
+        self.patterns = tuple(patterns)
+        self.filter_type = filter_type
+        self._literals = set()
+        self._matchers = []
+        expressions = []
+        for pattern in self.patterns:
+            if filter_type in (None, 'wildcards'):
+                if self.WILDCARD_CHARS.isdisjoint(pattern):
+                    self._literals.add(pattern.lower())
+                else:
+                    expressions.append(_translate_wildcards(pattern.lower()))
+            if filter_type in (None, 'regex'):
+                if self.REGEX_CHARS.isdisjoint(pattern):
+                    self._literals.add(pattern.lower())
+                elif self._compile(pattern) is None:
+                    continue
+                elif self.BACKREFERENCE.search(pattern):
+                    self._matchers.append(self._compile(pattern).match)
+                else:
+                    expressions.append(pattern)
+        if expressions:
+            combined = self._compile('|'.join('(?:%s)' % expression for expression in expressions))
+            if combined is not None:
+                self._matchers.append(combined.match)
+            else:
+                # Some expressions can't be combined (e.g. because of inline flags)
+                self._matchers.extend(self._compile(expression).match for expression in expressions)
+
+    @staticmethod
+    def _compile(expression):
+        try:
+            return re.compile('(?:%s)\\Z' % expression, re.IGNORECASE)
+        except re.error:
+            return None
+
+    @classmethod
+    def invalid_regexes(cls, patterns):
+        """
+        Return list of patterns that are not valid regular expressions.
+        """
+        return [pattern for pattern in patterns if cls._compile(pattern) is None]
+
+    def __repr__(self):
+        return 'HostFilter({0.patterns!r}, {0.filter_type!r})'.format(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, HostFilter):
+            return NotImplemented
+        return self.patterns == other.patterns and self.filter_type == other.filter_type
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.patterns, self.filter_type))
+
+    def match(self, host):
+        """
+        Return True if `host` matches any of the patterns.
+        """
+        lower_host = host.lower()
+        if lower_host in self._literals:
+            return True
+        for matcher in self._matchers:
+            if matcher(lower_host):
+                return True
+        return False
+
+
+def write_file_atomically(path, data, mode=0o600, make_dirs=False):
+    """
+    Replace the file `path` with `data`, readers never see it partially
+    written. The data are written to a temporary file in the same directory
+    that is renamed to `path` then.
+
+    @param data: content of the file
+    @type data: str
+    @param mode: permissions of the file
+    @type mode: int
+    @param make_dirs: create the directory of the file if it doesn't exist
+    @type make_dirs: bool
+    @raise IOError, OSError: when the file can't be written
+    """
+    directory = os.path.dirname(path) or '.'
+    if make_dirs and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        # Rename is atomic, the file is never partially written
+        os.rename(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class WriteFailureLog(object):
+    """
+    Log of failures of repeated writes (of a file). The first failure is
+    logged as warning, the following ones only as debug until a write
+    succeeds, so a full disk or unwritable directory doesn't flood the log.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self.failed = False
+
+    def success(self):
+        self.failed = False
+
+    def failure(self, msg, *args):
+        log = self.logger.debug if self.failed else self.logger.warning
+        log(msg, *args)
+        self.failed = True
@@ -4,9 +4,13 @@ from __future__ import print_function, absolute_import
 
 from .virt import (Virt, VirtError, Guest, AbstractVirtReport, DomainListReport,
                   HostGuestAssociationReport, ErrorReport,
-                  Hypervisor, DestinationThread, IntervalThread, info_to_destination_class)
+                  Hypervisor, DestinationThread, IntervalThread, VirtPool,
+                  LoginLimiter, AdaptiveInterval, start_delay,
+                  info_to_destination_class)
 
 __all__ = ['Virt', 'VirtError', 'Guest', 'AbstractVirtReport',
            'DomainListReport', 'HostGuestAssociationReport',
            'ErrorReport', 'Hypervisor', 'DestinationThread',
-           'IntervalThread', 'info_to_destination_class']
+           'IntervalThread', 'VirtPool', 'LoginLimiter', 'AdaptiveInterval',
+           'start_delay',
+           'info_to_destination_class']
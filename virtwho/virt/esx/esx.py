@@ -24,6 +24,7 @@ import os
 import suds
 import suds.transport
 import suds.client
+import suds.options
 import requests
 import errno
 import stat
@@ -34,10 +35,14 @@ from time import time
 from six.moves.urllib.error import URLError
 import socket
 from collections import defaultdict
+from threading import Lock
 from six.moves.http_client import HTTPException
+from requests.packages.urllib3.exceptions import ProtocolError, ReadTimeoutError
 
-from virtwho import virt
+from virtwho import virt, metrics
 from virtwho.config import VirtConfigSection
+from virtwho.virt.esx.updates import parse_update_set, wait_for_updates_request, \
+    SoapFault, UpdateSetParseError
 
 
 class FileAdapter(requests.adapters.BaseAdapter):
@@ -79,15 +84,43 @@ class RequestsTransport(suds.transport.Transport):
 
     This unifies network handling with other backends. For example
     proxy support will be same as for other modules.
+
+    Connections are kept alive in a pool of `pool_size` connections,
+    responses are compressed when `compression` is enabled. Bytes sent
+    and received are counted in the metrics of config `name`.
     '''
-    def __init__(self, session=None):
+    def __init__(self, session=None, pool_size=requests.adapters.DEFAULT_POOLSIZE,
+                 compression=True, name=None):
         suds.transport.Transport.__init__(self)
         self._session = session or requests.Session()
+        self._session.verify = False
+        self._session.headers['Accept-Encoding'] = 'gzip' if compression else 'identity'
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
         self._session.mount('file://', FileAdapter())
+        self.name = name
+
+    def _count(self, sent, received, decoded):
+        if self.name is None:
+            return
+        metrics.ESX_REQUEST_BYTES.inc(sent, config=self.name)
+        metrics.ESX_RESPONSE_BYTES.inc(received, config=self.name)
+        metrics.ESX_RESPONSE_DECODED_BYTES.inc(decoded, config=self.name)
+
+    @staticmethod
+    def _received(resp, decoded):
+        # Size of the body as it was transferred, it can be compressed
+        try:
+            return resp.raw.tell()
+        except (AttributeError, IOError, ValueError):
+            return decoded
 
     def open(self, request):
-        resp = self._session.get(request.url, headers=request.headers, verify=False)
+        resp = self._session.get(request.url, headers=request.headers)
         resp.raise_for_status()
+        if not request.url.startswith('file://'):
+            self._count(0, self._received(resp, len(resp.content)), len(resp.content))
         return BytesIO(resp.content)
 
     def send(self, request):
@@ -95,22 +128,147 @@ class RequestsTransport(suds.transport.Transport):
             request.url,
             data=request.message,
             headers=request.headers,
-            timeout=self.options.timeout,
-            verify=False
+            timeout=self.options.timeout
         )
-        ct = resp.headers.get('content-type')
+        ct = resp.headers.get('content-type') or ''
         if 'application/soap+xml' not in ct and 'text/xml' not in ct:
             resp.raise_for_status()
+        self._count(len(request.message or b''), self._received(resp, len(resp.content)), len(resp.content))
         return suds.transport.Reply(
             resp.status_code,
             resp.headers,
             resp.content,
         )
 
+    def post_stream(self, url, message, headers):
+        '''
+        Post SOAP `message` and return `ResponseStream` with body of the
+        response, that is read only when the stream is read.
+        '''
+        resp = self._session.post(
+            url,
+            data=message,
+            headers=headers,
+            timeout=self.options.timeout,
+            stream=True
+        )
+        ct = resp.headers.get('content-type', '')
+        if 'application/soap+xml' not in ct and 'text/xml' not in ct:
+            resp.close()
+            resp.raise_for_status()
+        return ResponseStream(self, resp, len(message))
+
+
+class ResponseStream(object):
+    '''
+    File-like body of a streamed response (decompressed). When it's
+    used as context manager, the connection is returned to the pool
+    if the body was read without errors, closed otherwise.
+    '''
+    def __init__(self, transport, resp, sent):
+        self._transport = transport
+        self._resp = resp
+        self._sent = sent
+        self._decoded = 0
+        resp.raw.decode_content = True
+
+    def read(self, size=-1):
+        # Errors of urllib3 are raised as the ones requests would raise,
+        # so that they are handled the same way as errors of other calls
+        try:
+            data = self._resp.raw.read(None if size < 0 else size)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.Timeout(e)
+        except ProtocolError as e:
+            raise requests.exceptions.ConnectionError(e)
+        self._decoded += len(data)
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                try:
+                    # Rest of the body (if any) has to be read to reuse the connection
+                    while self.read(io.DEFAULT_BUFFER_SIZE):
+                        pass
+                except Exception:
+                    self._resp.close()
+                    raise
+                self._resp.raw.release_conn()
+            else:
+                self._resp.close()
+        finally:
+            self._transport._count(self._sent, self._transport._received(self._resp, self._decoded),
+                                   self._decoded)
+
+
+class SharedWsdlClient(suds.client.Client):
+    """
+    Suds client that uses WSDL already parsed by another client.
+    Unlike `suds.client.Client.clone`, the options are not deep-copied,
+    so every client can have its own transport.
+    """
+    def __init__(self, template, **kwargs):
+        # Client.__init__ is not called, it would parse the WSDL
+        self.options = suds.options.Options()
+        self.set_options(**kwargs)
+        self.wsdl = template.wsdl
+        self.factory = template.factory
+        self.service = suds.client.ServiceSelector(self, self.wsdl.services)
+        self.sd = template.sd
+        self.messages = dict(tx=None, rx=None)
+
+
+# Clients with parsed WSDL files (by URL) shared by all the ESX sources
+_template_clients = {}
+_template_clients_lock = Lock()
+
+
+def create_client(wsdl, transport, **options):
+    """
+    Return suds client for `wsdl`. The WSDL is parsed only once per
+    process, all the clients share it, but every client has its own
+    `transport` and `options`.
+    """
+    with _template_clients_lock:
+        template = _template_clients.get(wsdl)
+        if template is None:
+            template = suds.client.Client(wsdl, transport=transport, **options)
+            # Template is used only for its WSDL, it must not keep the session
+            template.set_options(transport=suds.transport.Transport())
+            _template_clients[wsdl] = template
+    return SharedWsdlClient(template, transport=transport, **options)
+
+
+def clear_client_cache():
+    """
+    Forget all the parsed WSDL files.
+    """
+    with _template_clients_lock:
+        _template_clients.clear()
+
 
 class Esx(virt.Virt):
     CONFIG_TYPE = "esx"
     MAX_WAIT_TIME = 300  # 5 minutes
+    # How many times a failed WaitForUpdatesEx is retried with the last
+    # known version before the whole inventory is requested again
+    MAX_RESUME_ATTEMPTS = 3
+    event_driven = True
+    VM_PROPERTIES = ["config.uuid", "runtime.powerState"]
+    CLUSTER_PROPERTIES = ["name"]
+    HOST_PROPERTIES = ["name",
+                       "vm",
+                       "hardware.systemInfo.uuid",
+                       "hardware.cpuInfo.numCpuPackages",
+                       "parent",
+                       "config.product.name",
+                       "config.product.version",
+                       "config.network.dnsConfig.hostName",
+                       "config.network.dnsConfig.domainName"]
 
     def __init__(self, logger, config, dest, terminate_event=None,
                  interval=None, oneshot=False):
@@ -124,6 +282,13 @@ class Esx(virt.Virt):
 
         self.filter = None
         self.sc = None
+        self.transport = None
+        # Number of object updates applied since the last report
+        self.object_updates = 0
+        self.hosts = {}
+        self.vms = {}
+        self.clusters = {}
+        self._reset_index()
 
     def _prepare(self):
         """ Prepare for obtaining information from ESX server. """
@@ -148,12 +313,18 @@ class Esx(virt.Virt):
         self.vms = defaultdict(VM)
         self.clusters = defaultdict(Cluster)
         initial = True
+        truncated = False
+        # Pages of the update set that is being received
+        pages = 0
+        self.object_updates = 0
+        # Failed WaitForUpdatesEx calls since the last successful one
+        resume_attempts = 0
         next_update = time()
 
         while self._oneshot or not self.is_terminated():
 
             delta = next_update - time()
-            if initial or delta < 0:
+            if initial or truncated or delta < 0:
                 # We want to read the update asap
                 options = {}
                 timeout = 60
@@ -161,30 +332,56 @@ class Esx(virt.Virt):
                 max_wait_seconds = int(delta)
                 options = {'maxWaitSeconds': max_wait_seconds}
                 timeout = max_wait_seconds + 5
+            if self.config['max_object_updates']:
+                options['maxObjectUpdates'] = self.config['max_object_updates']
 
             if version == '':
                 # also, clean all data we have
                 self.hosts.clear()
                 self.vms.clear()
+                self.clusters.clear()
+                self._reset_index()
+                truncated = False
+                pages = 0
+                self.object_updates = 0
 
             try:
                 # Make sure that WaitForUpdatesEx finishes even
                 # if the ESX shuts down in the middle of waiting
                 self.client.set_options(timeout=timeout)
 
-                updateSet = self.client.service.WaitForUpdatesEx(
-                    _this=self.sc.propertyCollector,
-                    version=version,
-                    options=options)
+                wait_start = time()
+                updateSet = self.waitForUpdates(version, options)
                 initial = False
-            except (socket.error, URLError, requests.exceptions.Timeout):
+                resume_attempts = 0
+            except (socket.error, URLError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
                 self.logger.debug("Wait for ESX event finished, timeout")
                 self._cancel_wait()
+                resume_attempts += 1
+                if version and resume_attempts <= self.MAX_RESUME_ATTEMPTS:
+                    # Session and filter are still valid, only the changes
+                    # since the last known version are requested again
+                    self.logger.debug("Resuming ESX updates from version %s", version)
+                    continue
                 # Get the initial update again
                 version = ''
                 initial = True
                 continue
-            except (suds.WebFault, HTTPException) as e:
+            except (suds.WebFault, SoapFault, UpdateSetParseError, HTTPException) as e:
+                if self._is_invalid_version_fault(e):
+                    # Filter is still valid, but the changes since the last
+                    # known version are not available anymore
+                    self.logger.debug("ESX update version %s is not valid, getting complete inventory", version)
+                    version = ''
+                    initial = True
+                    continue
+                resume_attempts += 1
+                if version and resume_attempts <= self.MAX_RESUME_ATTEMPTS and \
+                        not self._is_not_authenticated_fault(e) and not self._is_canceled_fault(e):
+                    self.logger.debug("Waiting for ESX events failed: %s, resuming from version %s",
+                                      e, version)
+                    self._cancel_wait()
+                    continue
                 suppress_exception = False
                 try:
                     if hasattr(e, 'fault'):
@@ -206,15 +403,31 @@ class Esx(virt.Virt):
                 self._prepare()
                 continue
 
+            update_start = time()
+            truncated = False
             if updateSet is not None:
+                self._trace('wait_for_updates', wait_start)
                 version = updateSet.version
+                pages += 1
                 self.applyUpdates(updateSet)
+                truncated = bool(getattr(updateSet, 'truncated', False))
 
-            if hasattr(updateSet, 'truncated') and updateSet.truncated:
+            if truncated:
+                # Rest of the update set is requested right away, report
+                # is sent only when the update set is complete
                 continue
 
+            if pages:
+                self.logger.debug('Update set of config "%s" received in %d page(s) with %d object updates',
+                                  self.config.name, pages, self.object_updates)
+                metrics.ESX_UPDATE_PAGES.set(pages, config=self.config.name)
+                metrics.ESX_UPDATE_OBJECTS.set(self.object_updates, config=self.config.name)
+                pages = 0
+                self.object_updates = 0
+
             if last_version != version or time() > next_update:
                 assoc = self.getHostGuestMapping()
+                self._observe_get_data(update_start)
                 self._send_data(virt.HostGuestAssociationReport(self.config, assoc))
                 next_update = time() + self.interval
                 last_version = version
@@ -224,6 +437,21 @@ class Esx(virt.Virt):
 
         self.cleanup()
 
+    @staticmethod
+    def _fault_string(e):
+        return getattr(getattr(e, 'fault', None), 'faultstring', None)
+
+    def _is_not_authenticated_fault(self, e):
+        return self._fault_string(e) == 'The session is not authenticated.'
+
+    def _is_canceled_fault(self, e):
+        return self._fault_string(e) == 'The task was canceled by a user.'
+
+    @staticmethod
+    def _is_invalid_version_fault(e):
+        detail = getattr(getattr(e, 'fault', None), 'detail', None)
+        return hasattr(detail, 'InvalidCollectorVersionFault')
+
     def _format_hostname(self, host, domain):
         return u'{0}.{1}'.format(host, domain)
 
@@ -244,88 +472,145 @@ class Esx(virt.Virt):
 
         self.logout()
 
+    def _reset_index(self):
+        """
+        Forget the hypervisors built from the host and guest properties,
+        they are all built again by the next getHostGuestMapping call.
+        """
+        # host_id -> Hypervisor (None when the host can't be reported)
+        self._hypervisors = {}
+        # vm_id -> Guest (None when the guest can't be reported)
+        self._guests = {}
+        # vm_id -> IDs of the hosts that reference the guest
+        self._vm_hosts = {}
+        self._indexed = None
+
+    def _invalidate_host(self, host_id):
+        self._hypervisors.pop(host_id, None)
+
+    def _invalidate_vm(self, vm_id):
+        self._guests.pop(vm_id, None)
+        for host_id in self._vm_hosts.pop(vm_id, ()):
+            self._invalidate_host(host_id)
+
+    def _invalidate_cluster(self, cluster_id):
+        for host_id, host in list(self.hosts.items()):
+            parent = host.get('parent')
+            if parent is not None and parent.value == cluster_id:
+                self._invalidate_host(host_id)
+
     def getHostGuestMapping(self):
+        """
+        Hypervisors are built only for hosts that changed (or whose guests
+        or cluster changed) since the previous call, the others are reused.
+        """
+        indexed = (self.hosts, self.vms, self.clusters, self.config['hypervisor_id'])
+        if self._indexed is None or any(a is not b for a, b in zip(indexed[:3], self._indexed[:3])) \
+                or indexed[3] != self._indexed[3]:
+            self._reset_index()
+            self._indexed = indexed
+
         mapping = {'hypervisors': []}
+        exclude_host_parents = self.config.host_filter('exclude_host_parents')
+        filter_host_parents = self.config.host_filter('filter_host_parents')
         for host_id, host in list(self.hosts.items()):
             parent = host['parent'].value
-            if self.config['exclude_host_parents'] is not None and parent in self.config['exclude_host_parents']:
+            if exclude_host_parents is not None and exclude_host_parents.match(parent):
                 self.logger.debug("Skipping host '%s' because its parent '%s' is excluded", host_id, parent)
                 continue
-            if self.config['filter_host_parents'] is not None and parent not in self.config['filter_host_parents']:
+            if filter_host_parents is not None and not filter_host_parents.match(parent):
                 self.logger.debug("Skipping host '%s' because its parent '%s' is not included", host_id, parent)
                 continue
-            guests = []
-
-            try:
-                if self.config['hypervisor_id'] == 'uuid':
-                    uuid = host['hardware.systemInfo.uuid']
-                elif self.config['hypervisor_id'] == 'hwuuid':
-                    uuid = host_id
-                elif self.config['hypervisor_id'] == 'hostname':
-                    uuid = host['config.network.dnsConfig.hostName']
-                    domain_name = host['config.network.dnsConfig.domainName']
-                    if domain_name:
-                        uuid = self._format_hostname(uuid, domain_name)
-            except KeyError:
-                self.logger.debug("Host '%s' doesn't have hypervisor_id property", host_id)
-                continue
+            if host_id not in self._hypervisors:
+                self._hypervisors[host_id] = self._build_hypervisor(host_id, host)
+            hypervisor = self._hypervisors[host_id]
+            if hypervisor is not None:
+                mapping['hypervisors'].append(hypervisor)
+        return mapping
 
-            if host['vm']:
-                for vm_id in host['vm'].ManagedObjectReference:
-                    if vm_id.value not in self.vms:
-                        self.logger.debug("Host '%s' references non-existing guest '%s'", host_id, vm_id.value)
-                        continue
-                    vm = self.vms[vm_id.value]
-                    if 'config.uuid' not in vm:
-                        self.logger.debug("Guest '%s' doesn't have 'config.uuid' property", vm_id.value)
-                        continue
-                    if not vm['config.uuid'].strip():
-                        self.logger.debug("Guest '%s' has empty 'config.uuid' property", vm_id.value)
-                        continue
-                    state = virt.Guest.STATE_UNKNOWN
-                    try:
-                        if vm['runtime.powerState'] == 'poweredOn':
-                            state = virt.Guest.STATE_RUNNING
-                        elif vm['runtime.powerState'] == 'suspended':
-                            state = virt.Guest.STATE_PAUSED
-                        elif vm['runtime.powerState'] == 'poweredOff':
-                            state = virt.Guest.STATE_SHUTOFF
-                    except KeyError:
-                        self.logger.debug("Guest '%s' doesn't have 'runtime.powerState' property", vm_id.value)
-                    guests.append(virt.Guest(vm['config.uuid'], self.CONFIG_TYPE, state))
-            try:
-                name = host['config.network.dnsConfig.hostName']
+    def _build_hypervisor(self, host_id, host):
+        try:
+            if self.config['hypervisor_id'] == 'uuid':
+                uuid = host['hardware.systemInfo.uuid']
+            elif self.config['hypervisor_id'] == 'hwuuid':
+                uuid = host_id
+            elif self.config['hypervisor_id'] == 'hostname':
+                uuid = host['config.network.dnsConfig.hostName']
                 domain_name = host['config.network.dnsConfig.domainName']
                 if domain_name:
-                    name = self._format_hostname(name, domain_name)
-            except KeyError:
-                self.logger.debug("Unable to determine hostname for host '%s'", uuid)
-                name = ''
-
-            facts = {
-                virt.Hypervisor.CPU_SOCKET_FACT: str(host['hardware.cpuInfo.numCpuPackages']),
-                virt.Hypervisor.HYPERVISOR_TYPE_FACT: host.get('config.product.name', 'vmware'),
-            }
-
-            if host['parent'] and host['parent']._type == 'ClusterComputeResource':
-                cluster_id = host['parent'].value
-                # print('', self.clusters, cluster_id)
-                cluster = self.clusters[cluster_id]
-                facts[virt.Hypervisor.HYPERVISOR_CLUSTER] = cluster['name']
-
-            version = host.get('config.product.version', None)
-            if version:
-                facts[virt.Hypervisor.HYPERVISOR_VERSION_FACT] = version
-
-            mapping['hypervisors'].append(virt.Hypervisor(hypervisorId=uuid, guestIds=guests, name=name, facts=facts))
-        return mapping
+                    uuid = self._format_hostname(uuid, domain_name)
+        except KeyError:
+            self.logger.debug("Host '%s' doesn't have hypervisor_id property", host_id)
+            return None
+
+        guests = []
+        if host['vm']:
+            for vm_id in host['vm'].ManagedObjectReference:
+                # Guest that changes (or appears) invalidates the host
+                self._vm_hosts.setdefault(vm_id.value, set()).add(host_id)
+                if vm_id.value not in self.vms:
+                    self.logger.debug("Host '%s' references non-existing guest '%s'", host_id, vm_id.value)
+                    continue
+                if vm_id.value not in self._guests:
+                    self._guests[vm_id.value] = self._build_guest(vm_id.value, self.vms[vm_id.value])
+                guest = self._guests[vm_id.value]
+                if guest is not None:
+                    guests.append(guest)
+        try:
+            name = host['config.network.dnsConfig.hostName']
+            domain_name = host['config.network.dnsConfig.domainName']
+            if domain_name:
+                name = self._format_hostname(name, domain_name)
+        except KeyError:
+            self.logger.debug("Unable to determine hostname for host '%s'", uuid)
+            name = ''
+
+        facts = {
+            virt.Hypervisor.CPU_SOCKET_FACT: str(host['hardware.cpuInfo.numCpuPackages']),
+            virt.Hypervisor.HYPERVISOR_TYPE_FACT: host.get('config.product.name', 'vmware'),
+        }
+
+        if host['parent'] and host['parent']._type == 'ClusterComputeResource':
+            cluster_id = host['parent'].value
+            cluster = self.clusters[cluster_id]
+            facts[virt.Hypervisor.HYPERVISOR_CLUSTER] = cluster['name']
+
+        version = host.get('config.product.version', None)
+        if version:
+            facts[virt.Hypervisor.HYPERVISOR_VERSION_FACT] = version
+
+        return virt.Hypervisor(hypervisorId=uuid, guestIds=guests, name=name, facts=facts)
+
+    def _build_guest(self, vm_id, vm):
+        if 'config.uuid' not in vm:
+            self.logger.debug("Guest '%s' doesn't have 'config.uuid' property", vm_id)
+            return None
+        if not vm['config.uuid'].strip():
+            self.logger.debug("Guest '%s' has empty 'config.uuid' property", vm_id)
+            return None
+        state = virt.Guest.STATE_UNKNOWN
+        try:
+            if vm['runtime.powerState'] == 'poweredOn':
+                state = virt.Guest.STATE_RUNNING
+            elif vm['runtime.powerState'] == 'suspended':
+                state = virt.Guest.STATE_PAUSED
+            elif vm['runtime.powerState'] == 'poweredOff':
+                state = virt.Guest.STATE_SHUTOFF
+        except KeyError:
+            self.logger.debug("Guest '%s' doesn't have 'runtime.powerState' property", vm_id)
+        return virt.Guest(vm['config.uuid'], self.CONFIG_TYPE, state)
 
     def login(self):
         """
         Log into ESX
         """
 
-        kwargs = {'transport': RequestsTransport()}
+        if self.transport is None:
+            # Transport (and its pool of connections) is kept for next logins
+            self.transport = RequestsTransport(pool_size=self.config['connection_pool_size'],
+                                               compression=self.config['compression'],
+                                               name=self.config.name)
+        kwargs = {'transport': self.transport}
         # Connect to the vCenter server
         if self.config['simplified_vim']:
             wsdl = 'file://%s/vimServiceMinimal.wsdl' % os.path.dirname(os.path.abspath(__file__))
@@ -333,7 +618,7 @@ class Esx(virt.Virt):
         else:
             wsdl = self.url + '/sdk/vimService.wsdl'
         try:
-            self.client = suds.client.Client(wsdl, location="%s/sdk" % self.url, **kwargs)
+            self.client = create_client(wsdl, location="%s/sdk" % self.url, **kwargs)
         except requests.RequestException as e:
             raise virt.VirtError(str(e))
 
@@ -382,17 +667,9 @@ class Esx(virt.Virt):
         pfs = self.propertyFilterSpec()
         pfs.objectSet = [oSpec]
         pfs.propSet = [
-            self.createPropertySpec("VirtualMachine", ["config.uuid", "runtime.powerState"]),
-            self.createPropertySpec("ClusterComputeResource", ["name"]),
-            self.createPropertySpec("HostSystem", ["name",
-                                                   "vm",
-                                                   "hardware.systemInfo.uuid",
-                                                   "hardware.cpuInfo.numCpuPackages",
-                                                   "parent",
-                                                   "config.product.name",
-                                                   "config.product.version",
-                                                   "config.network.dnsConfig.hostName",
-                                                   "config.network.dnsConfig.domainName"])
+            self.createPropertySpec("VirtualMachine", self.VM_PROPERTIES),
+            self.createPropertySpec("ClusterComputeResource", self.CLUSTER_PROPERTIES),
+            self.createPropertySpec("HostSystem", self.HOST_PROPERTIES)
         ]
 
         try:
@@ -400,9 +677,31 @@ class Esx(virt.Virt):
         except requests.RequestException as e:
             raise virt.VirtError(str(e))
 
+    def waitForUpdates(self, version, options):
+        """
+        Call WaitForUpdatesEx, the response is parsed by the streaming
+        parser when `stream_updates` is enabled, by suds otherwise.
+        """
+        if not self.config['stream_updates']:
+            return self.client.service.WaitForUpdatesEx(
+                _this=self.sc.propertyCollector,
+                version=version,
+                options=options)
+        message = wait_for_updates_request(self.sc.propertyCollector, version,
+                                           options.get('maxWaitSeconds'),
+                                           options.get('maxObjectUpdates'))
+        headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': self.client.service.WaitForUpdatesEx.method.soap.action,
+        }
+        properties = set(self.VM_PROPERTIES + self.CLUSTER_PROPERTIES + self.HOST_PROPERTIES)
+        with self.transport.post_stream("%s/sdk" % self.url, message, headers) as stream:
+            return parse_update_set(stream, properties)
+
     def applyUpdates(self, updateSet):
         for filterSet in updateSet.filterSet:
             for objectSet in filterSet.objectSet:
+                self.object_updates += 1
                 if objectSet.obj._type == 'VirtualMachine':  # pylint: disable=W0212
                     self.applyVirtualMachineUpdate(objectSet)
                 elif objectSet.obj._type == 'HostSystem':  # pylint: disable=W0212
@@ -411,6 +710,7 @@ class Esx(virt.Virt):
                     self.applyClusterComputeResource(objectSet)
 
     def applyClusterComputeResource(self, objectSet):
+        self._invalidate_cluster(objectSet.obj.value)
         if objectSet.kind in ['enter', 'kind']:
             cluster = self.clusters[objectSet.obj.value]
             for change in objectSet.changeSet:
@@ -422,6 +722,7 @@ class Esx(virt.Virt):
             self.logger.error("Unknown update objectSet type: %s", objectSet.kind)
 
     def applyVirtualMachineUpdate(self, objectSet):
+        self._invalidate_vm(objectSet.obj.value)
         if objectSet.kind in ['enter', 'modify']:
             vm = self.vms[objectSet.obj.value]
             for change in objectSet.changeSet:
@@ -442,6 +743,7 @@ class Esx(virt.Virt):
             self.logger.error("Unknown update objectSet type: %s", objectSet.kind)
 
     def applyHostSystemUpdate(self, objectSet):
+        self._invalidate_host(objectSet.obj.value)
         if objectSet.kind in ['enter', 'modify']:
             host = self.hosts[objectSet.obj.value]
             for change in objectSet.changeSet:
@@ -534,9 +836,24 @@ class EsxConfigSection(VirtConfigSection):
         self.add_key('password', validation_method=self._validate_unencrypted_password, required=True)
         self.add_key('is_hypervisor', validation_method=self._validate_str_to_bool, default=True)
         self.add_key('simplified_vim', validation_method=self._validate_str_to_bool, default=True)
+        self.add_key('stream_updates', validation_method=self._validate_str_to_bool, default=False)
+        self.add_key('max_object_updates', validation_method=self._validate_non_negative_integer, default=0)
+        self.add_key('connection_pool_size', validation_method=self._validate_pool_size,
+                     default=requests.adapters.DEFAULT_POOLSIZE)
+        self.add_key('compression', validation_method=self._validate_str_to_bool, default=True)
         self.add_key('filter_host_parents', validation_method=self._validate_filter, default=None)
         self.add_key('exclude_host_parents', validation_method=self._validate_filter, default=None)
 
+    def _validate_pool_size(self, key):
+        error = self._validate_non_negative_integer(key)
+        if error is None and self._values[key] == 0:
+            error = (
+                'warning',
+                '%s has to be at least 1, using default: %s' % (key, self.defaults[key])
+            )
+            self._values[key] = self.defaults[key]
+        return error
+
     def _validate_server(self, key):
         error = super(EsxConfigSection, self)._validate_server(key)
         if error is None:
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Streaming parser of WaitForUpdatesEx responses of vCenter/ESX.
+
+Initial response of a large vCenter has hundreds of MB. Instead of
+building the whole tree of suds objects, the response is parsed
+incrementally, only the properties requested by virt-who are kept and
+every object update is discarded as soon as it's read. Returned objects
+have the same attributes as the suds ones that `Esx.applyUpdates` uses.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+__all__ = ['UpdateSetParseError', 'SoapFault', 'wait_for_updates_request', 'parse_update_set']
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+VIM = 'urn:vim25'
+
+_ENVELOPE = '{%s}Envelope' % SOAP_ENV
+_FAULT = '{%s}Fault' % SOAP_ENV
+_XSI_TYPE = '{%s}type' % XSI
+_RETURNVAL = '{%s}returnval' % VIM
+_VERSION = '{%s}version' % VIM
+_TRUNCATED = '{%s}truncated' % VIM
+_FILTER_SET = '{%s}filterSet' % VIM
+_OBJECT_SET = '{%s}objectSet' % VIM
+_KIND = '{%s}kind' % VIM
+_OBJ = '{%s}obj' % VIM
+_CHANGE_SET = '{%s}changeSet' % VIM
+_NAME = '{%s}name' % VIM
+_OP = '{%s}op' % VIM
+_VAL = '{%s}val' % VIM
+
+_INTEGER_TYPES = ('xsd:byte', 'xsd:short', 'xsd:int', 'xsd:long')
+
+
+class UpdateSetParseError(Exception):
+    """
+    Response is not a valid WaitForUpdatesEx response.
+    """
+    pass
+
+
+class SoapFault(Exception):
+    """
+    Response contains SOAP fault, `fault` has the same attributes
+    (faultcode, faultstring, detail) as the fault of `suds.WebFault`.
+    """
+    def __init__(self, fault):
+        super(SoapFault, self).__init__(fault.faultstring)
+        self.fault = fault
+
+
+class _Object(object):
+    """
+    Plain object with given attributes, like `suds.sudsobject.Object`.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % item for item in sorted(self.__dict__.items())))
+
+
+class ManagedObjectReference(_Object):
+    def __init__(self, value, type):
+        super(ManagedObjectReference, self).__init__(value=value, _type=type)
+
+
+class ArrayOfManagedObjectReference(_Object):
+    def __init__(self, references):
+        super(ArrayOfManagedObjectReference, self).__init__(ManagedObjectReference=references)
+
+    def __len__(self):
+        # Empty array is false, like the empty suds value
+        return len(self.ManagedObjectReference)
+
+
+def wait_for_updates_request(property_collector, version, max_wait_seconds=None, max_object_updates=None):
+    """
+    Return body of WaitForUpdatesEx request as bytes.
+
+    @param property_collector: reference to the property collector
+    (with `value` and `_type` attributes)
+    @param version: version of the previous update set, '' for the initial one
+    @type version: str
+    @param max_object_updates: maximum number of object updates in the
+    response, the rest is returned by following requests
+    @type max_object_updates: int
+    """
+    options = ''
+    if max_wait_seconds is not None:
+        options += '<maxWaitSeconds>%d</maxWaitSeconds>' % max_wait_seconds
+    if max_object_updates is not None:
+        options += '<maxObjectUpdates>%d</maxObjectUpdates>' % max_object_updates
+    if options:
+        options = '<options>%s</options>' % options
+    body = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soapenv:Envelope xmlns:soapenv="%s">'
+        '<soapenv:Body>'
+        '<WaitForUpdatesEx xmlns="%s">'
+        '<_this type=%s>%s</_this>'
+        '<version>%s</version>'
+        '%s'
+        '</WaitForUpdatesEx>'
+        '</soapenv:Body>'
+        '</soapenv:Envelope>'
+    ) % (SOAP_ENV, VIM, quoteattr(property_collector._type), escape(property_collector.value),
+         escape(version), options)
+    return body.encode('utf-8')
+
+
+def _text(element):
+    return element.text or ''
+
+
+def _value(element):
+    """
+    Convert <val> element to the value suds would create.
+    """
+    xsi_type = element.get(_XSI_TYPE, '')
+    if xsi_type == 'ArrayOfManagedObjectReference':
+        return ArrayOfManagedObjectReference([
+            ManagedObjectReference(_text(child), child.get('type')) for child in element])
+    if xsi_type == 'ManagedObjectReference':
+        return ManagedObjectReference(_text(element), element.get('type'))
+    if xsi_type in _INTEGER_TYPES:
+        return int(_text(element))
+    if xsi_type == 'xsd:boolean':
+        return _text(element) == 'true'
+    return _text(element)
+
+
+def _object_update(element, properties):
+    obj = element.find(_OBJ)
+    if obj is None:
+        raise UpdateSetParseError('objectSet without obj')
+    change_set = []
+    for change in element.iterfind(_CHANGE_SET):
+        name = _text(change.find(_NAME))
+        if properties is not None and name not in properties:
+            continue
+        attributes = {'name': name, 'op': _text(change.find(_OP))}
+        val = change.find(_VAL)
+        if val is not None:
+            attributes['val'] = _value(val)
+        change_set.append(_Object(**attributes))
+    return _Object(kind=_text(element.find(_KIND)),
+                   obj=ManagedObjectReference(_text(obj), obj.get('type')),
+                   changeSet=change_set)
+
+
+def _fault(element):
+    # Detail has an attribute for every fault in it, like the suds one
+    detail = element.find('detail')
+    if detail is not None:
+        detail = _Object(**dict((child.tag.rpartition('}')[2], _text(child)) for child in detail))
+    return _Object(faultcode=_text(element.find('faultcode')),
+                   faultstring=_text(element.find('faultstring')),
+                   detail=detail)
+
+
+def parse_update_set(source, properties=None):
+    """
+    Parse WaitForUpdatesEx response from file-like object `source`.
+
+    @param properties: names of the properties that are kept, all of them
+    when it's None
+    @type properties: set
+    @return: update set with `version`, `truncated` and `filterSet`
+    attributes or None when the response doesn't contain any update
+    @raise SoapFault: when the response is SOAP fault
+    @raise UpdateSetParseError: when the response is not valid
+    """
+    update_set = None
+    filter_set = None
+    # Elements that are open, parent of the current element is at [-2]
+    stack = []
+    try:
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element)
+                if element.tag == _RETURNVAL and len(stack) == 4:
+                    update_set = _Object(version='', truncated=False, filterSet=[])
+                elif element.tag == _FILTER_SET and update_set is not None:
+                    filter_set = _Object(objectSet=[])
+                    update_set.filterSet.append(filter_set)
+                continue
+            stack.pop()
+            if element.tag == _OBJECT_SET and filter_set is not None:
+                filter_set.objectSet.append(_object_update(element, properties))
+                # Processed object update is not needed anymore
+                stack[-1].remove(element)
+            elif element.tag == _VERSION and update_set is not None and len(stack) == 4:
+                update_set.version = _text(element)
+            elif element.tag == _TRUNCATED and update_set is not None and len(stack) == 4:
+                update_set.truncated = _text(element) == 'true'
+            elif element.tag == _FAULT:
+                raise SoapFault(_fault(element))
+            elif element.tag == _ENVELOPE:
+                return update_set
+    except ElementTree.ParseError as e:
+        raise UpdateSetParseError(str(e))
+    raise UpdateSetParseError('Response is not SOAP envelope')
@@ -184,6 +184,8 @@ class LibvirtdConfigSection(VirtConfigSection):
 
 
 class LibvirtdGuest(Guest):
+    __slots__ = ()
+
     def __init__(self, domain):
         try:
             state = domain.state(0)[0]
@@ -226,6 +228,7 @@ def libvirt_cred_request(credentials, config):
 class Libvirtd(Virt):
     """ Class for interacting with libvirt. """
     CONFIG_TYPE = "libvirt"
+    event_driven = True
 
     def __init__(self, logger, config, dest, terminate_event=None,
                  interval=None, oneshot=False, registerEvents=True):
@@ -325,7 +328,7 @@ class Libvirtd(Virt):
             if self._oneshot:
                 break
 
-            time.sleep(1)
+            self.wait(1)
             if time.time() > self.next_update:
                 report = self._get_report()
                 self._send_data(report)
@@ -342,10 +345,13 @@ class Libvirtd(Virt):
         self.next_update = time.time() + self.interval
 
     def _get_report(self):
+        start_time = time.time()
         if self.isHypervisor():
-            return HostGuestAssociationReport(self.config, self._getHostGuestMapping())
+            report = HostGuestAssociationReport(self.config, self._getHostGuestMapping())
         else:
-            return DomainListReport(self.config, self._listDomains(), self._remote_host_id())
+            report = DomainListReport(self.config, self._listDomains(), self._remote_host_id())
+        self._observe_get_data(start_time)
+        return report
 
     def _lookupDomain(self, method, domain):
         '''
@@ -23,19 +23,26 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import time
-from virtwho import log
-from operator import itemgetter
+import copy
+from virtwho import log, metrics
+from operator import attrgetter, itemgetter
 from datetime import datetime
-from threading import Thread, Event
+from threading import Thread, Event, Lock, Condition
 import json
 import hashlib
-import re
-import fnmatch
+import weakref
 import six
+from six.moves.queue import Queue
+from six.moves.urllib.parse import urlparse
+from collections import defaultdict, deque
 from virtwho.config import NotSetSentinel, Satellite5DestinationInfo, \
     Satellite6DestinationInfo, DefaultDestinationInfo, VW_GLOBAL
 from virtwho.manager import ManagerError, ManagerThrottleError, ManagerFatalError
-from virtwho import MinimumSendInterval, MinimumJobPollInterval
+from virtwho import MinimumSendInterval, MinimumJobPollInterval, DefaultFullResyncInterval
+from virtwho.scheduler import get_scheduler
+from virtwho.state import destination_key
+from virtwho.tracing import get_tracer
+from virtwho.util import FrozenDict, HostFilter
 
 try:
     from collections import OrderedDict
@@ -48,11 +55,81 @@ class VirtError(Exception):
     pass
 
 
-class Guest(object):
+# Encoder with the same output as json.dumps(..., sort_keys=True)
+_encode = json.JSONEncoder(sort_keys=True).encode
+
+
+def _intern(value):
+    """
+    Intern `value` if it's a string, values like virt type are shared
+    by many guests and hosts.
+    """
+    if type(value) is str:
+        return six.moves.intern(value)
+    return value
+
+
+class Freezable(object):
+    """
+    Mixin for objects that can be made immutable by calling `freeze` method.
+
+    Frozen objects can be shared between threads without copying, so
+    `copy.deepcopy` returns the very same object for them.
+
+    Subclasses are expected to define `__slots__` to keep the objects small.
+    """
+    __slots__ = ('_frozen',)
+
+    def __new__(cls, *args, **kwargs):
+        self = super(Freezable, cls).__new__(cls)
+        object.__setattr__(self, '_frozen', False)
+        return self
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("Can't set attribute '%s' of frozen %s" % (name, self.__class__.__name__))
+        super(Freezable, self).__setattr__(name, value)
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """
+        Make the object immutable. Returns the object itself.
+        """
+        if not self._frozen:
+            self._frozen = True
+        return self
+
+    def _attributes(self):
+        """
+        Return list of (name, value) pairs of all attributes of the object.
+        """
+        attributes = []
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name != '_frozen' and hasattr(self, name):
+                    attributes.append((name, getattr(self, name)))
+        attributes.extend(getattr(self, '__dict__', {}).items())
+        return attributes
+
+    def __deepcopy__(self, memo):
+        if self._frozen:
+            return self
+        result = self.__class__.__new__(self.__class__)
+        memo[id(self)] = result
+        for key, value in self._attributes():
+            object.__setattr__(result, key, copy.deepcopy(value, memo))
+        return result
+
+
+class Guest(Freezable):
     """
     This class represents one virtualization guest running on some
     host/hypervisor.
     """
+    __slots__ = ('uuid', 'virtWhoType', 'state')
 
     STATE_UNKNOWN = 0      # unknown state
     STATE_RUNNING = 1      # running
@@ -79,28 +156,41 @@ class Guest(object):
         `state` is a number that represents the state of the guest (stopped, running, ...)
         """
         self.uuid = uuid
-        self.virtWhoType = virt_type
-        self.state = state
+        self.virtWhoType = _intern(virt_type)
+        self.state = _intern(state)
 
     def __repr__(self):
         return 'Guest({0.uuid!r}, {0.virtWhoType!r}, {0.state!r})'.format(self)
 
+    @property
+    def active(self):
+        return 1 if self.state in (self.STATE_RUNNING, self.STATE_PAUSED) else 0
+
     def toDict(self):
         d = OrderedDict((
             ('guestId', self.uuid),
             ('state', self.state),
             ('attributes', {
                 'virtWhoType': self.virtWhoType,
-                'active': 1 if self.state in (self.STATE_RUNNING, self.STATE_PAUSED) else 0
+                'active': self.active
             }),
         ))
         return d
 
+    def toJSON(self):
+        """
+        Return JSON representation of the guest, same as `toDict`
+        serialized with sorted keys, but without creating the dictionaries.
+        """
+        return '{"attributes": {"active": %d, "virtWhoType": %s}, "guestId": %s, "state": %s}' % (
+            self.active, _encode(self.virtWhoType), _encode(self.uuid), _encode(self.state))
+
 
-class Hypervisor(object):
+class Hypervisor(Freezable):
     """
     A model for information about a hypervisor
     """
+    __slots__ = ('hypervisorId', 'guestIds', 'name', 'facts', '_hash')
 
     CPU_SOCKET_FACT = 'cpu.cpu_socket(s)'
     HYPERVISOR_TYPE_FACT = 'hypervisor.type'
@@ -138,12 +228,47 @@ class Hypervisor(object):
             d['facts'] = self.facts
         return d
 
+    def toJSON(self):
+        """
+        Return JSON representation of the hypervisor including all its
+        guests, same as `toDict` serialized with sorted keys.
+        """
+        parts = []
+        if self.facts is not None:
+            parts.append('"facts": %s' % _encode(self.facts))
+        guests = sorted(self.guestIds, key=attrgetter('uuid'))
+        parts.append('"guestIds": [%s]' % ', '.join(guest.toJSON() for guest in guests))
+        parts.append('"hypervisorId": {"hypervisorId": %s}' % _encode(self.hypervisorId))
+        if self.name is not None:
+            parts.append('"name": %s' % _encode(self.name))
+        return '{%s}' % ', '.join(parts)
+
     def __str__(self):
         return str(self.toDict())
 
+    def freeze(self):
+        """
+        Make the hypervisor and all its guests immutable.
+        """
+        if not self._frozen:
+            self.guestIds = tuple(guest.freeze() for guest in self.guestIds)
+            if self.facts is not None:
+                self.facts = FrozenDict(
+                    (_intern(key), _intern(value)) for key, value in self.facts.items())
+        return super(Hypervisor, self).freeze()
+
     def getHash(self):
-        sortedRepresentation = json.dumps(self.toDict(), sort_keys=True)
-        return hashlib.sha256(sortedRepresentation).hexdigest()
+        """
+        Return digest of the hypervisor including all its guests.
+
+        Frozen hypervisor can't change, so its digest is computed only once.
+        """
+        digest = getattr(self, '_hash', None)
+        if digest is None:
+            digest = hashlib.sha256(self.toJSON().encode('utf-8')).hexdigest()
+            if self._frozen:
+                object.__setattr__(self, '_hash', digest)
+        return digest
 
 
 class AbstractVirtReport(object):
@@ -164,6 +289,13 @@ class AbstractVirtReport(object):
     def __init__(self, config, state=STATE_CREATED):
         self._config = config
         self._state = state
+        self._frozen = False
+        # Hash of the frozen report
+        self._hash = None
+        # IDs of the traces the report belongs to, empty if not traced
+        self.trace_ids = ()
+        # When the report was placed in the datastore
+        self.stored_time = None
 
     def __repr__(self):
         return '{1}({0.config!r}, {0.state!r})'.format(self, self.__class__.__name__)
@@ -184,6 +316,19 @@ class AbstractVirtReport(object):
     def hash(self):
         return hash(self)
 
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """
+        Make data of the report immutable, so it can be shared between
+        threads without copying. The state of the report can still be changed.
+        Returns the report itself.
+        """
+        self._frozen = True
+        return self
+
 
 class ErrorReport(AbstractVirtReport):
     """
@@ -212,13 +357,23 @@ class DomainListReport(AbstractVirtReport):
     def hypervisor_id(self):
         return self._hypervisor_id
 
+    def freeze(self):
+        if not self._frozen:
+            self._guests = tuple(guest.freeze() for guest in self._guests)
+        return super(DomainListReport, self).freeze()
+
     @property
     def hash(self):
+        if self._hash is not None:
+            return self._hash
         current_hash = json.dumps(
                 sorted([g.toDict() for g in self.guests], key=itemgetter('guestId')),
                 sort_keys=True)
         current_hash += str(self.hypervisor_id)
-        return hashlib.sha256(current_hash.encode('utf-8')).hexdigest()
+        digest = hashlib.sha256(current_hash.encode('utf-8')).hexdigest()
+        if self._frozen:
+            self._hash = digest
+        return digest
 
 
 class HostGuestAssociationReport(AbstractVirtReport):
@@ -248,52 +403,59 @@ class HostGuestAssociationReport(AbstractVirtReport):
         except KeyError:
             # FIXME: default value should be there
             self.filter_type = None
+        self._exclude_filter = self._host_filter('exclude_hosts', exclude_hosts)
+        self._include_filter = self._host_filter('filter_hosts', filter_hosts)
+        # Filtered association of the frozen report
+        self._association = None
 
     def __repr__(self):
         return 'HostGuestAssociationReport({0.config!r}, {0._assoc!r}, {0.state!r})'.format(self)
 
-    def _filter(self, host, filterlist):
-        for i in filterlist:
-            if self.filter_type is None:
-                if fnmatch.fnmatch(host.lower(), i.lower()):
-                    # match is found
-                    return True
-                try:
-                    if re.match("^" + i + "$", host, re.IGNORECASE):
-                        # match is found
-                        return True
-                except:
-                    pass
-            elif self.filter_type == "wildcards":
-                if fnmatch.fnmatch(host.lower(), i.lower()):
-                    # match is found
-                    return True
-            elif self.filter_type == "regex":
-                try:
-                    if re.match("^" + i + "$", host, re.IGNORECASE):
-                        # match is found
-                        return True
-                except:
-                    pass
-        # no match
-        return False
+    def freeze(self):
+        if not self._frozen:
+            hypervisors = tuple(hypervisor.freeze() for hypervisor in self._assoc['hypervisors'])
+            self._assoc = FrozenDict(self._assoc, hypervisors=hypervisors)
+        return super(HostGuestAssociationReport, self).freeze()
+
+    def _host_filter(self, key, patterns):
+        """
+        Get matcher for list of filter `patterns`. The matcher compiled during
+        validation of config section is used, when it matches the patterns.
+        """
+        if patterns is None or patterns == NotSetSentinel:
+            return None
+        try:
+            host_filter = self._config.host_filter(key)
+        except AttributeError:
+            # Config is not a VirtConfigSection
+            host_filter = None
+        if isinstance(host_filter, HostFilter) and host_filter.patterns == tuple(patterns) and \
+                host_filter.filter_type == self.filter_type:
+            return host_filter
+        return HostFilter(patterns, self.filter_type)
 
     @property
     def association(self):
+        """
+        Association filtered by `exclude_hosts` and `filter_hosts`. It is
+        computed only once for frozen report, the result must not be modified.
+        """
+        if self._association is not None:
+            return self._association
         # Apply filter
         logger = log.getLogger(name='virt', queue=False)
         assoc = []
         for host in self._assoc['hypervisors']:
-            if self.exclude_hosts is not None and self.exclude_hosts != NotSetSentinel:
-                if self._filter(host.hypervisorId, self.exclude_hosts):
+            if self._exclude_filter is not None:
+                if self._exclude_filter.match(host.hypervisorId):
                     logger.debug("Skipping host '%s' because its ID was excluded by filter '%s'" %
                                  (host.hypervisorId, self.exclude_hosts))
                     continue
                 else:
                     logger.debug("Host %s passed filter %s" % (host.hypervisorId, self.exclude_hosts))
 
-            if self.filter_hosts is not None and self.filter_hosts != NotSetSentinel:
-                if self._filter(host.hypervisorId, self.filter_hosts):
+            if self._include_filter is not None:
+                if self._include_filter.match(host.hypervisorId):
                     logger.debug("Host %s passed filter %s" % (host.hypervisorId, self.filter_hosts))
                 else:
                     logger.debug("Skipping host '%s' because its ID was not included in filter '%s'" %
@@ -301,7 +463,10 @@ class HostGuestAssociationReport(AbstractVirtReport):
                     continue
 
             assoc.append(host)
-        return {'hypervisors': assoc}
+        association = {'hypervisors': assoc}
+        if self._frozen:
+            self._association = association
+        return association
 
     @property
     def serializedAssociation(self):
@@ -313,7 +478,52 @@ class HostGuestAssociationReport(AbstractVirtReport):
 
     @property
     def hash(self):
-        return hashlib.sha256(json.dumps(self.serializedAssociation, sort_keys=True).encode('utf-8')).hexdigest()
+        """
+        Digest of the filtered association. It is combined from digests of
+        the hypervisors, which are computed only once for frozen hypervisors,
+        so hashing a report with mostly unchanged hypervisors is cheap.
+        """
+        if self._hash is not None:
+            return self._hash
+        digests = sorted(hypervisor.getHash() for hypervisor in self.association['hypervisors'])
+        digest = hashlib.sha256(''.join(digests).encode('utf-8')).hexdigest()
+        if self._frozen:
+            self._hash = digest
+        return digest
+
+
+class ChunkedReport(AbstractVirtReport):
+    """
+    Host-to-guest mapping that was split to several reports (chunks), that
+    are checked in as separate jobs. The state is combined from states of
+    the chunks, the report is finished only when all the chunks are finished.
+    """
+    def __init__(self, config, chunks, state=AbstractVirtReport.STATE_CREATED):
+        super(ChunkedReport, self).__init__(config, state)
+        self.chunks = list(chunks)
+
+    def __repr__(self):
+        return 'ChunkedReport({0.config!r}, {0.chunks!r})'.format(self)
+
+    @property
+    def state(self):
+        states = [chunk.state or AbstractVirtReport.STATE_CREATED for chunk in self.chunks]
+        for state in (AbstractVirtReport.STATE_CREATED,
+                      AbstractVirtReport.STATE_PROCESSING,
+                      AbstractVirtReport.STATE_FAILED,
+                      AbstractVirtReport.STATE_CANCELED):
+            if state in states:
+                return state
+        return AbstractVirtReport.STATE_FINISHED
+
+    @state.setter
+    def state(self, value):
+        for chunk in self.chunks:
+            chunk.state = value
+
+    @property
+    def job_id(self):
+        return ', '.join(str(getattr(chunk, 'job_id', None)) for chunk in self.chunks)
 
 
 class IntervalThread(Thread):
@@ -327,19 +537,64 @@ class IntervalThread(Thread):
         self.terminate_event = terminate_event or self._internal_terminate_event
         self.interval = interval
         self._oneshot = oneshot
-        self.delta_time = 1.0
+        self.scheduler = get_scheduler()
+        # Event the thread is currently blocked on in `wait`
+        self._wakeup = Event()
+        # Seconds to wait before the first run, set by the executor
+        self.start_delay = 0
+        # `AdaptiveInterval` of polling sources, set by the executor
+        self.adaptive_interval = None
         super(IntervalThread, self).__init__()
 
     def wait(self, wait_time):
         """
-        Wait `wait_time` seconds, could be interrupted by setting _terminate_event or _internal_terminate_event.
+        Wait `wait_time` seconds, could be interrupted by calling `stop`.
+
+        The thread is woken up by the shared scheduler, it doesn't need
+        to poll in the meantime.
         """
-        total_time = 0.0
-        while total_time < wait_time:
-            if self.is_terminated():
-                break
-            time.sleep(self.delta_time)
-            total_time += self.delta_time
+        self._wakeup = wakeup = Event()
+        if wait_time <= 0 or self.is_terminated():
+            return
+        timer = self.scheduler.call_later(wait_time, wakeup.set)
+        try:
+            wakeup.wait()
+        finally:
+            timer.cancel()
+
+    def _delay_start(self):
+        """
+        Wait `start_delay` seconds, so the threads don't all run at once.
+        """
+        if self.start_delay > 0 and not self.is_terminated():
+            self.logger.debug("Thread '%s' delays its first run by %.1f seconds",
+                              self.config.name, self.start_delay)
+            self.wait(self.start_delay)
+
+    def _observe_get_data(self, start_time):
+        """
+        Record duration of gathering the data that started at `start_time`.
+        """
+        metrics.GET_DATA_SECONDS.observe(time.time() - start_time, thread=self.config.name)
+
+    def _current_interval(self):
+        """
+        Return the interval between runs, it changes with the change rate
+        of the reports when `adaptive_interval` is set.
+        """
+        if self.adaptive_interval is not None:
+            return self.adaptive_interval.current
+        return self.interval
+
+    def wait_terminated(self, timeout=None):
+        """
+        Block until the thread is stopped or `timeout` seconds elapse.
+
+        @return: True if the thread is terminated
+        @rtype: bool
+        """
+        self._internal_terminate_event.wait(timeout)
+        return self.is_terminated()
 
     def is_terminated(self):
         """
@@ -355,6 +610,7 @@ class IntervalThread(Thread):
         Causes this thread to stop at the next idle moment
         """
         self._internal_terminate_event.set()
+        self._wakeup.set()
 
     def _run(self):
         """
@@ -364,8 +620,12 @@ class IntervalThread(Thread):
         self.prepare()
         while not self.is_terminated():
             start_time = datetime.now()
+            get_data_start = time.time()
             data_to_send = self._get_data()
+            self._observe_get_data(get_data_start)
+            send_data_start = time.time()
             self._send_data(data_to_send)
+            metrics.SEND_DATA_SECONDS.observe(time.time() - send_data_start, thread=self.config.name)
             if self._oneshot:
                 self._internal_terminate_event.set()
                 break
@@ -377,7 +637,7 @@ class IntervalThread(Thread):
                              delta.days * 86400 + delta.seconds) * 10 ** 6 +
                              delta.microseconds) / 10 ** 6
 
-            wait_time = self.interval - int(delta_seconds)
+            wait_time = self._current_interval() - int(delta_seconds)
 
             if wait_time < 0:
                 self.logger.debug(
@@ -385,7 +645,14 @@ class IntervalThread(Thread):
                     "interval. Trying again immediately.")
                 continue
 
-            self.wait(wait_time)
+            self._wait_for_next_run(wait_time)
+
+    def _wait_for_next_run(self, wait_time):
+        """
+        Wait before next run of `_get_data` and `_send_data`. Subclasses
+        could reimplement it to start next run earlier.
+        """
+        self.wait(wait_time)
 
     def _get_data(self):
         """
@@ -468,6 +735,7 @@ class IntervalThread(Thread):
         @return: The number of seconds that should be waited before retrying
         @rtype: int
         """
+        metrics.RATE_LIMITED.inc()
         if retry_after is not None:
             try:
                 return int(retry_after)
@@ -486,10 +754,15 @@ class DestinationThread(IntervalThread):
 
     This class should work so long as the destination is a Manager object.
     """
+    # Destination is able to process reports with only some hypervisors
+    supports_delta_reporting = True
 
     def __init__(self, logger, config, source_keys=None, options=None,
                  source=None, dest=None, terminate_event=None, interval=None,
-                 oneshot=False):
+                 oneshot=False, delta_reporting=False,
+                 full_resync_interval=DefaultFullResyncInterval,
+                 max_hypervisors_per_checkin=0, max_guests_per_checkin=0,
+                 state_file=None):
         """
         @param source_keys: A list of keys to be used to retrieve info from
         the source
@@ -500,6 +773,26 @@ class DestinationThread(IntervalThread):
 
         @param dest: The destination object to use to actually send the data
         @type dest: Manager
+
+        @param delta_reporting: Send only hypervisors that were added, changed
+        or removed since the last report processed by the destination
+        @type delta_reporting: bool
+
+        @param full_resync_interval: How often (in seconds) is the complete
+        mapping sent, when delta_reporting is enabled
+        @type full_resync_interval: int
+
+        @param max_hypervisors_per_checkin: Maximum number of hypervisors
+        sent in one request, larger mappings are split (0 means unlimited)
+        @type max_hypervisors_per_checkin: int
+
+        @param max_guests_per_checkin: Maximum number of guests sent in one
+        request, larger mappings are split (0 means unlimited)
+        @type max_guests_per_checkin: int
+
+        @param state_file: File where digests of sent reports and IDs of
+        unfinished jobs are kept across restarts, not used in oneshot mode
+        @type state_file: StateFile
         """
         if not isinstance(source_keys, list):
             raise ValueError("Source keys must be a list")
@@ -507,6 +800,8 @@ class DestinationThread(IntervalThread):
         self.source_keys = source_keys
         self.last_report_for_source = {}  # Source_key to hash of last report
         self.submitted_report_and_hash_for_source = {}  # Source key to submitted batch report and hash
+        # Submitted batch report to time of the check in, for the metrics
+        self._checkin_times = weakref.WeakKeyDictionary()
         self.options = options
         self.reports_to_print = []  # A list of reports we would send but are
         #  going to print instead, to be used by the owner of the thread
@@ -520,16 +815,177 @@ class DestinationThread(IntervalThread):
         # EX when we get a 429 back from the server, this value will be the
         # value of the retry_after header.
         self.interval_modifier = 0
+        # Generations of the source keys in the datastore that were seen
+        # by the last run
+        self.source_generations = {}
+        self.delta_reporting = delta_reporting and self.supports_delta_reporting
+        self.full_resync_interval = full_resync_interval
+        self.last_full_report_time = None  # Time of last complete mapping sent in delta mode
+        # Source key to {hypervisorId: digest} of the submitted report
+        self.submitted_digests_for_source = {}
+        # Source key to {hypervisorId: digest} of the last report processed by destination
+        self.acknowledged_digests_for_source = {}
+        self.max_hypervisors_per_checkin = max_hypervisors_per_checkin
+        self.max_guests_per_checkin = max_guests_per_checkin
+        # Oneshot mode always sends the reports
+        self.state_file = state_file if not oneshot else None
+        if self.state_file is not None:
+            self.state_key = destination_key(config)
+            self._restore_state()
+
+    def _restore_state(self):
+        """
+        Restore digests of reports sent by previous run of virt-who and
+        jobs that the server may still be processing, for current sources.
+        """
+        state = self.state_file.get(self.state_key)
+        if not state:
+            return
+        source_keys = set(self.source_keys)
+        for source_key, report_hash in state.get('last_report_for_source', {}).items():
+            if source_key in source_keys:
+                self.last_report_for_source[source_key] = report_hash
+        if self.delta_reporting:
+            for source_key, digests in state.get('acknowledged_digests_for_source', {}).items():
+                if source_key in source_keys:
+                    self.acknowledged_digests_for_source[source_key] = digests
+            self.last_full_report_time = state.get('last_full_report_time')
+        # Sources checked in together share the jobs
+        reports_for_jobs = {}
+        for source_key, pending in state.get('pending', {}).items():
+            if source_key not in source_keys:
+                continue
+            job_ids = tuple(pending['job_ids'])
+            if job_ids not in reports_for_jobs:
+                reports_for_jobs[job_ids] = self._report_for_jobs(job_ids)
+            self.submitted_report_and_hash_for_source[source_key] = (reports_for_jobs[job_ids], pending['hash'])
+            if self.delta_reporting and pending.get('digests') is not None:
+                self.submitted_digests_for_source[source_key] = pending['digests']
+        self.logger.debug('Restored state of %d sources from "%s"',
+                          len(set(self.last_report_for_source) | set(self.submitted_report_and_hash_for_source)),
+                          self.state_file.path)
+
+    def _report_for_jobs(self, job_ids):
+        """
+        Create report that stands for the submitted report whose
+        jobs have `job_ids`, so the jobs are checked as usual.
+        """
+        chunks = []
+        for job_id in job_ids:
+            chunk = HostGuestAssociationReport(self.config, {'hypervisors': []},
+                                               state=AbstractVirtReport.STATE_PROCESSING)
+            chunk.job_id = job_id
+            chunks.append(chunk)
+        if len(chunks) == 1:
+            return chunks[0]
+        return ChunkedReport(self.config, chunks)
+
+    @staticmethod
+    def _job_ids(report):
+        """
+        Return list of IDs of the jobs of the submitted report or None
+        if some job ID is not known.
+        """
+        chunks = report.chunks if isinstance(report, ChunkedReport) else [report]
+        job_ids = [getattr(chunk, 'job_id', None) for chunk in chunks]
+        if None in job_ids:
+            return None
+        return job_ids
+
+    def _save_state(self):
+        """
+        Write digests of sent reports and unfinished jobs to the state file.
+        """
+        if self.state_file is None:
+            return
+        pending = {}
+        for source_key, (report, report_hash) in self.submitted_report_and_hash_for_source.items():
+            job_ids = self._job_ids(report)
+            if job_ids is None:
+                continue
+            pending[source_key] = {
+                'hash': report_hash,
+                'job_ids': job_ids,
+                'digests': self.submitted_digests_for_source.get(source_key),
+            }
+        self.state_file.set(self.state_key, {
+            'last_report_for_source': self.last_report_for_source,
+            'acknowledged_digests_for_source': self.acknowledged_digests_for_source,
+            'last_full_report_time': self.last_full_report_time,
+            'pending': pending,
+        })
+
+    def run(self):
+        try:
+            self._delay_start()
+            super(DestinationThread, self).run()
+        finally:
+            # Keep what was sent since the last save
+            self._save_state()
+
+    def _get_source_generations(self, source_keys):
+        generations = getattr(self.source, 'generations', None)
+        if generations is None:
+            return {}
+        return generations(source_keys)
+
+    def _wait_for_source(self, source_keys, timeout, since):
+        """
+        Wait until a new report for one of the source_keys is placed in the
+        source or the timeout expires.
+        """
+        wait_for_change = getattr(self.source, 'wait_for_change', None)
+        if wait_for_change is None:
+            # The source is not able to notify us, check it again in a while
+            self.wait(min(1, timeout))
+            return
+        if not self.is_terminated():
+            wait_for_change(source_keys, timeout=timeout, since=since, waiter=self)
+
+    def _wait_for_next_run(self, wait_time):
+        """
+        Wait until some source of this destination publishes a new report,
+        but don't start next run sooner than MinimumSendInterval seconds
+        after the previous one.
+        """
+        self._save_state()
+        # wait_time is the rest of the interval, compute how much of
+        # the MinimumSendInterval remains
+        minimum_wait = max(0, min(wait_time, wait_time - self.interval + MinimumSendInterval))
+        if minimum_wait > 0:
+            self.wait(minimum_wait)
+        remaining = wait_time - minimum_wait
+        if remaining > 0 and not self.is_terminated():
+            self._wait_for_source(self.source_keys, remaining, self.source_generations)
+
+    def stop(self):
+        super(DestinationThread, self).stop()
+        # Wake up the thread if it is waiting for new reports, other
+        # destinations keep waiting
+        interrupt = getattr(self.source, 'interrupt', None)
+        if interrupt is not None:
+            interrupt(self)
 
     def _get_data(self):
         """
         Gets the latest report from the source for each source_key
         @return: dict
         """
+        self.source_generations = self._get_source_generations(self.source_keys)
         if self.is_initial_run:
             return self._get_data_initial()
+        if self.delta_reporting and self._full_resync_due():
+            # Resend complete mapping of all sources, even if it didn't change
+            return self._get_data_common(self.source_keys, ignore_duplicates=False)
         return self._get_data_common(self.source_keys)
 
+    def _full_resync_due(self):
+        """
+        Return True if complete mapping should be sent in delta reporting mode.
+        """
+        return self.last_full_report_time is None or \
+            time.time() - self.last_full_report_time >= self.full_resync_interval
+
     def _get_data_common(self, source_keys, ignore_duplicates=True, log_missing_reports=True):
         reports = {}
         for source_key in source_keys:
@@ -544,8 +1000,11 @@ class DestinationThread(IntervalThread):
                 submitted_hash = self.submitted_report_and_hash_for_source[source_key][1]
                 self.check_report_status(submitted_report)
                 self.submitted_report_and_hash_for_source.pop(source_key)
+                submitted_digests = self.submitted_digests_for_source.pop(source_key, None)
                 if submitted_report.state == AbstractVirtReport.STATE_FINISHED:
                     self.last_report_for_source[source_key] = submitted_hash
+                    if submitted_digests is not None:
+                        self.acknowledged_digests_for_source[source_key] = submitted_digests
                     if ignore_duplicates and report.hash == submitted_hash:
                         self.logger.debug('Duplicate report found for config "%s", ignoring',
                                           report.config.name)
@@ -555,6 +1014,8 @@ class DestinationThread(IntervalThread):
                     self.logger.warning('Job %s has not finished processing. Will check after next interval.',
                                         str(submitted_report.job_id))
                     self.submitted_report_and_hash_for_source[source_key] = (submitted_report, submitted_hash)
+                    if submitted_digests is not None:
+                        self.submitted_digests_for_source[source_key] = submitted_digests
                     continue
             elif ignore_duplicates and report.hash == self.last_report_for_source.get(source_key,
                                                                                     None):
@@ -570,23 +1031,33 @@ class DestinationThread(IntervalThread):
         does not check to see if the data has been previously sent. This method will wait for a
         maximum of the self.interval period of time, then return whatever it has gathered thus far.
         If data for each source key is gathered before the interval has expired, this method will
-        return.
+        return. Reports that were already sent before restart of virt-who (see `state_file`)
+        are left out.
         @return: dict
         """
         reports = {}
-        while not reports and not self.is_terminated():
+        unchanged = set()  # Source keys with reports sent by previous run
+        while not reports and not unchanged and not self.is_terminated():
             source_keys_remaining = set(self.source_keys)
-            time_waited = 0
-            while len(source_keys_remaining) > 0 and time_waited < self.interval and not self.is_terminated():
+            deadline = time.time() + self.interval
+            while len(source_keys_remaining) > 0 and not self.is_terminated():
+                generations = self._get_source_generations(source_keys_remaining)
                 found_reports = self._get_data_common(source_keys_remaining,
                                                       ignore_duplicates=False,
                                                       log_missing_reports=False)
-                reports.update(found_reports)
+                for source_key, report in found_reports.items():
+                    if report.hash == self.last_report_for_source.get(source_key):
+                        self.logger.debug('Report for config "%s" was already sent, ignoring',
+                                          report.config.name)
+                        unchanged.add(source_key)
+                    else:
+                        reports[source_key] = report
                 source_keys_remaining.difference_update(found_reports.keys())
-                if len(source_keys_remaining) > 0:
-                    sleep_time = 1
-                    time.sleep(sleep_time)
-                    time_waited += sleep_time
+                remaining_time = deadline - time.time()
+                if len(source_keys_remaining) == 0 or remaining_time <= 0:
+                    break
+                # Wake up as soon as some of the remaining sources has a report
+                self._wait_for_source(source_keys_remaining, remaining_time, generations)
         self.is_initial_run = False
         return reports
 
@@ -604,6 +1075,7 @@ class DestinationThread(IntervalThread):
             if data_to_send.config.name != self.config.name:
                 self.stop()
             return
+        self._trace_datastore_wait(data_to_send)
 
         all_hypervisors = []  # All the Host-guest mappings together
         domain_list_reports = []  # Source_keys of DomainListReports
@@ -614,6 +1086,10 @@ class DestinationThread(IntervalThread):
         total_hypervisors = 0
         total_guests = 0
 
+        # Complete mapping has to be sent from time to time in delta reporting mode
+        full_resync = self.delta_reporting and self._full_resync_due()
+        digests_for_source = {}  # Source_key to {hypervisorId: digest} of the reports
+
         # Reports of different types are handled differently
         for source_key, report in data_to_send.items():
             if getattr(self.config, 'owner', None) is None and \
@@ -627,16 +1103,26 @@ class DestinationThread(IntervalThread):
                 domain_list_reports.append(source_key)
                 continue
             if isinstance(report, HostGuestAssociationReport):
-                # These reports are put into one report to send at once
-                all_hypervisors.extend(report.association['hypervisors'])
-                # Keep track of those reports that we have
-                reports_batched.append(source_key)
+                hypervisors = report.association['hypervisors']
                 # Print information about host-to-quest mapping for this report
-                mapping = report.association
-                hypervisor_count = len(mapping['hypervisors'])
-                guest_count = sum(len(hypervisor.guestIds) for hypervisor in mapping['hypervisors'])
+                hypervisor_count = len(hypervisors)
+                guest_count = sum(len(hypervisor.guestIds) for hypervisor in hypervisors)
                 self.logger.info('Hosts-to-guests mapping for config "%s": %d hypervisors and %d guests found',
                                  report.config.name, hypervisor_count, guest_count)
+                if self.delta_reporting:
+                    digests = dict((hypervisor.hypervisorId, hypervisor.getHash()) for hypervisor in hypervisors)
+                    digests_for_source[source_key] = digests
+                    acknowledged_digests = self.acknowledged_digests_for_source.get(source_key)
+                    if not full_resync and acknowledged_digests is not None:
+                        hypervisors = self._changed_hypervisors(hypervisors, digests, acknowledged_digests)
+                        hypervisor_count = len(hypervisors)
+                        guest_count = sum(len(hypervisor.guestIds) for hypervisor in hypervisors)
+                        self.logger.debug('Hosts-to-guests mapping for config "%s": %d hypervisors '
+                                          'were added, changed or removed', report.config.name, hypervisor_count)
+                # These reports are put into one report to send at once
+                all_hypervisors.extend(hypervisors)
+                # Keep track of those reports that we have
+                reports_batched.append(source_key)
                 total_hypervisors += hypervisor_count
                 total_guests += guest_count
                 continue
@@ -655,49 +1141,48 @@ class DestinationThread(IntervalThread):
         # HostGuestAssociationReports
         all_hypervisors_dict = {'hypervisors': all_hypervisors}
         batch_host_guest_report = HostGuestAssociationReport(self.config, all_hypervisors_dict)
+        batch_host_guest_report.trace_ids = tuple(trace_id for source_key in reports_batched
+                                                  for trace_id in data_to_send[source_key].trace_ids)
 
         if all_hypervisors:
+            # Very large mappings are sent in several requests
+            chunks = self._split_hypervisors(all_hypervisors)
+            if len(chunks) > 1:
+                self.logger.info('Host-to-guest mapping will be sent in %d parts', len(chunks))
+                chunk_reports = [HostGuestAssociationReport(self.config, {'hypervisors': chunk})
+                                 for chunk in chunks]
+                for chunk_report in chunk_reports:
+                    chunk_report.trace_ids = batch_host_guest_report.trace_ids
+                trace_ids = batch_host_guest_report.trace_ids
+                batch_host_guest_report = ChunkedReport(self.config, chunk_reports)
+                batch_host_guest_report.trace_ids = trace_ids
+            else:
+                chunk_reports = [batch_host_guest_report]
+
             result = None
-            # Try to actually do the checkin whilst being mindful of the
-            # rate limit (retrying where necessary)
-            num_429_received = 0
-            while result is None and not self.is_terminated():
-                try:
-                    self.logger.info('Sending updated Host-to-guest mapping to "{owner}" including '
-                                     '{num_hypervisors} hypervisors and {num_guests} '
-                                     'guests'.format(owner=self.config['owner'],
-                                                     num_hypervisors=total_hypervisors,
-                                                     num_guests=total_guests))
-                    result = self.dest.hypervisorCheckIn(
-                            batch_host_guest_report,
-                            options=self.options)
-                    break
-                except ManagerThrottleError as e:
-                    if self._oneshot:
-                        self.logger.debug('429 encountered while performing hypervisor checkin in '
-                                          'oneshot mode, not retrying')
-                        sources_erred.extend(reports_batched)
-                        break
-                    num_429_received += 1
-                    retry_after = self.handle_429(e.retry_after, num_429_received)
-                    self.logger.debug("429 encountered while performing "
-                                      "hypervisor check in.\n"
-                                      "Trying again in "
-                                      "%s", retry_after)
-                    self.interval_modifier = retry_after
-                except (ManagerError, ManagerFatalError) as err:
-                    self.logger.exception("Error during hypervisor "
-                                          "checkin: %s" % err)
-                    if self._oneshot:
-                        sources_erred.extend(reports_batched)
+            for chunk_report in chunk_reports:
+                if len(chunk_reports) > 1:
+                    num_hypervisors = len(chunk_report.association['hypervisors'])
+                    num_guests = sum(len(hypervisor.guestIds)
+                                     for hypervisor in chunk_report.association['hypervisors'])
+                else:
+                    num_hypervisors = total_hypervisors
+                    num_guests = total_guests
+                result = self._hypervisor_check_in(chunk_report, num_hypervisors, num_guests,
+                                                   reports_batched, sources_erred)
+                if not result:
+                    # Don't send the rest of the mapping, it will be sent again with next report
                     break
-                self.wait(wait_time=self.interval_modifier)
-                self.interval_modifier = 0
 
             if result:
+                self._checkin_times[batch_host_guest_report] = time.time()
                 for source_key in reports_batched:
                     self.submitted_report_and_hash_for_source[source_key] =\
                         (batch_host_guest_report, data_to_send[source_key].hash)
+                    if source_key in digests_for_source:
+                        self.submitted_digests_for_source[source_key] = digests_for_source[source_key]
+                if full_resync:
+                    self.last_full_report_time = time.time()
 
         # Send each Domain Guest List Report if necessary
         for source_key in domain_list_reports:
@@ -707,7 +1192,8 @@ class DestinationThread(IntervalThread):
                 num_429_received = 0
                 while retry and not self.is_terminated():  # Retry if we encounter a 429
                     try:
-                        self.dest.sendVirtGuests(report, options=self.options)
+                        with get_tracer().span('send_guests', report.trace_ids, destination=self.config.name):
+                            self.dest.sendVirtGuests(report, options=self.options)
                         sources_sent.append(source_key)
                         self.last_report_for_source[source_key] = data_to_send[
                             source_key].hash
@@ -753,12 +1239,118 @@ class DestinationThread(IntervalThread):
                                 if source_key not in sources_sent]
         return
 
+    def _hypervisor_check_in(self, report, num_hypervisors, num_guests, reports_batched, sources_erred):
+        """
+        Send host-to-guest mapping to the destination, retry when the rate
+        limit is exceeded.
+
+        @param reports_batched: Source_keys of reports included in the mapping
+        @param sources_erred: List of erred source_keys that is extended
+        when the check in fails in oneshot mode
+        @return: Result of hypervisorCheckIn or None when it failed
+        """
+        result = None
+        # Try to actually do the checkin whilst being mindful of the
+        # rate limit (retrying where necessary)
+        num_429_received = 0
+        while result is None and not self.is_terminated():
+            try:
+                self.logger.info('Sending updated Host-to-guest mapping to "{owner}" including '
+                                 '{num_hypervisors} hypervisors and {num_guests} '
+                                 'guests'.format(owner=self.config['owner'],
+                                                 num_hypervisors=num_hypervisors,
+                                                 num_guests=num_guests))
+                checkin_start = time.time()
+                try:
+                    result = self.dest.hypervisorCheckIn(
+                            report,
+                            options=self.options)
+                finally:
+                    metrics.CHECKIN_SECONDS.observe(time.time() - checkin_start,
+                                                    destination=self.config.name)
+                    get_tracer().record('checkin', report.trace_ids, checkin_start,
+                                        destination=self.config.name,
+                                        hypervisors=num_hypervisors, guests=num_guests)
+                metrics.CHECKINS.inc(destination=self.config.name, result='success')
+                break
+            except ManagerThrottleError as e:
+                metrics.CHECKINS.inc(destination=self.config.name, result='throttled')
+                if self._oneshot:
+                    self.logger.debug('429 encountered while performing hypervisor checkin in '
+                                      'oneshot mode, not retrying')
+                    sources_erred.extend(reports_batched)
+                    break
+                num_429_received += 1
+                retry_after = self.handle_429(e.retry_after, num_429_received)
+                self.logger.debug("429 encountered while performing "
+                                  "hypervisor check in.\n"
+                                  "Trying again in "
+                                  "%s", retry_after)
+                self.interval_modifier = retry_after
+            except (ManagerError, ManagerFatalError) as err:
+                metrics.CHECKINS.inc(destination=self.config.name, result='error')
+                self.logger.exception("Error during hypervisor "
+                                      "checkin: %s" % err)
+                if self._oneshot:
+                    sources_erred.extend(reports_batched)
+                break
+            self.wait(wait_time=self.interval_modifier)
+            self.interval_modifier = 0
+        return result
+
+    def _split_hypervisors(self, hypervisors):
+        """
+        Split list of hypervisors to chunks with at most
+        max_hypervisors_per_checkin hypervisors and max_guests_per_checkin
+        guests. Hypervisor with more guests than the limit is sent alone.
+
+        @return: list of lists of Hypervisor objects
+        """
+        max_hypervisors = self.max_hypervisors_per_checkin
+        max_guests = self.max_guests_per_checkin
+        if not max_hypervisors and not max_guests:
+            return [hypervisors]
+        chunks = []
+        chunk = []
+        chunk_guests = 0
+        for hypervisor in hypervisors:
+            guest_count = len(hypervisor.guestIds)
+            if chunk and ((max_hypervisors and len(chunk) >= max_hypervisors) or
+                          (max_guests and chunk_guests + guest_count > max_guests)):
+                chunks.append(chunk)
+                chunk = []
+                chunk_guests = 0
+            chunk.append(hypervisor)
+            chunk_guests += guest_count
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _changed_hypervisors(hypervisors, digests, acknowledged_digests):
+        """
+        Get hypervisors that were added or changed since the acknowledged
+        report. Removed hypervisors are reported without any guests.
+
+        @param hypervisors: Current hypervisors of the source
+        @param digests: Dict of hypervisorId to digest of current hypervisors
+        @param acknowledged_digests: Dict of hypervisorId to digest of
+        hypervisors in the last report processed by destination
+        @return: list of Hypervisor objects
+        """
+        changed = [hypervisor for hypervisor in hypervisors
+                   if acknowledged_digests.get(hypervisor.hypervisorId) != digests[hypervisor.hypervisorId]]
+        for hypervisor_id in sorted(set(acknowledged_digests) - set(digests)):
+            changed.append(Hypervisor(hypervisor_id, guestIds=[]))
+        return changed
+
     def check_report_status(self, report):
         """
         Checks at the server for the state of the previously submitted job. The state is recorded
         in the passed-in report
         """
         self.logger.debug("Existing report state: %s" % report.state)
+        pending = report.state in (None, AbstractVirtReport.STATE_CREATED, AbstractVirtReport.STATE_PROCESSING)
         num_429_received = 0
         first_attempt = True
         while not report.state or report.state == AbstractVirtReport.STATE_CREATED\
@@ -774,7 +1366,15 @@ class DestinationThread(IntervalThread):
             self.wait(wait_time=wait_time)
 
             try:
-                self.dest.check_report_state(report)
+                with get_tracer().span('job_check', report.trace_ids, destination=self.config.name):
+                    if isinstance(report, ChunkedReport):
+                        # Check only jobs of chunks that are not finished yet
+                        for chunk in report.chunks:
+                            if not chunk.state or chunk.state in (AbstractVirtReport.STATE_CREATED,
+                                                                  AbstractVirtReport.STATE_PROCESSING):
+                                self.dest.check_report_state(chunk)
+                    else:
+                        self.dest.check_report_state(report)
             except ManagerThrottleError as e:
                 if self._oneshot:
                     self.logger.debug('429 encountered when checking job state in '
@@ -789,9 +1389,46 @@ class DestinationThread(IntervalThread):
                 break
             # If we get here and have to try again, it's not our first rodeo...
             first_attempt = False
+        self._observe_job(report, pending)
+
+    def _observe_job(self, report, pending):
+        """
+        Record how long the server processed the job of `report`, if it
+        was `pending` before the check and it's done now.
+        """
+        checkin_time = self._checkin_times.get(report)
+        if not pending or checkin_time is None:
+            return
+        states = {
+            AbstractVirtReport.STATE_FINISHED: 'finished',
+            AbstractVirtReport.STATE_FAILED: 'failed',
+            AbstractVirtReport.STATE_CANCELED: 'canceled',
+        }
+        state = states.get(report.state)
+        if state is not None:
+            del self._checkin_times[report]
+            metrics.JOB_SECONDS.observe(time.time() - checkin_time,
+                                        destination=self.config.name, state=state)
+            get_tracer().record('job', report.trace_ids, checkin_time,
+                                destination=self.config.name, state=state)
+
+    def _trace_datastore_wait(self, data_to_send):
+        """
+        Record how long the reports waited in the datastore.
+        """
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return
+        now = time.time()
+        for report in data_to_send.values():
+            if report.stored_time is not None:
+                tracer.record('datastore', report.trace_ids, report.stored_time, now,
+                              destination=self.config.name)
 
 
 class Satellite5DestinationThread(DestinationThread):
+    # Reports are checked in to Satellite 5 one by one, without delta reporting
+    supports_delta_reporting = False
 
     def _send_data(self, data_to_send):
         """
@@ -831,9 +1468,10 @@ class Satellite5DestinationThread(DestinationThread):
                 num_429_received = 0
                 while result is None and not self.is_terminated():
                     try:
-                        result = self.dest.hypervisorCheckIn(
-                                report,
-                                options=self.options)
+                        with get_tracer().span('checkin', report.trace_ids, destination=self.config.name):
+                            result = self.dest.hypervisorCheckIn(
+                                    report,
+                                    options=self.options)
                         self.last_report_for_source[source_key] = report.hash
                         sources_sent.append(source_key)
                         break
@@ -893,13 +1531,25 @@ class Virt(IntervalThread):
     Run `start` method to start obtaining data about virtual guests. The data
     will be pushed to the dest(ination) that is parameter of the `__init__`
     method.
+
+    Backends that only poll the data in intervals could be run by `VirtPool`
+    instead, backends reimplementing `_run` to wait for events must set
+    `event_driven` to True.
     """
+    event_driven = False
 
     def __init__(self, logger, config, dest, terminate_event=None,
                  interval=None, oneshot=False):
         super(Virt, self).__init__(logger, config, dest=dest,
                                    terminate_event=terminate_event,
                                    interval=interval, oneshot=oneshot)
+        self._prepared = False
+        # Shared `LoginLimiter`, set by the executor
+        self.login_limiter = None
+        self._first_poll = True
+        self._login_acquired = False
+        # Spans of the report that is being gathered
+        self._pending_spans = []
 
     @classmethod
     def __subclasses_list(cls):
@@ -946,6 +1596,73 @@ class Virt(IntervalThread):
         '''
         self._run()
 
+    def run(self):
+        self._delay_start()
+        self._acquire_login()
+        try:
+            super(Virt, self).run()
+        finally:
+            self._release_login()
+
+    def stop(self):
+        super(Virt, self).stop()
+        if self.login_limiter is not None:
+            self.login_limiter.interrupt()
+
+    def _acquire_login(self):
+        """
+        Wait until the first poll is allowed by the `login_limiter`, the
+        slot is released when the first report is gathered.
+        """
+        if not self._first_poll:
+            return
+        self._first_poll = False
+        if self.login_limiter is not None:
+            self._login_acquired = self.login_limiter.acquire(self)
+
+    def _release_login(self):
+        if self._login_acquired:
+            self._login_acquired = False
+            self.login_limiter.release()
+
+    def poll(self):
+        """
+        Gather the report once and place it in the datastore. It's used
+        by `VirtPool` instead of running the thread, errors are handled
+        the same way as in `run`.
+
+        @return: number of seconds until the next poll
+        @rtype: float
+        """
+        self._acquire_login()
+        start_time = time.time()
+        try:
+            if not self._prepared:
+                self.prepare()
+                self._prepared = True
+            data_to_send = self._get_data()
+            self._observe_get_data(start_time)
+            self._send_data(data_to_send)
+            wait_time = self._current_interval() - (time.time() - start_time)
+        except Exception as e:
+            # Prepare the backend again next time, like `run` does
+            self._prepared = False
+            wait_time = self.interval
+            if not self.is_terminated():
+                if isinstance(e, VirtError):
+                    self.logger.error("Thread '%s' fails with error: %s",
+                                      self.config.name, str(e))
+                else:
+                    self.logger.exception("Thread '%s' fails with "
+                                          "exception:", self.config.name)
+                self._send_data(ErrorReport(self.config))
+        if self._oneshot:
+            self.logger.debug("Thread '%s' stopped after running once",
+                              self.config.name)
+            self._internal_terminate_event.set()
+        self._release_login()
+        return max(0, wait_time)
+
     def _get_report(self):
         if self.isHypervisor():
             return HostGuestAssociationReport(self.config, self.getHostGuestMapping())
@@ -962,13 +1679,70 @@ class Virt(IntervalThread):
         """
         return self._get_report()
 
+    def _observe_get_data(self, start_time):
+        super(Virt, self)._observe_get_data(start_time)
+        self._trace('collect', start_time)
+
+    def _trace(self, name, start_time):
+        """
+        Keep span `name` (that started at `start_time` and ends now) of
+        the report that is being gathered, it's recorded when the report
+        gets its trace ID.
+        """
+        if get_tracer().enabled:
+            self._pending_spans.append((name, start_time, time.time()))
+
     def _send_data(self, data_to_send):
+        # The first report (or error) is gathered, let others log in
+        self._release_login()
         if self.is_terminated():
             return
         self.logger.info('Report for config "%s" gathered, placing in '
                           'datastore', data_to_send.config.name)
+        # Frozen report is stored in the datastore without copying
+        data_to_send.freeze()
+        self._start_trace(data_to_send)
+        self._observe_report(data_to_send)
+        if self.adaptive_interval is not None and not isinstance(data_to_send, ErrorReport):
+            previous = self.adaptive_interval.current
+            self.adaptive_interval.observe(data_to_send.hash)
+            if self.adaptive_interval.current != previous:
+                self.logger.debug('Interval of config "%s" changed to %d seconds',
+                                  self.config.name, self.adaptive_interval.current)
+        data_to_send.stored_time = time.time()
         self.dest.put(self.config.name, data_to_send)
 
+    def _start_trace(self, report):
+        """
+        Assign trace ID to the `report` and record the spans of gathering it.
+        """
+        spans, self._pending_spans = self._pending_spans, []
+        tracer = get_tracer()
+        trace_id = tracer.new_trace_id()
+        if trace_id is None:
+            return
+        report.trace_ids = (trace_id,)
+        for name, start_time, end_time in spans:
+            tracer.record(name, report.trace_ids, start_time, end_time, config=self.config.name)
+        # Hash is computed only once for the frozen report, it's used later anyway
+        with tracer.span('hash', report.trace_ids, config=self.config.name):
+            report.hash
+
+    def _observe_report(self, report):
+        name = self.config.name
+        metrics.REPORT_TIMESTAMP.set(time.time(), config=name)
+        if isinstance(report, HostGuestAssociationReport):
+            hypervisors = report.association['hypervisors']
+            metrics.REPORTS.inc(config=name, type='association')
+            metrics.REPORT_HYPERVISORS.set(len(hypervisors), config=name)
+            metrics.REPORT_GUESTS.set(sum(len(hypervisor.guestIds) for hypervisor in hypervisors),
+                                      config=name)
+        elif isinstance(report, DomainListReport):
+            metrics.REPORTS.inc(config=name, type='domains')
+            metrics.REPORT_GUESTS.set(len(report.guests), config=name)
+        else:
+            metrics.REPORTS.inc(config=name, type='error')
+
     def isHypervisor(self):
         """
         Return True if the virt instance represents hypervisor environment
@@ -1016,6 +1790,218 @@ class Virt(IntervalThread):
         self._username = self._to_unicode(value)
 
 
+class VirtPool(object):
+    """
+    Fixed number of worker threads polling virt backends.
+
+    Every virt is a job that is queued by the shared scheduler when its
+    interval elapses, so the backends don't need a thread of their own.
+
+    When `max_polls_per_server` is set, at most that many configs using
+    the same server are polled at once, others wait (without occupying
+    a worker) until a poll of the server finishes.
+    """
+
+    def __init__(self, logger, max_workers, max_polls_per_server=0, scheduler=None):
+        self.logger = logger
+        self.max_workers = max_workers
+        self.max_polls_per_server = max_polls_per_server
+        self.scheduler = scheduler or get_scheduler()
+        self._queue = Queue()
+        self._lock = Lock()
+        self._timers = {}
+        self._workers = []
+        self._stopped = False
+        # Number of running polls and waiting virts for each server
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(deque)
+
+    @staticmethod
+    def server_of(virt):
+        """
+        Return host name of the server polled by `virt` or None if
+        the backend doesn't use a server.
+        """
+        server = virt.config.get('server', None)
+        if not server:
+            return None
+        server = six.text_type(server)
+        if '://' in server:
+            server = urlparse(server).hostname or server
+        return server.lower()
+
+    def add(self, virt):
+        """
+        Add `virt` to the pool, it will be polled as soon as a worker is free
+        and its `start_delay` elapses.
+        """
+        if virt.start_delay > 0:
+            self._schedule(virt, virt.start_delay)
+        else:
+            self._queue.put(virt)
+
+    def start(self):
+        for index in range(self.max_workers):
+            worker = Thread(target=self._work, name='virt-who-worker-%d' % index)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            virt = self._queue.get()
+            if virt is None:
+                return
+            if virt.is_terminated():
+                continue
+            server = self.server_of(virt) if self.max_polls_per_server else None
+            if not self._acquire(virt, server):
+                continue
+            try:
+                wait_time = virt.poll()
+            finally:
+                self._release(server)
+            if not virt.is_terminated():
+                self._schedule(virt, wait_time)
+
+    def _acquire(self, virt, server):
+        """
+        Reserve a poll of `server` for `virt`. If the server is already
+        polled `max_polls_per_server` times, the virt waits and False
+        is returned.
+        """
+        if server is None:
+            return True
+        with self._lock:
+            if self._running[server] >= self.max_polls_per_server:
+                self._waiting[server].append(virt)
+                return False
+            self._running[server] += 1
+            return True
+
+    def _release(self, server):
+        if server is None:
+            return
+        with self._lock:
+            self._running[server] -= 1
+            if self._waiting[server]:
+                self._queue.put(self._waiting[server].popleft())
+
+    def _schedule(self, virt, wait_time):
+        with self._lock:
+            if self._stopped:
+                return
+            self._timers[virt] = self.scheduler.call_later(wait_time, lambda: self._queue.put(virt))
+
+    def stop(self):
+        """
+        Stop scheduling of the virts and wait until running polls finish.
+        """
+        with self._lock:
+            self._stopped = True
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+class LoginLimiter(object):
+    """
+    Limits the number of virt backends doing their first poll at once.
+
+    The first poll logs in to the server and gathers complete inventory,
+    which is the most expensive part; when all the backends start at the
+    same time, the servers (and virt-who) get the load all at once.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._running = 0
+        self._condition = Condition()
+
+    def acquire(self, virt):
+        """
+        Block until a slot is free or `virt` is terminated.
+
+        @return: True if the slot was acquired and must be released
+        @rtype: bool
+        """
+        with self._condition:
+            while self._running >= self.limit:
+                if virt.is_terminated():
+                    return False
+                self._condition.wait()
+            self._running += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._running -= 1
+            # Some of the waiting virts might be terminated, wake them all
+            self._condition.notify_all()
+
+    def interrupt(self):
+        """
+        Wake up all waiting virts, so the terminated ones could give up.
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+
+class AdaptiveInterval(object):
+    """
+    Interval of a polling source that follows how often its report changes.
+
+    After a change, the source is polled every `min_interval` seconds, so
+    following changes (e.g. a migration of many guests) are reported soon.
+    Every `STABLE_POLLS` polls without a change, the interval is doubled,
+    up to `max_interval` seconds.
+    """
+    STABLE_POLLS = 3
+
+    def __init__(self, interval, min_interval, max_interval):
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.current = interval
+        self._last_hash = None
+        self._stable_polls = 0
+
+    def observe(self, report_hash):
+        """
+        Update the interval with the hash of the newly gathered report.
+        """
+        if self._last_hash is None:
+            self._last_hash = report_hash
+            return
+        if report_hash != self._last_hash:
+            self._last_hash = report_hash
+            self._stable_polls = 0
+            self.current = self.min_interval
+            return
+        self._stable_polls += 1
+        if self._stable_polls >= self.STABLE_POLLS:
+            self._stable_polls = 0
+            self.current = min(self.current * 2, self.max_interval)
+
+
+def start_delay(key, splay):
+    """
+    Return delay in range [0, splay) seconds derived from `key`, it's the
+    same in every run, so the polls stay spread after restart.
+
+    @param key: unique name of the thread (including the host virt-who runs on)
+    @type key: str
+    """
+    if splay <= 0:
+        return 0
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return splay * int(digest[:13], 16) / float(16 ** 13)
+
+
 info_to_destination_class = {
     Satellite5DestinationInfo: Satellite5DestinationThread,
     Satellite6DestinationInfo: DestinationThread,
@@ -75,6 +75,7 @@ class Xen(virt.Virt):
     # if no events occur the call to event_from will return after this interval
     # if events do occur the call will return sooner
     EVENT_FROM_TIMEOUT = 30.0
+    event_driven = True
 
     # if the token parameter is set to an empty string, the return from event_from will contain all
     # events that have occurred, you probably want to use this the first time you use event_from
@@ -237,7 +238,9 @@ class Xen(virt.Virt):
                 events = []
 
             if initial or len(events) > 0 or delta > 0:
+                start_time = time()
                 assoc = self.getHostGuestMapping()
+                self._observe_get_data(start_time)
                 self._send_data(virt.HostGuestAssociationReport(self.config, assoc))
                 initial = False
 
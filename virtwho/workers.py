@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+Running virt backends in worker processes.
+
+Source configs are split among several processes, so parsing of large
+reports doesn't compete for one GIL. Reports gathered by the workers are
+sent to the parent process and stored in its datastore, destinations
+stay in the parent. Changes of the metrics recorded by the workers are
+sent too, they are exported by the parent.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import multiprocessing
+import os
+import signal
+import time
+from threading import Event, Lock, Thread
+
+from virtwho import log, metrics
+from virtwho.scheduler import get_scheduler, reset_scheduler
+from virtwho.virt import (DomainListReport, ErrorReport, Guest,
+                          HostGuestAssociationReport, Hypervisor)
+
+__all__ = ['WorkerProcess', 'encode_report', 'decode_report']
+
+# How often the worker sends changes of the metrics (in seconds), they're
+# sent also together with every report
+METRICS_INTERVAL = 15
+
+
+def encode_report(report):
+    """
+    Return compact representation of the report made of tuples and
+    plain values. The config is not included, the receiving side has
+    the same configs. Host filters are already applied.
+    """
+    if isinstance(report, HostGuestAssociationReport):
+        return ('hosts', [
+            (hypervisor.hypervisorId, hypervisor.name,
+             dict(hypervisor.facts) if hypervisor.facts is not None else None,
+             [(guest.uuid, guest.virtWhoType, guest.state) for guest in hypervisor.guestIds])
+            for hypervisor in report.association['hypervisors']
+        ], report.exclude_hosts, report.filter_hosts)
+    if isinstance(report, DomainListReport):
+        return ('domains', [(guest.uuid, guest.virtWhoType, guest.state) for guest in report.guests],
+                report.hypervisor_id)
+    if isinstance(report, ErrorReport):
+        return ('error',)
+    raise TypeError("Unsupported report type: %s" % type(report).__name__)
+
+
+def decode_report(config, data):
+    """
+    Create report for `config` from the representation returned by `encode_report`.
+    """
+    kind = data[0]
+    if kind == 'hosts':
+        hypervisors = [
+            Hypervisor(hypervisor_id, [Guest(*guest) for guest in guests], name=name, facts=facts)
+            for hypervisor_id, name, facts, guests in data[1]
+        ]
+        return HostGuestAssociationReport(config, {'hypervisors': hypervisors},
+                                          exclude_hosts=data[2], filter_hosts=data[3])
+    if kind == 'domains':
+        return DomainListReport(config, [Guest(*guest) for guest in data[1]], hypervisor_id=data[2])
+    if kind == 'error':
+        return ErrorReport(config)
+    raise ValueError("Unknown report kind: %s" % kind)
+
+
+class _Channel(object):
+    """
+    Sending end of the pipe from a worker process to the parent, it can
+    be used from several threads.
+
+    It behaves like a datastore for the virt backends and like a queue
+    for `log.QueueHandler`.
+    """
+
+    def __init__(self, connection, registry=metrics.REGISTRY):
+        self._connection = connection
+        self._lock = Lock()
+        self._registry = registry
+        # Values of the metrics that the parent already has
+        self._sent_metrics = registry.snapshot()
+        self._closed = False
+
+    def _send(self, message):
+        with self._lock:
+            self._connection.send(message)
+
+    def put(self, key, report):
+        self._send(('report', key, encode_report(report), report.trace_ids))
+        self.send_metrics()
+
+    def send_metrics(self):
+        """
+        Send changes of the metrics since the previous call.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            snapshot = self._registry.snapshot()
+            changes = self._registry.changes(self._sent_metrics, snapshot)
+            if changes:
+                self._connection.send(('metrics', changes))
+            self._sent_metrics = snapshot
+
+    def put_nowait(self, record):
+        self._send(('log', record))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._connection.close()
+
+
+class WorkerProcess(object):
+    """
+    Process running virt backends for a shard of source configs.
+
+    It has the same interface as `IntervalThread` regarding termination,
+    so `Executor` can wait for it and stop it like for the virt threads.
+    """
+
+    def __init__(self, executor, index, configs, datastore):
+        """
+        @param executor: executor that starts the process, it's used to
+                         create and run the virt backends in the child
+        @param index: number of the worker
+        @param configs: list of (name, config) tuples of the shard
+        @param datastore: datastore where the reports are stored
+        """
+        self.executor = executor
+        self.index = index
+        self.configs = configs
+        self.datastore = datastore
+        self.process = None
+        self._receiver = None
+        self._terminated = Event()
+
+    @property
+    def name(self):
+        return 'virt-who-worker-%d' % self.index
+
+    @property
+    def ident(self):
+        return self.process.pid if self.process is not None else None
+
+    def start(self):
+        # Fork is required, configs and loggers are inherited by the child
+        context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        reader, writer = context.Pipe(duplex=False)
+        self.process = context.Process(target=self._run_child, args=(writer,), name=self.name)
+        self.process.daemon = True
+        self.process.start()
+        writer.close()
+        self._receiver = Thread(target=self._receive, args=(reader,), name='%s-receiver' % self.name)
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    def _receive(self, reader):
+        """
+        Store reports and log records sent by the worker, until it exits.
+        """
+        configs = dict(self.configs)
+        try:
+            while True:
+                try:
+                    message = reader.recv()
+                except EOFError:
+                    break
+                if message[0] == 'report':
+                    key, data = message[1], message[2]
+                    report = decode_report(configs[key], data)
+                    report.trace_ids = tuple(message[3])
+                    report.stored_time = time.time()
+                    self.datastore.put(key, report.freeze())
+                elif message[0] == 'log':
+                    log.getQueueLogger().queue.put_nowait(message[1])
+                elif message[0] == 'metrics':
+                    metrics.REGISTRY.apply_changes(message[1])
+        finally:
+            reader.close()
+            self._terminated.set()
+
+    def _run_child(self, writer):
+        """
+        Main function of the worker process.
+        """
+        # Reload and termination are handled by the parent, which stops
+        # the worker using SIGTERM
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Threads of the parent don't exist in the child
+        reset_scheduler()
+        self.executor.virts = []
+        self.executor.destinations = []
+        self.executor.pool = None
+        channel = _Channel(writer)
+        logger = self.executor.logger
+        level = min([handler.level for handler in logger.handlers] or [0])
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(log.QueueHandler(channel, level))
+
+        def terminate(signum, frame):
+            self.executor.terminate_event.set()
+            for virt in self.executor.virts:
+                virt.stop()
+        signal.signal(signal.SIGTERM, terminate)
+
+        def send_metrics():
+            channel.send_metrics()
+            get_scheduler().call_later(METRICS_INTERVAL, send_metrics)
+        get_scheduler().call_later(METRICS_INTERVAL, send_metrics)
+
+        exit_code = 0
+        try:
+            self.executor.virts = self.executor._create_virt_backends(self.configs, channel)
+            self.executor._start_virts()
+            self.executor.wait_on_threads(self.executor.virts)
+            self.executor.stop_threads()
+        except Exception:
+            logger.exception("Worker %d failed:", self.index)
+            exit_code = 1
+        finally:
+            channel.send_metrics()
+            channel.close()
+        # Don't run cleanup inherited from the parent (atexit handlers)
+        os._exit(exit_code)
+
+    def is_terminated(self):
+        return self._terminated.is_set()
+
+    def wait_terminated(self, timeout=None):
+        self._terminated.wait(timeout)
+        return self.is_terminated()
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+
+    def join(self, timeout=None):
+        if self.process is not None:
+            self.process.join(timeout)
+        if self._receiver is not None:
+            self._receiver.join(timeout)